@@ -1,13 +1,22 @@
 #%%
+import os
+import time
+import hmac
 from typing import Union
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Header, HTTPException, Query
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 import numpy as np
 import pandas as pd
 import polyline
 from geopy.distance import geodesic
 import location
 import emission
+import metrics
+import live
+from timetable import Timetable
+from serialize import FastJSONResponse, round_coords
 
 #%%
 app = FastAPI()
@@ -25,6 +34,25 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    timings = metrics.start_request()
+    t0 = time.perf_counter()
+
+    response = await call_next(request)
+
+    route_ = request.scope.get("route")
+    handler = route_.path if route_ is not None else "unmatched"
+    metrics.request_seconds.observe(
+        time.perf_counter() - t0, handler, request.method, str(response.status_code)
+    )
+
+    if metrics.server_timing and timings:
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings)
+
+    return response
+
+
 #%%
 cities = pd.read_csv("data/airports.csv").drop_duplicates(subset=["city"])
 flight_routes = pd.read_csv("data/flight_routes.csv")
@@ -32,6 +60,24 @@ car_routes = pd.read_parquet("data/car_routes.parquet")
 bus_routes = pd.read_parquet("data/bus_routes.parquet")
 train_routes = pd.read_parquet("data/train_routes.parquet")
 
+train_profiles = (
+    pd.read_parquet("data/train_profiles.parquet")
+    if os.path.exists("data/train_profiles.parquet")
+    else None
+)
+
+# live routing for city pairs missing from the precomputed tables
+live_routers = {}
+for mode, radius in [("train", 5), ("bus", 10)]:
+    ftimetable = f"data/{mode}_timetable.npz"
+    if os.path.exists(ftimetable):
+        live_routers[mode] = live.LiveRouter(
+            Timetable.load(ftimetable),
+            cities,
+            radius=radius,
+            store=f"data/{mode}_routes_live.jsonl",
+        )
+
 
 #%%
 def get_bearing(lat1, lon1, lat2, lon2):
@@ -57,6 +103,13 @@ def read_item(item_id: int, q: Union[str, None] = None):
     return {"item_id": item_id, "q": q}
 
 
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.get("/cities")
 def list_cities():
     return cities.city.sort_values().values.tolist()
@@ -75,10 +128,29 @@ def get_destinations(origin: str):
 
 
 @app.get("/route/{origin}/{destination}")
-def route(origin: str, destination: str):
+def route(
+    origin: str,
+    destination: str,
+    fast: bool = False,
+    precision: Union[int, None] = None,
+    uncertainty: bool = False,
+    zoom: Union[int, None] = None,
+):
+    """Compare routes between two cities for all transport modes.
+
+    Set `fast=true` to render the response with orjson, and `precision` to
+    round route coordinates to a number of decimals (5 decimals is ~1 m).
+    With `uncertainty=true`, the summary also has 5th, 50th and 95th
+    percentiles of CO2 from Monte Carlo sampling. `zoom` selects the
+    simplified geometry tier of car and bus routes for that map zoom level.
+    """
+    co2_percentiles = {}
+
     q = "city_origin==@origin and city_destination==@destination"
 
-    flights = flight_routes.query(q)
+    with metrics.stage("query", "flight"):
+        flights = flight_routes.query(q)
+
     if flights.shape[0] == 0:
         flight_route = []
         flight_time = None
@@ -87,75 +159,130 @@ def route(origin: str, destination: str):
         flight = flights.iloc[0]
         flight_time = int(flight.duration)
 
-        flight_emission = emission.Flight(flight.typecode)
-        flight_co2 = flight_emission.co2(flight.distance)
+        with metrics.stage("emission", "flight"):
+            flight_emission = emission.Flight(flight.typecode)
+            flight_co2 = flight_emission.co2(flight.distance)
+            if uncertainty:
+                co2_percentiles["flight"] = flight_emission.co2_percentiles(
+                    flight.distance
+                )
+
+        with metrics.stage("geometry", "flight"):
+            origin_coords = flight[
+                ["airport_latitude_origin", "airport_longitude_origin"]
+            ]
+            destination_coords = flight[
+                ["airport_latitude_destination", "airport_longitude_destination"]
+            ]
+
+            flight_route = []
+
+            # Calculate great-circle path
+            bearing = get_bearing(*origin_coords, *destination_coords)
+            total_distance = geodesic(origin_coords, destination_coords).miles
+
+            # Calculate points along the great-circle path
+            for i in np.linspace(0, 1, 10):
+                distance = i * total_distance
+                point = geodesic(miles=distance).destination(origin_coords, bearing)
+                flight_route.append((point.latitude, point.longitude))
+
+    with metrics.stage("query", "car"):
+        cars = car_routes.query(q)
 
-        origin_coords = flight[["airport_latitude_origin", "airport_longitude_origin"]]
-        destination_coords = flight[
-            ["airport_latitude_destination", "airport_longitude_destination"]
-        ]
-
-        flight_route = []
-
-        # Calculate great-circle path
-        bearing = get_bearing(*origin_coords, *destination_coords)
-        total_distance = geodesic(origin_coords, destination_coords).miles
-
-        # Calculate points along the great-circle path
-        for i in np.linspace(0, 1, 10):
-            distance = i * total_distance
-            point = geodesic(miles=distance).destination(origin_coords, bearing)
-            flight_route.append((point.latitude, point.longitude))
-
-    cars = car_routes.query(q)
     if cars.shape[0] == 0:
-        car_route = []
+        car_route = car_route_display = []
         car_time = None
     else:
         car = cars.iloc[0]
-        car_route = polyline.decode(car.coords)
+
+        with metrics.stage("decode", "car"):
+            car_route = polyline.decode(car.coords)
+
+            # countries are always attributed on the same geometry
+            car_column = location.tier_column(car.index, zoom)
+            if car_column == "coords":
+                car_route_display = car_route
+            else:
+                car_route_display = polyline.decode(car[car_column])
+
         car_time = int(car.duration)
 
-        car_emission = emission.Car("petrol")
-        car_co2_2pax_petrol = car_emission.co2(car.distance)
+        with metrics.stage("geometry", "car"):
+            car_countries = location.route_countries(car_route)
 
-        car_emission = emission.Car("diesel")
-        car_co2_2pax_diesel = car_emission.co2(car.distance)
+        with metrics.stage("emission", "car"):
+            car_emission = emission.Car("petrol")
+            car_co2_2pax_petrol = car_emission.co2(car.distance)
 
-        car_emission = emission.Car("electric")
-        car_co2_2pax_electric = car_emission.co2(
-            car.distance, location.route_countries(car_route)
-        )
+            car_emission = emission.Car("diesel")
+            car_co2_2pax_diesel = car_emission.co2(car.distance)
+
+            car_emission = emission.Car("electric")
+            car_co2_2pax_electric = car_emission.co2(car.distance, car_countries)
+
+            if uncertainty:
+                for car_type in ["diesel", "petrol", "electric"]:
+                    co2_percentiles[f"car_{car_type}"] = emission.Car(
+                        car_type
+                    ).co2_percentiles(car.distance, car_countries)
+
+    with metrics.stage("query", "bus"):
+        buses = bus_routes.query(q).sort_values("distance")
+
+    if buses.shape[0] == 0 and "bus" in live_routers:
+        with metrics.stage("live", "bus"):
+            buses = live_routers["bus"].routes(origin, destination)
 
-    buses = bus_routes.query(q).sort_values("distance")
     if buses.shape[0] == 0:
         bus_route = []
         bus_time = None
         bus_co2 = []
     else:
         bus = buses.iloc[0]
-        bus_route = polyline.decode(bus.coords)
+
+        with metrics.stage("decode", "bus"):
+            bus_route = polyline.decode(bus[location.tier_column(bus.index, zoom)])
+
         bus_time = int(bus.duration)
 
-        bus_emission = emission.Bus()
-        bus_co2 = bus_emission.co2(bus.distance)
+        with metrics.stage("emission", "bus"):
+            bus_emission = emission.Bus()
+            bus_co2 = bus_emission.co2(bus.distance)
+            if uncertainty:
+                co2_percentiles["bus"] = bus_emission.co2_percentiles(bus.distance)
+
+    with metrics.stage("query", "train"):
+        trains = train_routes.query(q)
+
+    if trains.shape[0] == 0 and "train" in live_routers:
+        with metrics.stage("live", "train"):
+            trains = live_routers["train"].routes(origin, destination)
 
-    trains = train_routes.query(q)
     if trains.shape[0] == 0:
         train_route = []
         train_time = None
         train_co2 = []
     else:
         train = trains.iloc[0]
-        train_route = polyline.decode(train.coords)
+
+        with metrics.stage("decode", "train"):
+            train_route = polyline.decode(train.coords)
+
         train_time = int(train.duration)
 
-        train_emission = emission.Train()
-        train_co2 = train_emission.co2(
-            train.distance, location.route_countries(train_route)
-        )
+        with metrics.stage("geometry", "train"):
+            train_countries = location.route_countries(train_route)
 
-    return {
+        with metrics.stage("emission", "train"):
+            train_emission = emission.Train()
+            train_co2 = train_emission.co2(train.distance, train_countries)
+            if uncertainty:
+                co2_percentiles["train"] = train_emission.co2_percentiles(
+                    train.distance, train_countries
+                )
+
+    result = {
         "routes": {
             "flight": {
                 "route": flight_route,
@@ -163,7 +290,7 @@ def route(origin: str, destination: str):
             },
             "train": {"route": train_route, "info": ""},
             "bus": {"route": bus_route, "info": ""},
-            "car": {"route": car_route, "info": ""},
+            "car": {"route": car_route_display, "info": ""},
         },
         "summary": [
             {"mode": "flight", "CO2": flight_co2, "Time": flight_time},
@@ -179,6 +306,69 @@ def route(origin: str, destination: str):
         ],
     }
 
+    if uncertainty:
+        keys = ["flight", "train", "bus", "car_diesel", "car_petrol", "car_electric"]
+        for summary, key in zip(result["summary"], keys):
+            summary["CO2_percentiles"] = co2_percentiles.get(key, [])
+
+    # serialise here rather than in FastAPI, so it can be timed as a stage
+    with metrics.stage("serialize"):
+        if fast:
+            return FastJSONResponse(result, precision=precision)
+
+        if precision is not None:
+            result = round_coords(result, precision, as_list=True)
+
+        return JSONResponse(jsonable_encoder(result))
+
+
+@app.get("/profile/{origin}/{destination}")
+def train_profile(origin: str, destination: str, window: int = Query(60, gt=0)):
+    """Shortest train journey per departure time window (minutes of the day)."""
+    q = "city_origin==@origin and city_destination==@destination"
+
+    profile = None
+    if train_profiles is not None and window == 60:
+        profile = train_profiles.query(q)
+
+    if (profile is None or profile.shape[0] == 0) and "train" in live_routers:
+        with metrics.stage("profile", "train"):
+            profile = live_routers["train"].profile(origin, destination, window)
+
+    if profile is None or profile.shape[0] == 0:
+        return []
+
+    return (
+        profile[["window_start", "departure", "arrival", "duration", "transfers"]]
+        .round(1)
+        .to_dict(orient="records")
+    )
+
+
+# token for POST /emission/reload, which is only allowed from the server
+# itself when no token is set
+reload_token = os.environ.get("COPULA_RELOAD_TOKEN")
+
+
+@app.post("/emission/reload")
+def reload_emission_factors(
+    request: Request, x_reload_token: Union[str, None] = Header(default=None)
+):
+    """Load emission_factors.json again, without restarting the server."""
+    if reload_token is not None:
+        allowed = x_reload_token is not None and hmac.compare_digest(
+            x_reload_token, reload_token
+        )
+    else:
+        client = request.client.host if request.client is not None else None
+        allowed = client in ("127.0.0.1", "::1", "localhost")
+
+    if not allowed:
+        raise HTTPException(status_code=403, detail="Reload not allowed")
+
+    factors = emission.reload_factors()
+    return {"version": factors.version, "path": factors.path}
+
 
 #%%
 if "__name__" == "__main__":
@@ -0,0 +1,144 @@
+import os
+import json
+import pickle
+import inspect
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+
+cache_dir = "data/cache"
+
+# bump to invalidate all cached artifacts, e.g. after a change of format
+cache_version = 1
+
+_hash_lock = threading.Lock()
+
+
+def file_hash(path, size=2**20):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def cached_file_hash(path, root=cache_dir):
+    """File hash, remembered by size and modification time so large inputs
+    are only read again when they change."""
+    fmemo = os.path.join(root, "file_hashes.json")
+    stat = os.stat(path)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    key = os.path.abspath(path)
+
+    with _hash_lock:
+        memo = {}
+        if os.path.exists(fmemo):
+            with open(fmemo) as f:
+                memo = json.load(f)
+
+        if key in memo and memo[key]["stamp"] == stamp:
+            return memo[key]["sha256"]
+
+        memo[key] = dict(stamp=stamp, sha256=file_hash(path))
+        os.makedirs(root, exist_ok=True)
+        atomic_write(fmemo, lambda f: f.write(json.dumps(memo).encode()))
+
+    return memo[key]["sha256"]
+
+
+def input_hash(value, root=cache_dir):
+    """Hash of a stage input: a file path, a DataFrame or an array."""
+    if isinstance(value, str) and os.path.exists(value):
+        return cached_file_hash(value, root)
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        hashes = pd.util.hash_pandas_object(value, index=True).values
+        return hashlib.sha256(hashes.tobytes()).hexdigest()
+    if isinstance(value, np.ndarray):
+        return hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()
+    return hashlib.sha256(repr(value).encode()).hexdigest()
+
+
+def code_hash(obj):
+    """Hash of the source of a function, class or module."""
+    try:
+        source = inspect.getsource(obj)
+    except (OSError, TypeError):
+        # defined interactively, fall back on the compiled code, or on the
+        # object itself so that the artifact is never reused
+        code = getattr(obj, "__code__", None)
+        if code is None:
+            source = repr(obj)
+        else:
+            source = code.co_code.hex() + repr(code.co_consts)
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def artifact_key(stage, inputs=(), params=None, code=(), root=cache_dir):
+    """Content address of a stage result, from its inputs, parameters and
+    the source code computing it."""
+    sha = hashlib.sha256(f"{stage}:{cache_version}".encode())
+    for value in inputs:
+        sha.update(input_hash(value, root).encode())
+    for obj in code:
+        sha.update(code_hash(obj).encode())
+    for name, value in sorted((params or {}).items()):
+        sha.update(f"{name}={value!r}".encode())
+    return sha.hexdigest()[:24]
+
+
+def atomic_write(path, write):
+    """Write to a temporary file first, so readers never see half a file."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def save(obj, path, fmt):
+    if fmt == "parquet":
+        atomic_write(path, lambda f: obj.to_parquet(f, index=False))
+    elif fmt == "npz":
+        atomic_write(path, lambda f: np.savez(f, **obj))
+    else:
+        atomic_write(path, lambda f: pickle.dump(obj, f, protocol=5))
+
+
+def load(path, fmt):
+    if fmt == "parquet":
+        return pd.read_parquet(path)
+    if fmt == "npz":
+        with np.load(path, allow_pickle=False) as f:
+            return {k: f[k] for k in f.files}
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def cached(
+    stage, compute, inputs=(), params=None, code=(), fmt="pickle", root=cache_dir
+):
+    """Result of `compute()`, from the cache when a result for the same
+    inputs, parameters and code has been stored before.
+
+    `inputs` are file paths (hashed by content), DataFrames or arrays;
+    `params` are the stage parameters. `code` are the functions, classes
+    or modules the stage runs, whose source is part of the key along with
+    `compute` itself, so that changing them invalidates the artifact.
+    Formats are "parquet" for a DataFrame, "npz" for a dict of arrays, and
+    "pickle" for anything else, such as graphs and KD-trees. Set `root` to
+    None to disable the cache.
+    """
+    if root is None:
+        return compute()
+
+    key = artifact_key(stage, inputs, params, [compute, *code], root)
+    path = os.path.join(root, f"{stage}_{key}.{fmt}")
+
+    if os.path.exists(path):
+        return load(path, fmt)
+
+    result = compute()
+    os.makedirs(root, exist_ok=True)
+    save(result, path, fmt)
+
+    return result
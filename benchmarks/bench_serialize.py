@@ -0,0 +1,72 @@
+# %%
+import os
+import sys
+import json
+import timeit
+import numpy as np
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import serialize
+
+# typical number of route points per mode
+route_sizes = {"flight": 10, "train": 60, "bus": 800, "car": 5000}
+
+
+def synthetic_route(n, seed=0):
+    """Random walk of (lat, lon) tuples, as returned by polyline.decode."""
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0, 0.01, size=(n, 2))
+    coords = np.array([48.0, 8.0]) + np.cumsum(steps, axis=0)
+    return [tuple(c) for c in coords.tolist()]
+
+
+def synthetic_response(mode, n):
+    return {
+        "routes": {mode: {"route": synthetic_route(n), "info": ""}},
+        "summary": [{"mode": mode, "CO2": (120, 240), "Time": 300}],
+    }
+
+
+def stdlib_dumps(content):
+    # same path as fastapi.responses.JSONResponse
+    return json.dumps(
+        jsonable_encoder(content),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def bench(modes=route_sizes, precisions=(None, 5), repeat=20):
+    results = []
+
+    for mode, n in modes.items():
+        content = synthetic_response(mode, n)
+
+        encoders = {"stdlib": stdlib_dumps}
+        for precision in precisions:
+            name = "orjson" if precision is None else f"orjson (precision={precision})"
+            encoders[name] = lambda c, p=precision: serialize.dumps(c, p)
+
+        for name, dumps in encoders.items():
+            seconds = min(timeit.repeat(lambda: dumps(content), number=1, repeat=repeat))
+            results.append(
+                dict(
+                    mode=mode,
+                    points=n,
+                    encoder=name,
+                    bytes=len(dumps(content)),
+                    time_ms=round(seconds * 1000, 3),
+                )
+            )
+
+    return pd.DataFrame(results)
+
+
+# %%
+if __name__ == "__main__":
+    print(bench().to_string(index=False))
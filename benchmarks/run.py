@@ -0,0 +1,325 @@
+"""Benchmark the pipelines and the API on synthetic data at several scales.
+
+    python benchmarks/run.py small medium
+
+Each scale is run in a temporary working directory with a generated `data/`
+folder. A profiler report (wall time, CPU time, peak RSS and throughput per
+benchmark) is written to benchmarks/results/, which can be compared between
+runs with `python profiler.py baseline.json current.json`.
+"""
+
+# %%
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import importlib
+import numpy as np
+import pandas as pd
+import polyline
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(__file__))
+
+import synthetic
+from profiler import StageProfiler
+
+scales = {
+    "small": dict(n_cities=10, stops_per_city=2, n_lines=10, n_trips=100, n_pairs=20),
+    "medium": dict(n_cities=30, stops_per_city=3, n_lines=40, n_trips=1000, n_pairs=100),
+    "large": dict(n_cities=80, stops_per_city=5, n_lines=120, n_trips=5000, n_pairs=300),
+}
+
+
+def prepare(n_cities, stops_per_city, n_lines, n_trips, n_days=7, seed=0):
+    airports = synthetic.write_data_dir(".", n_cities, seed)
+
+    feed = synthetic.gen_gtfs(
+        airports, stops_per_city, n_lines, n_trips, n_days, seed=seed
+    )
+    synthetic.write_gtfs(feed, "data/source/train/gtfs_synthetic")
+
+    for i, company in enumerate(["flixbus", "alsa", "blabla"]):
+        feed = synthetic.gen_gtfs(
+            airports,
+            stops_per_city,
+            n_lines,
+            n_trips // 2,
+            n_days,
+            speed=70,
+            agency=company,
+            seed=seed + i + 1,
+        )
+        synthetic.write_gtfs(feed, f"data/gtfs/bus/gtfs_{company}")
+
+    return airports
+
+
+def run_scale(name, n_pairs, n_queries=200, seed=0, **kwargs):
+    profiler = StageProfiler(f"bench_{name}")
+
+    with profiler.stage("prepare_fixtures"):
+        airports = prepare(seed=seed, **kwargs)
+
+    # location reads data/ on import, so import after the fixtures are written
+    import location
+    import emission
+    import process_train
+    import process_bus
+    import live
+    import validate
+    import geocode
+    from timetable import Timetable
+    from service_calendar import ServiceCalendar, select_trips
+
+    with profiler.stage("city_pairs") as s:
+        city_pairs, proj = location.gen_city_pairs(airports)
+        s.rows = city_pairs.shape[0]
+
+    # geocoding against a local stub, first with an empty cache, then cached
+    queries = (airports.city + ", " + airports.country).tolist()
+    stub = geocode.StubGeocoder(
+        dict(zip(queries, zip(airports.city_latitude, airports.city_longitude))),
+        delay=0.01,
+    )
+    geocoder = geocode.Geocoder(stub, rate=100, burst=10, store="data/geocode.jsonl")
+    for variant in ["geocode", "geocode_cached"]:
+        with profiler.stage(variant) as s:
+            geocoder.geocode_many(queries, progress=False)
+            s.rows = len(queries)
+    assert len(stub.calls) == len(set(queries))
+
+    sample_pairs = city_pairs.sample(
+        min(n_pairs, city_pairs.shape[0]), random_state=seed
+    )
+
+    # train
+    with profiler.stage("train_gtfs_load") as s:
+        gtfs_routes = process_train.generate_gtfs_routes()
+        s.rows = gtfs_routes.shape[0]
+
+    with profiler.stage("train_stop_merge") as s:
+        gtfs_routes = process_train.process_gtfs_routes(gtfs_routes, proj)
+        s.rows = gtfs_routes.shape[0]
+
+    with profiler.stage("train_service_date") as s:
+        calendar = ServiceCalendar.load("data/train_calendar.npz")
+        travel_date = calendar.busiest_dates()
+        day_routes = select_trips(gtfs_routes, calendar, travel_date, overnight=False)
+        trip_routes = select_trips(gtfs_routes, calendar, travel_date, n_days=2)
+        s.rows = day_routes.shape[0] + trip_routes.shape[0]
+
+    with profiler.stage("train_graph_build") as s:
+        G, edges, nodes = process_train.create_graph(day_routes)
+        s.rows = edges.shape[0]
+
+    rng = np.random.default_rng(seed)
+    node_ids = list(G.nodes)
+    queries = rng.choice(node_ids, size=(n_queries, 2))
+
+    with profiler.stage("train_search_bounds") as s:
+        bounds = process_train.SearchBounds(G, n_landmarks=8)
+        s.rows = G.number_of_nodes()
+
+    for variant, b in [("dijkstra", None), ("astar", bounds)]:
+        with profiler.stage(f"train_shortest_path_{variant}") as s:
+            stats = dict(settled=0)
+            for o, d in queries:
+                process_train.shortest_path(G, o, d, bounds=b, stats=stats)
+            s.rows = n_queries
+            s.settled = stats["settled"]
+
+    with profiler.stage("train_city_routes_unpruned") as s:
+        unpruned_routes = process_train.create_train_routes(
+            G, nodes, sample_pairs, bounds, prune=False
+        )
+        s.rows = sample_pairs.shape[0]
+
+    with profiler.stage("train_city_routes") as s:
+        train_routes = process_train.create_train_routes(
+            G, nodes, sample_pairs, bounds
+        )
+        s.rows = sample_pairs.shape[0]
+
+    # pruning only drops dominated stops, so the routes are the same
+    pd.testing.assert_frame_equal(train_routes, unpruned_routes)
+
+    with profiler.stage("train_city_routes_parallel") as s:
+        parallel_routes = process_train.create_train_routes(
+            G, nodes, sample_pairs, bounds, processes=os.cpu_count()
+        )
+        s.rows = sample_pairs.shape[0]
+
+    # the merge is deterministic, so both modes give the same table
+    pd.testing.assert_frame_equal(
+        train_routes.reset_index(drop=True), parallel_routes, check_dtype=False
+    )
+
+    with profiler.stage("train_penalty_sweep") as s:
+        sweep = process_train.sweep_penalties(
+            G,
+            nodes,
+            sample_pairs,
+            transfer_penalties=(5, 10),
+            time_penalty_factors=(0.05, 0.1),
+            bounds=bounds,
+        )
+        s.rows = sample_pairs.shape[0] * 4
+
+    # the default penalties of the sweep find the same routes
+    report = process_train.sweep_report(sweep, baseline=(10, 0.1)).set_index(
+        ["transfer_penalty", "time_penalty_factor"]
+    )
+    assert report.loc[(10, 0.1), "routes"] == train_routes.shape[0]
+    assert report.loc[(10, 0.1), "routes_changed"] == 0
+
+    with profiler.stage("train_validation") as s:
+        validate.validate_routes(train_routes, "train", outdir=None)
+        s.rows = train_routes.shape[0]
+
+    with profiler.stage("train_timetable_build") as s:
+        timetable = Timetable.from_stop_times(trip_routes, stop_column="uni_stop_id")
+        s.rows = timetable.n_connections
+
+    router = live.LiveRouter(timetable, airports, radius=5, cache_size=0)
+
+    with profiler.stage("train_live_routes") as s:
+        for cp in sample_pairs.itertuples():
+            router.search(cp.city_origin, cp.city_destination)
+        s.rows = sample_pairs.shape[0]
+
+    with profiler.stage("train_profiles") as s:
+        process_train.create_train_profiles(timetable, sample_pairs, proj)
+        s.rows = sample_pairs.shape[0]
+
+    # bus, with OSRM replaced by an offline stand-in
+    location.get_osm_route = synthetic.fake_osm_route
+
+    with profiler.stage("bus_gtfs_load") as s:
+        gtfs_bus_routes = process_bus.generate_gtfs_routes()
+        s.rows = gtfs_bus_routes.shape[0]
+
+    with profiler.stage("bus_graph_build") as s:
+        G_bus, edges_bus, nodes_bus = process_bus.create_graph(gtfs_bus_routes)
+        s.rows = edges_bus.shape[0]
+
+    with profiler.stage("bus_city_routes") as s:
+        bus_routes = process_bus.create_routes(
+            G_bus, gtfs_bus_routes, sample_pairs, proj
+        )
+        s.rows = sample_pairs.shape[0]
+
+    # route geometry and emissions
+    car_routes = synthetic.gen_line_routes(sample_pairs, seed=seed)
+    decoded = [polyline.decode(c) for c in car_routes.coords]
+
+    with profiler.stage("route_countries") as s:
+        countries = [location.route_countries(c) for c in decoded]
+        s.rows = len(decoded)
+
+    distances = rng.uniform(50, 2000, 10_000)
+
+    with profiler.stage("emission_ground") as s:
+        train, bus, car = emission.Train(), emission.Bus(), emission.Car("electric")
+        for i, d in enumerate(distances):
+            c = countries[i % len(countries)]
+            train.co2(d, c)
+            bus.co2(d)
+            car.co2(d, c)
+        s.rows = len(distances)
+
+    with profiler.stage("emission_ground_batch") as s:
+        fractions = np.vstack([location.country_vector(c) for c in countries])
+        fractions = fractions[np.arange(len(distances)) % len(countries)]
+        train.co2_batch(distances, fractions, location.country_names)
+        bus.co2_batch(distances)
+        car.co2_batch(distances, fractions, location.country_names)
+        s.rows = len(distances)
+
+    with profiler.stage("emission_sampling") as s:
+        for i, d in enumerate(distances[:100]):
+            train.co2_percentiles(d, countries[i % len(countries)])
+        s.rows = 100
+
+    with profiler.stage("emission_flight") as s:
+        for typecode in synthetic.typecodes:
+            flight = emission.Flight(typecode)
+            for d in distances[:100]:
+                flight.co2(d)
+        s.rows = len(synthetic.typecodes) * 100
+
+    with profiler.stage("emission_flight_table_build") as s:
+        emission.build_flight_table(synthetic.typecodes)
+        s.rows = len(synthetic.typecodes)
+
+    with profiler.stage("emission_flight_table") as s:
+        for typecode in synthetic.typecodes:
+            emission.Flight(typecode).co2_batch(distances)
+        s.rows = len(synthetic.typecodes) * len(distances)
+
+    import process_flight
+
+    flight_routes = synthetic.gen_flight_routes(airports, seed=seed)
+    od_pairs = flight_routes[
+        ["origin", "destination", "distance", "duration", "typecode", "daily_flights"]
+    ]
+    with profiler.stage("flight_routes") as s:
+        process_flight.gen_flight_routes(airports, od_pairs)
+        s.rows = od_pairs.shape[0]
+
+    # api, served from the tables computed above
+    flight_routes.to_csv("data/flight_routes.csv", index=False)
+    car_routes.to_parquet("data/car_routes.parquet", index=False)
+    bus_routes.to_parquet("data/bus_routes.parquet", index=False)
+    train_routes.to_parquet("data/train_routes.parquet", index=False)
+
+    from fastapi.testclient import TestClient
+    import api
+
+    api = importlib.reload(api)
+    client = TestClient(api.app)
+
+    for fast in [False, True]:
+        with profiler.stage(f"api_route{'_fast' if fast else ''}") as s:
+            for cp in sample_pairs.itertuples():
+                response = client.get(
+                    f"/route/{cp.city_origin}/{cp.city_destination}",
+                    params=dict(fast=fast),
+                )
+                assert response.status_code == 200
+            s.rows = sample_pairs.shape[0]
+
+    return profiler
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scales", nargs="*", default=["small"], choices=list(scales))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the fixtures")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    outdir = os.path.join(root, "benchmarks", "results")
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
+
+    for scale in args.scales:
+        workdir = tempfile.mkdtemp(prefix=f"copula_bench_{scale}_")
+        os.chdir(workdir)
+
+        try:
+            profiler = run_scale(scale, seed=args.seed, **scales[scale])
+            fout = profiler.save(f"{outdir}/{scale}_{timestamp}.json")
+        finally:
+            os.chdir(cwd)
+            if not args.keep:
+                shutil.rmtree(workdir)
+
+        report = pd.DataFrame(profiler.stages)
+        columns = ["stage", "rows", "wall_s", "rows_per_s", "peak_rss_mb", "settled"]
+        print(report.reindex(columns=columns))
+        print(f"report saved to {fout}")
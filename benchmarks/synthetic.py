@@ -0,0 +1,350 @@
+"""Deterministic synthetic fixtures for benchmarks.
+
+The real GTFS feeds, airports and route tables under `data/` are not part of
+the repository, so the benchmarks run against generated data with the same
+schema. All generators take a seed and return the same data for the same
+arguments.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import polyline
+
+# countries as vertical strips over the bounding box, west to east
+strip_countries = [
+    ("ES", "Spain"),
+    ("FR", "France"),
+    ("BE", "Belgium"),
+    ("NL", "Netherlands"),
+    ("DE", "Germany"),
+    ("AT", "Austria"),
+    ("PL", "Poland"),
+    ("SK", "Slovakia"),
+]
+
+lon_min, lon_max = -6.0, 24.0
+lat_min, lat_max = 40.0, 56.0
+
+typecodes = ["A320", "A319", "B738", "A321", "E190"]
+
+
+def country_of(lon):
+    edges = np.linspace(lon_min, lon_max, len(strip_countries) + 1)
+    idx = np.clip(np.searchsorted(edges, lon) - 1, 0, len(strip_countries) - 1)
+    return [strip_countries[i] for i in np.atleast_1d(idx)]
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 6371 * 2 * np.arcsin(np.sqrt(a))
+
+
+def minutes_to_gtfs_time(minutes):
+    minutes = np.asarray(minutes).round().astype(int)
+    return [f"{m // 60:02}:{m % 60:02}:00" for m in minutes]
+
+
+# %%
+def gen_airports(n_cities=20, airports_per_city=1, seed=0):
+    """Cities and airports in the schema of data/airports.csv."""
+    rng = np.random.default_rng(seed)
+
+    city_lat = rng.uniform(lat_min + 0.5, lat_max - 0.5, n_cities)
+    city_lon = rng.uniform(lon_min + 0.5, lon_max - 0.5, n_cities)
+
+    rows = []
+    for i in range(n_cities):
+        code, country = country_of(city_lon[i])[0]
+        for k in range(airports_per_city):
+            rows.append(
+                dict(
+                    airport=f"X{i:03}{k}",
+                    place=f"City{i:03}",
+                    city=f"City{i:03}",
+                    country=country,
+                    country_code=code,
+                    airport_type="large_airport",
+                    name=f"City{i:03} Airport {k}",
+                    airport_latitude=city_lat[i] + rng.uniform(-0.2, 0.2),
+                    airport_longitude=city_lon[i] + rng.uniform(-0.2, 0.2),
+                    city_latitude=city_lat[i],
+                    city_longitude=city_lon[i],
+                )
+            )
+
+    return pd.DataFrame(rows)
+
+
+def gen_world():
+    """Country polygons in the schema of data/naturalearth_lowres.parquet."""
+    import geopandas as gpd
+    from shapely.geometry import box
+
+    edges = np.linspace(lon_min, lon_max, len(strip_countries) + 1)
+    # widen the outer strips so that no point falls outside of all countries
+    edges[0], edges[-1] = -30, 60
+
+    return gpd.GeoDataFrame(
+        dict(
+            ADMIN=[name for _, name in strip_countries],
+            ISO_A2=[code for code, _ in strip_countries],
+        ),
+        geometry=[box(edges[i], 30, edges[i + 1], 70) for i in range(len(edges) - 1)],
+        crs="EPSG:4326",
+    )
+
+
+# %%
+def gen_gtfs(
+    airports: pd.DataFrame,
+    stops_per_city=3,
+    n_lines=20,
+    n_trips=200,
+    n_days=7,
+    speed=120,
+    agency="Synthetic Rail",
+    seed=0,
+):
+    """Generate a GTFS feed connecting the cities.
+
+    Lines are random walks between neighbouring cities, trips run in both
+    directions over the day at `speed` km/h. Returns a dict of DataFrames
+    named after the GTFS files.
+    """
+    rng = np.random.default_rng(seed)
+    cities = airports.drop_duplicates("city").reset_index(drop=True)
+    n_cities = cities.shape[0]
+
+    # stops within ~3 km of the city center
+    stop_city = np.repeat(np.arange(n_cities), stops_per_city)
+    stops = pd.DataFrame(
+        dict(
+            stop_id=[f"S{i:05}" for i in range(len(stop_city))],
+            stop_code=[f"C{i:05}" for i in range(len(stop_city))],
+            stop_name=[
+                f"{cities.city[c]} {k}" for c in range(n_cities) for k in range(stops_per_city)
+            ],
+            stop_lat=cities.city_latitude.values[stop_city]
+            + rng.uniform(-0.025, 0.025, len(stop_city)),
+            stop_lon=cities.city_longitude.values[stop_city]
+            + rng.uniform(-0.025, 0.025, len(stop_city)),
+        )
+    )
+
+    # lines follow the nearest neighbours of each city
+    dist = haversine(
+        cities.city_latitude.values[:, None],
+        cities.city_longitude.values[:, None],
+        cities.city_latitude.values[None, :],
+        cities.city_longitude.values[None, :],
+    )
+    neighbours = np.argsort(dist, axis=1)[:, 1 : min(5, n_cities)]
+
+    lines = []
+    for _ in range(n_lines):
+        line = [rng.integers(n_cities)]
+        for _ in range(rng.integers(2, 8)):
+            candidates = [c for c in neighbours[line[-1]] if c not in line]
+            if not candidates:
+                break
+            line.append(rng.choice(candidates))
+        lines.append([c * stops_per_city + rng.integers(stops_per_city) for c in line])
+
+    agency_df = pd.DataFrame(
+        dict(agency_id=["1"], agency_name=[agency], agency_url=["http://example.org"])
+    )
+
+    routes = pd.DataFrame(
+        dict(
+            route_id=[f"R{i:04}" for i in range(n_lines)],
+            agency_id="1",
+            route_short_name=[f"L{i}" for i in range(n_lines)],
+            route_long_name=[f"Line {i}" for i in range(n_lines)],
+            route_type=2,
+        )
+    )
+
+    services = ["DAILY", "WEEKDAY", "WEEKEND"]
+    start = pd.Timestamp("2024-01-01")
+    end = start + pd.Timedelta(days=n_days - 1)
+    calendar = pd.DataFrame(
+        dict(
+            service_id=services,
+            monday=[1, 1, 0],
+            tuesday=[1, 1, 0],
+            wednesday=[1, 1, 0],
+            thursday=[1, 1, 0],
+            friday=[1, 1, 0],
+            saturday=[1, 0, 1],
+            sunday=[1, 0, 1],
+            start_date=int(start.strftime("%Y%m%d")),
+            end_date=int(end.strftime("%Y%m%d")),
+        )
+    )
+
+    # one added and one removed service date within the period
+    dates = pd.date_range(start, end)
+    calendar_dates = pd.DataFrame(
+        dict(
+            service_id=["WEEKEND", "WEEKDAY"],
+            date=[int(dates[min(2, n_days - 1)].strftime("%Y%m%d"))] * 2,
+            exception_type=[1, 2],
+        )
+    )
+
+    trip_rows = []
+    stop_time_rows = []
+    for t in range(n_trips):
+        line_idx = rng.integers(n_lines)
+        line_stops = lines[line_idx]
+        direction = int(rng.integers(2))
+        if direction == 1:
+            line_stops = line_stops[::-1]
+
+        trip_id = f"T{t:06}"
+        trip_rows.append(
+            dict(
+                route_id=f"R{line_idx:04}",
+                service_id=services[rng.integers(len(services))],
+                trip_id=trip_id,
+                direction_id=direction,
+            )
+        )
+
+        lat = stops.stop_lat.values[line_stops]
+        lon = stops.stop_lon.values[line_stops]
+        leg_minutes = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:]) / speed * 60
+        dwell = 2
+
+        arrival = rng.uniform(300, 1320) + np.concatenate(
+            [[0], np.cumsum(leg_minutes + dwell)]
+        )
+        departure = arrival + dwell
+
+        for seq, (s, a, d) in enumerate(zip(line_stops, arrival, departure)):
+            stop_time_rows.append((trip_id, a, d, stops.stop_id.values[s], seq + 1))
+
+    stop_times = pd.DataFrame(
+        stop_time_rows,
+        columns=["trip_id", "arrival_mins", "departure_mins", "stop_id", "stop_sequence"],
+    )
+    stop_times = stop_times.assign(
+        arrival_time=minutes_to_gtfs_time(stop_times.arrival_mins),
+        departure_time=minutes_to_gtfs_time(stop_times.departure_mins),
+    ).drop(columns=["arrival_mins", "departure_mins"])
+
+    return dict(
+        agency=agency_df,
+        routes=routes,
+        trips=pd.DataFrame(trip_rows),
+        stops=stops,
+        stop_times=stop_times[
+            ["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence"]
+        ],
+        calendar=calendar,
+        calendar_dates=calendar_dates,
+    )
+
+
+def write_gtfs(feed: dict, path: str):
+    os.makedirs(path, exist_ok=True)
+    for name, df in feed.items():
+        df.to_csv(f"{path}/{name}.txt", index=False)
+
+
+def gtfs_routes(feed: dict):
+    """Merged stop sequence table, as produced by generate_gtfs_routes."""
+    return (
+        feed["trips"]
+        .merge(feed["routes"])
+        .merge(feed["stop_times"])
+        .merge(feed["stops"])
+        .merge(feed["agency"])
+        .sort_values(["trip_id", "stop_sequence"])
+        .reset_index(drop=True)
+    )
+
+
+# %%
+def gen_line_routes(city_pairs: pd.DataFrame, n_points=200, speed=80, seed=0):
+    """Noisy straight-line routes for each city pair, like the car routes."""
+    rng = np.random.default_rng(seed)
+    results = []
+
+    for cp in city_pairs.itertuples():
+        t = np.linspace(0, 1, n_points)[:, None]
+        coords = np.array([cp.lat0, cp.lon0]) * (1 - t) + np.array([cp.lat1, cp.lon1]) * t
+        coords[1:-1] += rng.normal(0, 0.01, size=(n_points - 2, 2))
+        distance = haversine(cp.lat0, cp.lon0, cp.lat1, cp.lon1) * 1.2
+        results.append(
+            dict(
+                city_origin=cp.city_origin,
+                city_destination=cp.city_destination,
+                duration=distance / speed * 60,
+                distance=distance,
+                coords=polyline.encode(coords.tolist()),
+            )
+        )
+
+    return city_pairs.merge(pd.DataFrame(results))
+
+
+def gen_flight_routes(airports: pd.DataFrame, min_distance=300, seed=0):
+    """Flight routes between airports, in the schema of data/flight_routes.csv."""
+    rng = np.random.default_rng(seed)
+    a = airports.add_suffix("_origin").merge(
+        airports.add_suffix("_destination"), how="cross"
+    )
+    a = a.query("city_origin != city_destination").rename(
+        columns=dict(airport_origin="origin", airport_destination="destination")
+    )
+
+    distance = haversine(
+        a.airport_latitude_origin,
+        a.airport_longitude_origin,
+        a.airport_latitude_destination,
+        a.airport_longitude_destination,
+    )
+
+    return (
+        a.assign(
+            distance=distance,
+            duration=distance / 750 * 60 + 30,
+            typecode=rng.choice(typecodes, a.shape[0]),
+            daily_flights=rng.integers(1, 10, a.shape[0]).astype(float),
+        )
+        .query("distance > @min_distance")
+        .reset_index(drop=True)
+    )
+
+
+def fake_osm_route(lonlats, server_url=None):
+    """Offline stand-in for location.get_osm_route, following the stops."""
+    lonlats = np.asarray(lonlats, dtype=float)
+    distance = haversine(
+        lonlats[:-1, 1], lonlats[:-1, 0], lonlats[1:, 1], lonlats[1:, 0]
+    ).sum()
+    return {
+        "code": "Ok",
+        "routes": [
+            {
+                "duration": distance / 70 * 3600,
+                "distance": distance * 1000,
+                "geometry": polyline.encode(lonlats[:, ::-1].tolist()),
+            }
+        ]
+    }
+
+
+def write_data_dir(path=".", n_cities=20, seed=0):
+    """Write the base files that location.py and api.py expect under data/."""
+    os.makedirs(f"{path}/data", exist_ok=True)
+    airports = gen_airports(n_cities, seed=seed)
+    airports.to_csv(f"{path}/data/airports.csv", index=False)
+    gen_world().to_parquet(f"{path}/data/naturalearth_lowres.parquet")
+    return airports
@@ -1,97 +1,372 @@
 #%%
-from dataclasses import dataclass
+import os
+import json
+import threading
+import numpy as np
 import openap
 from openap import polymer
 
 #%%
-# gram per kWh
-co2_kwh = {
-    "EU-27": 238.0,
-    "Austria": 82.0,
-    "Belgium": 139.0,
-    "Bulgaria": 398.0,
-    "Croatia": 138.0,
-    "Cyprus": 605.0,
-    "Czechia": 397.0,
-    "Denmark": 123.0,
-    "Estonia": 656.0,
-    "Finland": 70.0,
-    "France": 58.0,
-    "Germany": 348.0,
-    "Greece": 397.0,
-    "Hungary": 188.0,
-    "Ireland": 332.0,
-    "Italy": 234.0,
-    "Latvia": 106.0,
-    "Lithuania": 127.0,
-    "Luxembourg": 45.0,
-    "Malta": 349.0,
-    "Netherlands": 339.0,
-    "Poland": 721.0,
-    "Portugal": 167.0,
-    "Romania": 212.0,
-    "Slovakia": 113.0,
-    "Slovenia": 211.0,
-    "Spain": 165.0,
-    "Sweden": 9.0,
-}
-
-# https://www.kaggle.com/datasets/debajyotipodder/co2-emission-by-vehicles
-# https://ev-database.org/cheatsheet/energy-consumption-electric-car
-
-car_co2 = {
-    "diesel": {
-        "co2_km_low": 200,  # gram co2
-        "co2_km_high": 270,
-    },
-    "petrol": {
-        "co2_km_low": 210,
-        "co2_km_high": 280,
-    },
-    "electric": {
-        "kwh_km_low": 0.15,
-        "kwh_km_high": 0.25,
-    },
-}
+factors_file = os.path.join(os.path.dirname(__file__), "emission_factors.json")
+
+
+class EmissionFactors:
+    """Emission factors from a versioned JSON file.
+
+    Grid intensities are kept in an array (kg CO2 per kWh) with one entry per
+    country, and can be aligned to any list of country names, such as the
+    country ids of `location.world`, for matrix products over many routes.
+    """
+
+    def __init__(self, path=factors_file):
+        with open(path) as f:
+            data = json.load(f)
+
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.version = data["version"]
+
+        grid = data["grid_co2_g_kwh"]
+        self.countries = list(grid["values"])
+        self.grid = np.array(list(grid["values"].values()), dtype=float) / 1000
+        self.default = grid["values"][grid["default"]] / 1000
+
+        # aliases map other spellings of country names to a key of
+        # `values`, e.g. "Czech Republic" in older route tables to "Czechia"
+        self.index = {country: i for i, country in enumerate(self.countries)}
+        for alias, country in grid.get("aliases", {}).items():
+            self.index[alias] = self.index[country]
+
+        self.car = data["car"]
+        self.train = data["train"]
+        self.bus = data["bus"]
+        self.uncertainty = data["uncertainty"]
+
+        self.aligned = {}
+
+    def grid_intensity(self, countries):
+        """Intensity for each country name, the default for unknown ones."""
+        key = tuple(countries)
+        if key not in self.aligned:
+            idx = np.array([self.index.get(c, -1) for c in key], dtype=int)
+            self.aligned[key] = np.where(idx >= 0, self.grid[idx], self.default)
+        return self.aligned[key]
+
+    def mix_intensity(self, countries: dict):
+        """Intensity of a route, from the fraction of distance per country."""
+        co2_kg_kWh = 0
+        for country, fraction in countries.items():
+            i = self.index.get(country)
+            co2_kg_kWh += (self.default if i is None else self.grid[i]) * fraction
+        return co2_kg_kWh
+
+
+_factors = EmissionFactors()
+_reload_lock = threading.Lock()
+
+
+def factors():
+    return _factors
+
+
+def reload_factors(path=None, force=False):
+    """Load emission factors again when the file has changed.
+
+    The new table is built completely before it replaces the current one, so
+    requests see either the old or the new factors, never a mix. An invalid
+    file raises and leaves the current factors in place.
+    """
+    global _factors
+
+    with _reload_lock:
+        current = _factors
+        path = current.path if path is None else path
+
+        if not force and path == current.path:
+            if os.path.getmtime(path) == current.mtime:
+                return current
+
+        _factors = EmissionFactors(path)
+        return _factors
 
 
 #%%
-class Flight:
+# percentiles returned by the sampling mode
+sample_percentiles = (5, 50, 95)
+
+
+def grid_spread(rng, shape, sigma):
+    """Random factors with mean one for the grid intensity."""
+    return rng.lognormal(-(sigma**2) / 2, sigma, size=shape)
+
+
+class Sampling:
+    """Monte Carlo percentiles for classes with a `co2_samples` method.
+
+    Samples are drawn with a seeded generator, so results are reproducible.
+    A scalar distance gives percentiles of one route, an array of distances
+    gives one row of percentiles per route.
+    """
+
+    def co2_percentiles(self, *args, q=sample_percentiles, n=10_000, seed=0, **kwargs):
+        samples = self.co2_samples(*args, n=n, seed=seed, **kwargs)
+        pct = np.percentile(samples, q, axis=-1).round().T
+        if pct.ndim == 1:
+            return tuple(int(v) for v in pct)
+        return pct
+
+
+#%%
+flight_table_file = "data/flight_co2_table.npz"
+
+# largest relative interpolation error accepted for a type in the table
+max_table_error = 0.01
+
+
+class FlightTable:
+    """Flight CO2 per aircraft type over a grid of distances and masses.
+
+    Evaluated with np.interp in place of the polymer model. The maximum
+    relative error against the direct openap result, checked halfway
+    between grid points, is stored per type in `max_error`. Types with an
+    error above `tolerance` are left out, so the polymer model is used.
+    """
+
+    def __init__(self, path=flight_table_file, tolerance=max_table_error):
+        with np.load(path) as f:
+            self.typecodes = f["typecodes"].tolist()
+            self.distance = f["distance"]
+            self.mass_fraction = f["mass_fraction"]
+            self.co2 = f["co2"]  # typecode x mass fraction x distance
+            self.mtow = f["mtow"]
+            self.pax = f["pax"]
+            self.max_error = f["max_error"]
+
+        self.index = {
+            typecode: i
+            for i, typecode in enumerate(self.typecodes)
+            if self.max_error[i] <= tolerance
+        }
+
+        coarse = sorted(set(self.typecodes) - set(self.index))
+        if len(coarse) > 0:
+            print(f"Flight table error above {tolerance:.0e}, not used for", coarse)
+
+    def __contains__(self, typecode):
+        return typecode in self.index
+
+    def lookup(self, typecode, distance, mass_fraction):
+        """CO2 with a last axis over `mass_fraction`, or None when the
+        distance or masses are not covered by the table."""
+        d = np.asarray(distance, dtype=float)
+        if d.size and (d.min() < self.distance[0] or d.max() > self.distance[-1]):
+            return None
+
+        k = [np.flatnonzero(np.isclose(self.mass_fraction, f)) for f in mass_fraction]
+        if any(len(ki) == 0 for ki in k):
+            return None
+
+        rows = self.co2[self.index[typecode]]
+        return np.stack([np.interp(d, self.distance, rows[ki[0]]) for ki in k], axis=-1)
+
+
+_flight_table = None
+
+
+def flight_table():
+    """The flight CO2 table, loaded once, or None when it is not built."""
+    global _flight_table
+    if _flight_table is None and os.path.exists(flight_table_file):
+        _flight_table = FlightTable()
+    return _flight_table
+
+
+def build_flight_table(
+    typecodes,
+    distance=np.arange(50, 8001, 25),
+    mass_fraction=(0.8, 0.9, 1.0),
+    fout=flight_table_file,
+    tolerance=max_table_error,
+):
+    """Evaluate the polymer model on a distance grid for each aircraft type.
+
+    CO2 is close to linear in distance between grid points, so with the
+    default 25 km grid the relative interpolation error is expected to be
+    well below the default tolerance of 1%. Raises ValueError, without
+    writing the table, when the error of any type is above `tolerance`.
+    """
+    distance = np.asarray(distance, dtype=float)
+    midpoints = (distance[1:] + distance[:-1]) / 2
+
+    typecodes = sorted(set(typecodes))
+    co2 = np.zeros((len(typecodes), len(mass_fraction), len(distance)))
+    mtow = np.zeros(len(typecodes))
+    pax = np.zeros((len(typecodes), 2))
+    max_error = np.zeros(len(typecodes))
+
+    for i, typecode in enumerate(typecodes):
+        poly = polymer.Flight(typecode)
+        ac = openap.prop.aircraft(typecode)
+        mtow[i] = ac["limits"]["MTOW"]
+        pax[i] = ac["pax"]["low"], ac["pax"]["high"]
+
+        for k, f in enumerate(mass_fraction):
+            mass = f * mtow[i]
+            co2[i, k] = [poly.co2(distance=d, mass=mass)[0] for d in distance]
+
+            direct = np.array([poly.co2(distance=d, mass=mass)[0] for d in midpoints])
+            error = np.abs(np.interp(midpoints, distance, co2[i, k]) - direct) / direct
+            max_error[i] = max(max_error[i], error.max())
+
+        print(f"{typecode}: max relative error {max_error[i]:.2e}")
+
+    coarse = [t for t, e in zip(typecodes, max_error) if e > tolerance]
+    if len(coarse) > 0:
+        raise ValueError(
+            f"Interpolation error above {tolerance:.0e} for {coarse}, "
+            "use a finer distance grid"
+        )
+
+    np.savez(
+        fout,
+        typecodes=np.array(typecodes),
+        distance=distance,
+        mass_fraction=np.array(mass_fraction),
+        co2=co2,
+        mtow=mtow,
+        pax=pax,
+        max_error=max_error,
+    )
+    return fout
+
+
+class Flight(Sampling):
     def __init__(self, typecode):
         self.typecode = typecode
-        self.poly = polymer.Flight(typecode)
+        self.factors = factors()
+        self.table = flight_table()
+        self._poly = None
 
-        ac = openap.prop.aircraft(typecode)
-        self.mass = ac["limits"]["MTOW"] * 0.9
-        self.pax_low, self.pax_high = ac["pax"]["low"], ac["pax"]["high"]
+        if self.table is not None and typecode in self.table:
+            i = self.table.index[typecode]
+            self.mtow = self.table.mtow[i]
+            self.pax_low, self.pax_high = self.table.pax[i]
+        else:
+            self.table = None
+            ac = openap.prop.aircraft(typecode)
+            self.mtow = ac["limits"]["MTOW"]
+            self.pax_low, self.pax_high = ac["pax"]["low"], ac["pax"]["high"]
+
+        self.mass = self.mtow * 0.9
+
+    @property
+    def poly(self):
+        if self._poly is None:
+            self._poly = polymer.Flight(self.typecode)
+        return self._poly
+
+    def co2_mass(self, distance, mass_fraction):
+        """Flight CO2 with a last axis over the fractions of MTOW, from the
+        table when it covers the query, from the polymer model otherwise."""
+        if self.table is not None:
+            co2 = self.table.lookup(self.typecode, distance, mass_fraction)
+            if co2 is not None:
+                return co2
+
+        d = np.asarray(distance, dtype=float)
+        co2 = [
+            [self.poly.co2(distance=di, mass=f * self.mtow)[0] for f in mass_fraction]
+            for di in d.ravel()
+        ]
+        return np.array(co2).reshape(d.shape + (len(mass_fraction),))
 
     def co2(self, distance):
-        co2_low = self.poly.co2(distance=distance, mass=self.mass) / self.pax_high
-        co2_high = self.poly.co2(distance=distance, mass=self.mass) / self.pax_low
-        return int(round(co2_low[0], -1)), int(round(co2_high[0], -1))
+        co2 = float(self.co2_mass(distance, [self.mass / self.mtow])[..., 0])
+        co2_low = co2 / self.pax_high
+        co2_high = co2 / self.pax_low
+        return int(round(co2_low, -1)), int(round(co2_high, -1))
+
+    def co2_batch(self, distance):
+        """CO2 of many flights of this type, in one table lookup."""
+        co2 = self.co2_mass(distance, [self.mass / self.mtow])[..., 0]
+        return (co2 / self.pax_high).round(-1), (co2 / self.pax_low).round(-1)
+
+    def co2_samples(self, distance, n=10_000, seed=0):
+        """CO2 per passenger, sampling take-off mass, seats and load factor.
+
+        Flight CO2 is known at the low, mode and high mass only; samples in
+        between are interpolated linearly in mass.
+        """
+        u = self.factors.uncertainty["flight"]
+        rng = np.random.default_rng(seed)
+        d = np.asarray(distance, dtype=float)
+
+        mass_fraction = np.array(u["mass_fraction"])
+        co2_mass = self.co2_mass(d, mass_fraction)
 
+        f = rng.triangular(*mass_fraction, size=d.shape + (n,))
+        lower = f < mass_fraction[1]
+        i = np.where(lower, 0, 1)
+        f0 = np.where(lower, mass_fraction[0], mass_fraction[1])
+        f1 = np.where(lower, mass_fraction[1], mass_fraction[2])
+        c0 = np.take_along_axis(co2_mass, i, axis=-1)
+        c1 = np.take_along_axis(co2_mass, i + 1, axis=-1)
+        co2 = c0 + (c1 - c0) * (f - f0) / (f1 - f0)
 
-class Train:
+        seats = rng.uniform(self.pax_low, self.pax_high, size=d.shape + (n,))
+        load_factor = rng.triangular(*u["load_factor"], size=d.shape + (n,))
+
+        return co2 / (seats * load_factor)
+
+
+class Train(Sampling):
     def __init__(self):
-        self.kWh_pax_km_low = 0.03
-        self.kWh_pax_km_high = 0.05
+        self.factors = factors()
+        self.kWh_pax_km_low = self.factors.train["kwh_pax_km_low"]
+        self.kWh_pax_km_high = self.factors.train["kwh_pax_km_high"]
 
     def co2(self, distance: float, countries: dict):
-        co2_kg_kWh = 0
-        for country, fraction in countries.items():
-            co2_kg_kWh_country = co2_kwh.get(country, co2_kwh["EU-27"]) / 1000
-            co2_kg_kWh += co2_kg_kWh_country * fraction
+        co2_kg_kWh = self.factors.mix_intensity(countries)
 
         co2_low = self.kWh_pax_km_low * co2_kg_kWh * distance
         co2_high = self.kWh_pax_km_high * co2_kg_kWh * distance
 
         return round(co2_low), round(co2_high)
 
+    def co2_batch(self, distance, fractions, countries):
+        """CO2 of many routes, with `fractions` (routes x countries) of the
+        distance in each of the `countries`."""
+        co2_kg_kWh = np.asarray(fractions) @ self.factors.grid_intensity(countries)
+
+        co2_low = self.kWh_pax_km_low * co2_kg_kWh * distance
+        co2_high = self.kWh_pax_km_high * co2_kg_kWh * distance
+
+        return co2_low.round(), co2_high.round()
+
+    def co2_samples(self, distance, countries, fractions=None, n=10_000, seed=0):
+        """CO2 samples of a route (`countries` as from route_countries), or
+        of many routes (`fractions` and `countries` as in co2_batch)."""
+        rng = np.random.default_rng(seed)
+        d = np.asarray(distance, dtype=float)[..., None]
+
+        if fractions is None:
+            co2_kg_kWh = self.factors.mix_intensity(countries)
+        else:
+            co2_kg_kWh = np.asarray(fractions) @ self.factors.grid_intensity(countries)
+        co2_kg_kWh = np.asarray(co2_kg_kWh)[..., None]
+
+        shape = d.shape[:-1] + (n,)
+        kwh = rng.uniform(self.kWh_pax_km_low, self.kWh_pax_km_high, size=shape)
+        spread = grid_spread(rng, shape, self.factors.uncertainty["grid_sigma"])
+
+        return kwh * co2_kg_kWh * spread * d
 
-class Bus:
+
+class Bus(Sampling):
     def __init__(self):
-        self.co2_pax_km_low = 0.03
-        self.co2_pax_km_high = 0.08
+        self.factors = factors()
+        self.co2_pax_km_low = self.factors.bus["co2_pax_km_low"]
+        self.co2_pax_km_high = self.factors.bus["co2_pax_km_high"]
 
     def co2(self, distance: float):
         co2_low = self.co2_pax_km_low * distance
@@ -99,14 +374,28 @@ class Bus:
 
         return round(co2_low), round(co2_high)
 
+    def co2_batch(self, distance):
+        distance = np.asarray(distance, dtype=float)
+        co2_low = self.co2_pax_km_low * distance
+        co2_high = self.co2_pax_km_high * distance
+
+        return co2_low.round(), co2_high.round()
 
-class Car:
+    def co2_samples(self, distance, n=10_000, seed=0):
+        rng = np.random.default_rng(seed)
+        d = np.asarray(distance, dtype=float)[..., None]
+        shape = d.shape[:-1] + (n,)
+        return rng.uniform(self.co2_pax_km_low, self.co2_pax_km_high, size=shape) * d
+
+
+class Car(Sampling):
     def __init__(self, car_type):
         self.car_type = car_type
+        self.factors = factors()
 
     def co2(self, distance: float, countries: dict = None):
         if self.car_type in ["petrol", "diesel"]:
-            co2_km = car_co2[self.car_type]
+            co2_km = self.factors.car[self.car_type]
             co2_low = co2_km["co2_km_low"] / 1000 * distance
             co2_high = co2_km["co2_km_high"] / 1000 * distance
             return round(co2_low), round(co2_high)
@@ -114,17 +403,66 @@ class Car:
         elif self.car_type == "electric":
             assert countries is not None
 
-            car_co2_kwh = car_co2[self.car_type]
-            co2_kg_kWh = 0
-            for country, fraction in countries.items():
-                co2_kg_kWh_country = co2_kwh.get(country, co2_kwh["EU-27"]) / 1000
-                co2_kg_kWh += co2_kg_kWh_country * fraction
+            car_co2_kwh = self.factors.car[self.car_type]
+            co2_kg_kWh = self.factors.mix_intensity(countries)
 
             co2_low = car_co2_kwh["kwh_km_low"] * co2_kg_kWh * distance
             co2_high = car_co2_kwh["kwh_km_high"] * co2_kg_kWh * distance
 
             return round(co2_low), round(co2_high)
 
+    def co2_batch(self, distance, fractions=None, countries=None):
+        """CO2 of many routes, see Train.co2_batch."""
+        distance = np.asarray(distance, dtype=float)
+
+        if self.car_type in ["petrol", "diesel"]:
+            co2_km = self.factors.car[self.car_type]
+            co2_low = co2_km["co2_km_low"] / 1000 * distance
+            co2_high = co2_km["co2_km_high"] / 1000 * distance
+            return co2_low.round(), co2_high.round()
+
+        elif self.car_type == "electric":
+            assert fractions is not None and countries is not None
+
+            car_co2_kwh = self.factors.car[self.car_type]
+            co2_kg_kWh = np.asarray(fractions) @ self.factors.grid_intensity(countries)
+
+            co2_low = car_co2_kwh["kwh_km_low"] * co2_kg_kWh * distance
+            co2_high = car_co2_kwh["kwh_km_high"] * co2_kg_kWh * distance
+
+            return co2_low.round(), co2_high.round()
+
+    def co2_samples(self, distance, countries=None, fractions=None, n=10_000, seed=0):
+        """CO2 samples, see Train.co2_samples. `countries` is only needed
+        for electric cars."""
+        rng = np.random.default_rng(seed)
+        d = np.asarray(distance, dtype=float)[..., None]
+        shape = d.shape[:-1] + (n,)
+
+        if self.car_type in ["petrol", "diesel"]:
+            co2_km = self.factors.car[self.car_type]
+            low, high = co2_km["co2_km_low"] / 1000, co2_km["co2_km_high"] / 1000
+            return rng.uniform(low, high, size=shape) * d
+
+        elif self.car_type == "electric":
+            assert countries is not None
+
+            if fractions is None:
+                co2_kg_kWh = self.factors.mix_intensity(countries)
+            else:
+                co2_kg_kWh = np.asarray(fractions) @ self.factors.grid_intensity(
+                    countries
+                )
+            co2_kg_kWh = np.asarray(co2_kg_kWh)[..., None]
+
+            car_co2_kwh = self.factors.car[self.car_type]
+            kwh = rng.uniform(
+                car_co2_kwh["kwh_km_low"], car_co2_kwh["kwh_km_high"], size=shape
+            )
+            spread = grid_spread(rng, shape, self.factors.uncertainty["grid_sigma"])
+
+            return kwh * co2_kg_kWh * spread * d
+
 
 # Sample instantiation of each class
 # flight = Flight(typecode="A320")
@@ -0,0 +1,190 @@
+# %%
+import os
+import glob
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import polyline
+from scipy.sparse import coo_matrix
+import location
+import emission
+from profiler import StageProfiler
+
+# equal area projection for the length of route pieces per country
+length_crs = "EPSG:3035"
+
+
+# %%
+def route_lines(routes: pd.DataFrame, column="coords"):
+    """LineStrings (lon, lat) from encoded polylines, built in one call.
+
+    Routes with fewer than two points are dropped.
+    """
+    decoded = [polyline.decode(c) for c in routes[column]]
+    n = np.array([len(c) for c in decoded], dtype=int)
+    keep = n >= 2
+
+    if not keep.any():
+        return gpd.GeoDataFrame(
+            routes.iloc[:0].reset_index(drop=True),
+            geometry=gpd.GeoSeries([], crs="EPSG:4326"),
+            crs="EPSG:4326",
+        )
+
+    latlon = np.concatenate([np.asarray(c) for c, k in zip(decoded, keep) if k])
+    indices = np.repeat(np.arange(keep.sum()), n[keep])
+    lines = shapely.linestrings(latlon[:, ::-1], indices=indices)
+
+    return gpd.GeoDataFrame(
+        routes[keep].reset_index(drop=True), geometry=lines, crs="EPSG:4326"
+    )
+
+
+def country_fractions(gdf: gpd.GeoDataFrame):
+    """Fraction of each route length per country id (routes x countries)."""
+    lines = gdf[["geometry"]].assign(route=np.arange(gdf.shape[0])).to_crs(length_crs)
+    world = location.world[["geometry"]].assign(
+        country=np.arange(location.world.shape[0])
+    )
+
+    pieces = gpd.overlay(lines, world.to_crs(length_crs), how="intersection")
+    total = np.maximum(lines.length.values, 1e-9)
+
+    fractions = coo_matrix(
+        (
+            pieces.length.values / total[pieces.route.values],
+            (pieces.route.values, pieces.country.values),
+        ),
+        shape=(gdf.shape[0], len(location.country_names)),
+    )
+    return fractions.toarray()
+
+
+def emission_columns(gdf: gpd.GeoDataFrame, mode: str):
+    """CO2 low/high (kg per passenger) for all routes of a mode."""
+    distance = gdf["distance"].values
+
+    if mode == "flight":
+        co2 = np.zeros((gdf.shape[0], 2))
+        for typecode, idx in gdf.groupby("typecode").indices.items():
+            flight = emission.Flight(typecode)
+            co2[idx] = np.column_stack(flight.co2_batch(distance[idx]))
+        return dict(co2_low=co2[:, 0], co2_high=co2[:, 1])
+
+    if mode == "bus":
+        co2_low, co2_high = emission.Bus().co2_batch(distance)
+        return dict(co2_low=co2_low, co2_high=co2_high)
+
+    if mode == "train":
+        fractions = country_fractions(gdf)
+        co2_low, co2_high = emission.Train().co2_batch(
+            distance, fractions, location.country_names
+        )
+        return dict(co2_low=co2_low, co2_high=co2_high)
+
+    if mode == "car":
+        fractions = country_fractions(gdf)
+        columns = {}
+        for car_type in ["petrol", "diesel", "electric"]:
+            co2_low, co2_high = emission.Car(car_type).co2_batch(
+                distance, fractions, location.country_names
+            )
+            columns[f"co2_{car_type}_low"] = co2_low
+            columns[f"co2_{car_type}_high"] = co2_high
+        return columns
+
+    return {}
+
+
+def export_routes(routes: pd.DataFrame, mode: str, fout: str, geoarrow=False):
+    """Routes of one mode as GeoParquet, with the most detailed geometry.
+
+    Set `geoarrow` to store native GeoArrow geometry instead of WKB.
+    """
+    column = location.tier_column(routes.columns, zoom=np.inf)
+    gdf = route_lines(routes, column)
+
+    gdf = gdf.assign(mode=mode, **emission_columns(gdf, mode)).drop(
+        columns=[c for c in gdf.columns if c.startswith("coords")]
+    )
+
+    os.makedirs(os.path.dirname(fout), exist_ok=True)
+    if geoarrow:
+        gdf.to_parquet(fout, index=False, geometry_encoding="geoarrow")
+    else:
+        gdf.to_parquet(fout, index=False)
+
+    return gdf
+
+
+def flight_lines(flight_routes: pd.DataFrame):
+    """Straight lines between airports, encoded like the other routes."""
+    return flight_routes.assign(
+        coords=[
+            polyline.encode([(lat0, lon0), (lat1, lon1)])
+            for lat0, lon0, lat1, lon1 in flight_routes[
+                [
+                    "airport_latitude_origin",
+                    "airport_longitude_origin",
+                    "airport_latitude_destination",
+                    "airport_longitude_destination",
+                ]
+            ].values
+        ]
+    )
+
+
+def write_tiles(files: dict, fout="data/export/routes.pmtiles"):
+    """Vector tiles with one layer per mode, if tippecanoe is installed."""
+    if shutil.which("tippecanoe") is None:
+        print("tippecanoe not found, vector tiles are skipped")
+        return None
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        layers = []
+        for mode, fin in files.items():
+            fjson = os.path.join(tmpdir, f"{mode}.geojsonl")
+            gdf = gpd.read_parquet(fin)
+            columns = ["city_origin", "city_destination", "mode", "geometry"]
+            columns += gdf.select_dtypes("number").columns.tolist()
+            gdf[columns].to_file(fjson, driver="GeoJSONSeq")
+            layers += ["-L", f"{mode}:{fjson}"]
+
+        subprocess.run(
+            ["tippecanoe", "-o", fout, "-zg", "--drop-densest-as-needed", "--force"]
+            + layers,
+            check=True,
+        )
+
+    return fout
+
+
+# %%
+if __name__ == "__main__":
+    profiler = StageProfiler("export")
+    files = {}
+
+    for fin in sorted(glob.glob("data/*_routes.parquet")):
+        mode = os.path.basename(fin).replace("_routes.parquet", "")
+        with profiler.stage(f"export_{mode}") as s:
+            fout = f"data/export/{mode}_routes.parquet"
+            s.rows = export_routes(pd.read_parquet(fin), mode, fout).shape[0]
+            files[mode] = fout
+
+    # %%
+    if os.path.exists("data/flight_routes.csv"):
+        with profiler.stage("export_flight") as s:
+            flight_routes = flight_lines(pd.read_csv("data/flight_routes.csv"))
+            fout = "data/export/flight_routes.parquet"
+            s.rows = export_routes(flight_routes, "flight", fout).shape[0]
+            files["flight"] = fout
+
+    # %%
+    with profiler.stage("vector_tiles"):
+        write_tiles(files)
+
+    profiler.save()
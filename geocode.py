@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+geocode_store = "data/cache/geocode.jsonl"
+
+
+class TokenBucket:
+    """Rate limiter allowing `rate` requests per second, in bursts of up to
+    `capacity` requests. Thread-safe; acquire() blocks until a token is
+    available."""
+
+    def __init__(self, rate=1.0, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+def nominatim(user_agent="airports", timeout=10):
+    """Geocoding function of OpenStreetMap Nominatim, returning (lat, lon)
+    or None. Nominatim allows at most one request per second."""
+    from geopy.geocoders import Nominatim
+
+    geolocator = Nominatim(user_agent=user_agent, timeout=timeout)
+
+    def geocode(query):
+        location = geolocator.geocode(query)
+        if location is None:
+            return None
+        return location.latitude, location.longitude
+
+    return geocode
+
+
+class StubGeocoder:
+    """Local geocoder answering from a dict of query: (lat, lon), which
+    records its calls. For running the pipeline without network access."""
+
+    def __init__(self, locations: dict, delay=0.0):
+        self.locations = locations
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, query):
+        with self.lock:
+            self.calls.append(query)
+        time.sleep(self.delay)
+        return self.locations.get(query)
+
+
+class Geocoder:
+    """Cached, rate-limited geocoding of place names.
+
+    `geocode` is a function of a query string returning (lat, lon) or None,
+    such as nominatim() or a StubGeocoder. Results, including places not
+    found, are kept in memory and appended to the JSON lines file `store`,
+    which is read back on start, so each query is sent only once. Queries
+    run in `workers` threads sharing one TokenBucket; failed requests are
+    retried `retries` times with exponential backoff.
+    """
+
+    def __init__(
+        self, geocode, rate=1.0, burst=1, workers=4, retries=2, store=geocode_store
+    ):
+        self.geocode_fn = geocode
+        self.bucket = TokenBucket(rate, burst)
+        self.workers = workers
+        self.retries = retries
+        self.store = store
+        self.lock = threading.Lock()
+        self.cache = {}
+
+        if store is not None and os.path.exists(store):
+            with open(store) as f:
+                for line in f:
+                    record = json.loads(line)
+                    location = record["location"]
+                    self.cache[record["query"]] = location and tuple(location)
+
+    def request(self, query):
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                return self.geocode_fn(query)
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(2**attempt)
+
+    def geocode(self, query):
+        with self.lock:
+            if query in self.cache:
+                return self.cache[query]
+
+        location = self.request(query)
+
+        with self.lock:
+            self.cache[query] = location
+            if self.store is not None:
+                os.makedirs(os.path.dirname(self.store) or ".", exist_ok=True)
+                with open(self.store, "a") as f:
+                    record = dict(query=query, location=location)
+                    f.write(json.dumps(record) + "\n")
+
+        return location
+
+    def geocode_many(self, queries, progress=True):
+        """Locations of all queries as a dict, each unique query sent once."""
+        unique = list(dict.fromkeys(queries))
+        missing = [q for q in unique if q not in self.cache]
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            results = pool.map(self.geocode, missing)
+            list(tqdm(results, total=len(missing), disable=not progress))
+
+        return {q: self.cache[q] for q in unique}
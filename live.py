@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import polyline
+from scipy.spatial import cKDTree
+import location
+from timetable import profile_windows
+
+
+class LRUCache:
+    """Thread-safe least recently used cache with a bounded size."""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                return default
+            self.data.move_to_end(key)
+            return self.data[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+
+class LiveRouter:
+    """On-demand routing for city pairs missing from the precomputed tables.
+
+    Stops within `radius` km of both cities are searched together in one
+    timetable query, which is aborted after `budget` seconds. Results are
+    kept in an LRU cache and, when `store` is given, appended to a JSON lines
+    file that is read back on start.
+    """
+
+    def __init__(
+        self,
+        timetable,
+        airports: pd.DataFrame,
+        radius=5,
+        departure=360,
+        budget=0.5,
+        access_speed=None,
+        cache_size=4096,
+        store=None,
+    ):
+        self.timetable = timetable
+        self.radius = radius
+        self.departure = departure
+        self.budget = budget
+        # km/h to reach a stop from the city center, None for no access time
+        self.access_speed = access_speed
+
+        cities, proj = location.city_table(airports)
+        self.cities = cities.set_index("city")
+
+        x, y = proj(timetable.stop_lon, timetable.stop_lat)
+        self.stop_xy = np.column_stack([x / 1000, y / 1000])
+        self.stop_kd_tree = cKDTree(self.stop_xy)
+
+        self.cache = LRUCache(cache_size)
+        self.store = store
+        self.store_lock = threading.Lock()
+
+        if store is not None and os.path.exists(store):
+            with open(store) as f:
+                for line in f:
+                    record = json.loads(line)
+                    key = (record.pop("city_origin"), record.pop("city_destination"))
+                    self.cache.put(key, record.get("route"))
+
+    def stops_near(self, city):
+        pos = self.cities.loc[city, ["x", "y"]].values.astype(float)
+        idx = np.array(self.stop_kd_tree.query_ball_point(pos, r=self.radius), dtype=int)
+
+        if self.access_speed is None:
+            access = np.zeros(len(idx))
+        else:
+            distances = np.hypot(*(self.stop_xy[idx] - pos).T)
+            access = distances / self.access_speed * 60
+
+        return dict(zip(idx.tolist(), access.tolist()))
+
+    def search(self, origin, destination):
+        tt = self.timetable
+        sources = self.stops_near(origin)
+        targets = self.stops_near(destination)
+
+        if len(sources) == 0 or len(targets) == 0:
+            return None
+
+        journey = tt.earliest_arrival(
+            sources,
+            targets,
+            self.departure,
+            deadline=time.perf_counter() + self.budget,
+        )
+
+        if journey.timed_out:
+            raise TimeoutError(f"{origin} - {destination}: no result in {self.budget}s")
+
+        if len(journey.legs) == 0:
+            return None
+
+        stops = tt.journey_stops(journey)
+
+        return dict(
+            duration=journey.duration,
+            distance=float(tt.journey_distance(journey)),
+            transfers=journey.transfers,
+            coords=polyline.encode(
+                list(zip(tt.stop_lat[stops].tolist(), tt.stop_lon[stops].tolist()))
+            ),
+        )
+
+    def search_profile(self, origin, destination, max_transfers=4):
+        tt = self.timetable
+        sources = self.stops_near(origin)
+        targets = self.stops_near(destination)
+
+        if len(sources) == 0 or len(targets) == 0:
+            return None
+
+        scan = tt.profile_scan(
+            targets,
+            max_transfers=max_transfers,
+            deadline=time.perf_counter() + self.budget,
+        )
+
+        if scan.timed_out:
+            raise TimeoutError(f"{origin} - {destination}: no result in {self.budget}s")
+
+        return tt.profile_from(scan, sources)
+
+    def profile(self, origin, destination, window=60, max_transfers=4):
+        """Shortest journey per departure time window, computed live, empty
+        for unknown cities or when the search runs out of time."""
+        columns = ["window_start", "departure", "arrival", "duration", "transfers"]
+        empty = pd.DataFrame(columns=columns)
+
+        if origin not in self.cities.index or destination not in self.cities.index:
+            return empty
+
+        try:
+            profile = self.search_profile(origin, destination, max_transfers)
+        except TimeoutError:
+            return empty
+
+        if profile is None:
+            return empty
+
+        return profile_windows(profile, window=window).dropna(subset=["duration"])
+
+    def route(self, origin, destination):
+        key = (origin, destination)
+        if key in self.cache:
+            return self.cache.get(key)
+
+        if origin not in self.cities.index or destination not in self.cities.index:
+            return None
+
+        try:
+            result = self.search(origin, destination)
+        except TimeoutError:
+            # not cached, a later request may be luckier
+            return None
+
+        self.cache.put(key, result)
+
+        if self.store is not None:
+            record = dict(city_origin=origin, city_destination=destination, route=result)
+            with self.store_lock, open(self.store, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+        return result
+
+    def routes(self, origin, destination):
+        """Live route as a (possibly empty) table, like the precomputed ones."""
+        result = self.route(origin, destination)
+        if result is None:
+            return pd.DataFrame(columns=["duration", "distance", "coords"])
+        return pd.DataFrame(
+            [dict(city_origin=origin, city_destination=destination) | result]
+        )
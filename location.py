@@ -1,8 +1,13 @@
+import os
+import numpy as np
 import pandas as pd
-import itertools
+import polyline
 from pyproj import Proj, Geod
+from scipy.spatial import cKDTree
 from shapely.geometry import Point, LineString
 import geopandas as gpd
+import artifacts
+import geocode
 
 countries = {
     "AL": "Albania",
@@ -39,62 +44,209 @@ countries = {
 
 world = gpd.read_parquet("data/naturalearth_lowres.parquet")
 
+# country ids are the row positions in `world`
+country_names = world.ADMIN.tolist()
+country_ids = {name: i for i, name in enumerate(country_names)}
 
-def gen_city_pairs(airports: pd.DataFrame = None):
 
+def city_table(airports: pd.DataFrame = None):
+    """Unique cities with integer ids and projected coordinates (km).
+
+    The projection is computed once from all cities, and is the same as
+    the one previously derived from the full city pair table.
+    """
     if airports is None:
         airports = pd.read_csv("data/airports.csv")
 
-    city_pairs = pd.DataFrame(
-        itertools.product(airports["city"].unique(), repeat=2),
-        columns=["city_origin", "city_destination"],
-    ).query("city_origin!=city_destination")
-
-    city_pairs = (
-        city_pairs.merge(
-            airports[["city", "city_latitude", "city_longitude"]],
-            left_on="city_origin",
-            right_on="city",
-        )
-        .merge(
-            airports[["city", "city_latitude", "city_longitude"]],
-            left_on="city_destination",
-            right_on="city",
-        )
-        .drop(columns=["city_x", "city_y"])
-        .rename(
-            columns=dict(
-                city_latitude_x="lat0",
-                city_longitude_x="lon0",
-                city_latitude_y="lat1",
-                city_longitude_y="lon1",
-            )
-        )
-        .drop_duplicates(["city_origin", "city_destination"])
+    cities = (
+        airports.drop_duplicates("city")[["city", "city_latitude", "city_longitude"]]
+        .rename(columns=dict(city_latitude="lat", city_longitude="lon"))
+        .reset_index(drop=True)
+        .rename_axis("city_id")
+        .reset_index()
     )
 
     proj = Proj(
         proj="lcc",
         ellps="WGS84",
-        lat_1=city_pairs.lat0.min(),
-        lat_2=city_pairs.lat0.max(),
-        lat_0=city_pairs.lat0.mean(),
-        lon_0=city_pairs.lon0.mean(),
+        lat_1=cities.lat.min(),
+        lat_2=cities.lat.max(),
+        lat_0=cities.lat.mean(),
+        lon_0=cities.lon.mean(),
+    )
+
+    x, y = proj(cities.lon.values, cities.lat.values)
+    cities = cities.assign(x=x / 1000, y=y / 1000)
+
+    return cities, proj
+
+
+class AirportIndex:
+    """KD-tree of airports on projected coordinates (km), with integer
+    airport ids being the row positions in `airports`."""
+
+    def __init__(self, airports: pd.DataFrame, proj):
+        self.airports = airports.reset_index(drop=True)
+        self.codes = pd.Index(self.airports.airport)
+
+        x, y = proj(
+            self.airports.airport_longitude.values,
+            self.airports.airport_latitude.values,
+        )
+        self.xy = np.column_stack([x / 1000, y / 1000])
+        self.tree = cKDTree(self.xy)
+
+    def ids(self, codes):
+        """Airport ids of airport codes, -1 for unknown codes."""
+        return self.codes.get_indexer(codes)
+
+    def within(self, x, y, radius):
+        """All (point, airport) id pairs less than `radius` km apart."""
+        neighbors = self.tree.query_ball_point(np.column_stack([x, y]), r=radius)
+        point = np.repeat(np.arange(len(neighbors)), [len(n) for n in neighbors])
+        airport = np.fromiter(
+            (a for n in neighbors for a in n), dtype=int, count=len(point)
+        )
+        return point, airport
+
+    def city_airports(self, cities: pd.DataFrame, radius=None):
+        """(city_id, airport_id) pairs: the airports of each city, and with
+        `radius` also all other airports within `radius` km of it."""
+        # airports of cities missing from `cities` are only linked by radius
+        row = pd.Index(cities.city).get_indexer(self.airports.city)
+        known = row >= 0
+        links = [(cities.city_id.values[row[known]], np.flatnonzero(known))]
+
+        if radius is not None:
+            point, airport = self.within(cities.x.values, cities.y.values, radius)
+            links.append((cities.city_id.values[point], airport))
+
+        city, airport = map(np.concatenate, zip(*links))
+        pairs = np.column_stack([city, airport]).astype(int)
+        return np.unique(pairs, axis=0).T
+
+
+def city_pair_ids(cities: pd.DataFrame, origins=None, min_distance=None, max_distance=None):
+    """Integer ids of all ordered city pairs, optionally within a distance band.
+
+    Distances are measured between projected city coordinates, in km.
+    """
+    n = cities.shape[0]
+    dest = np.arange(n)
+    orig = dest if origins is None else np.asarray(origins)
+
+    i = np.repeat(orig, n)
+    j = np.tile(dest, len(orig))
+    mask = i != j
+
+    if min_distance is not None or max_distance is not None:
+        x, y = cities.x.values, cities.y.values
+        d = np.hypot(x[i] - x[j], y[i] - y[j])
+        if min_distance is not None:
+            mask &= d >= min_distance
+        if max_distance is not None:
+            mask &= d <= max_distance
+
+    return i[mask], j[mask]
+
+
+def city_pair_frame(cities: pd.DataFrame, i, j):
+    city, lat, lon = cities.city.values, cities.lat.values, cities.lon.values
+    x, y = cities.x.values, cities.y.values
+
+    return pd.DataFrame(
+        dict(
+            city_origin=city[i],
+            city_destination=city[j],
+            lat0=lat[i],
+            lon0=lon[i],
+            lat1=lat[j],
+            lon1=lon[j],
+            x0=x[i],
+            x1=x[j],
+            y0=y[i],
+            y1=y[j],
+        )
     )
 
-    x0, y0 = proj(city_pairs.lon0, city_pairs.lat0)
-    x1, y1 = proj(city_pairs.lon1, city_pairs.lat1)
 
-    city_pairs = city_pairs.assign(
-        x0=x0 / 1000, x1=x1 / 1000, y0=y0 / 1000, y1=y1 / 1000
+def iter_city_pairs(
+    airports: pd.DataFrame = None,
+    chunksize=1_000_000,
+    min_distance=None,
+    max_distance=None,
+):
+    """Yield city pairs in chunks of about `chunksize` rows, grouped by origin."""
+    cities, proj = city_table(airports)
+    n = cities.shape[0]
+    step = max(1, chunksize // max(n - 1, 1))
+
+    for start in range(0, n, step):
+        i, j = city_pair_ids(
+            cities, np.arange(start, min(start + step, n)), min_distance, max_distance
+        )
+        yield city_pair_frame(cities, i, j)
+
+
+def gen_city_pairs(
+    airports: pd.DataFrame = None,
+    min_distance=None,
+    max_distance=None,
+    cache=True,
+):
+    """All ordered pairs of distinct cities, with projected coordinates.
+
+    When reading data/airports.csv, the result is cached in the artifact
+    cache, keyed by the content of the airports file and the distance band.
+    """
+    fairports = None
+
+    if airports is None:
+        fairports = "data/airports.csv"
+        airports = pd.read_csv(fairports)
+
+    cities, proj = city_table(airports)
+
+    def compute():
+        i, j = city_pair_ids(
+            cities, min_distance=min_distance, max_distance=max_distance
+        )
+        return city_pair_frame(cities, i, j)
+
+    if fairports is None or not cache:
+        return compute(), proj
+
+    city_pairs = artifacts.cached(
+        "city_pairs",
+        compute,
+        inputs=[fairports],
+        params=dict(min_distance=min_distance, max_distance=max_distance),
+        code=[city_table, city_pair_ids, city_pair_frame],
+        fmt="parquet",
     )
 
     return city_pairs, proj
 
 
-def get_osm_route(lonlats, server_url="http://router.project-osrm.org"):
+public_osrm = "http://router.project-osrm.org"
+
+# OSRM server for car and bus routes, set COPULA_OSRM_URL for a local one
+osrm_server = os.environ.get("COPULA_OSRM_URL", public_osrm)
+
+# the public demo server is shared, at most one request per second
+public_osrm_limit = geocode.TokenBucket(rate=1.0)
+
+
+def get_osm_route(lonlats, server_url=None):
+    """OSRM route through the points; check that `code` is "Ok" before
+    reading `routes`."""
     import requests
 
+    if server_url is None:
+        server_url = osrm_server
+    if server_url == public_osrm:
+        public_osrm_limit.acquire()
+
     lonlats_str = ";".join([f"{c[0]},{c[1]}" for c in lonlats])
 
     osrm_url = f"{server_url}/route/v1/driving"
@@ -105,6 +257,30 @@ def get_osm_route(lonlats, server_url="http://router.project-osrm.org"):
     return route
 
 
+# Douglas-Peucker tolerance (degrees) of the route tier used from each zoom level
+zoom_tolerances = {0: 0.05, 6: 0.01, 9: 0.002, 12: 0}
+
+
+def simplify_tiers(coords, tolerances=zoom_tolerances):
+    """Encoded polylines of a route for each zoom tier, as coords_z{zoom}."""
+    line = LineString(coords)
+    return {
+        f"coords_z{zoom}": polyline.encode(
+            list(line.simplify(tolerance).coords) if tolerance > 0 else coords
+        )
+        for zoom, tolerance in tolerances.items()
+    }
+
+
+def tier_column(columns, zoom=None):
+    """Most detailed tier column for a zoom level, `coords` when not tiered."""
+    if zoom is None:
+        return "coords"
+
+    tiers = [z for z in zoom_tolerances if z <= zoom and f"coords_z{z}" in columns]
+    return f"coords_z{max(tiers)}" if tiers else "coords"
+
+
 def route_countries(coords_lonlat):
 
     coords = [Point((lat, lon)) for lon, lat in coords_lonlat]
@@ -126,3 +302,11 @@ def route_countries(coords_lonlat):
         coutires[country["ADMIN"]] = round(distance / total_distance, 2)
 
     return coutires
+
+
+def country_vector(countries: dict):
+    """Fractions from route_countries() as an array indexed by country id."""
+    vector = np.zeros(len(country_names))
+    for country, fraction in countries.items():
+        vector[country_ids[country]] += fraction
+    return vector
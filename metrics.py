@@ -0,0 +1,132 @@
+import os
+import time
+import bisect
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+
+# add a Server-Timing header with per-stage durations to each response
+server_timing = os.environ.get("COPULA_SERVER_TIMING", "0") == "1"
+
+# seconds, similar to the prometheus_client defaults with finer low end
+default_buckets = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Histogram:
+    """Minimal Prometheus histogram with labels.
+
+    Observations only take a lock and a bisect, so it is cheap enough to
+    keep enabled in production.
+    """
+
+    def __init__(self, name, documentation, labelnames, buckets=default_buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.counts = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        self.sums = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[labelvalues][i] += 1
+            self.sums[labelvalues] += value
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+
+        with self.lock:
+            series = [(k, list(v), self.sums[k]) for k, v in self.counts.items()]
+
+        for labelvalues, counts, total in sorted(series):
+            labels = ",".join(
+                f'{n}="{v}"' for n, v in zip(self.labelnames, labelvalues)
+            )
+            sep = "," if labels else ""
+
+            cumulative = 0
+            for le, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{{{labels}{sep}le="{le}"}} {cumulative}'
+                )
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+
+        return "\n".join(lines)
+
+
+stage_seconds = Histogram(
+    "copula_stage_duration_seconds",
+    "Duration of each stage of a route request.",
+    ["stage", "mode"],
+)
+
+request_seconds = Histogram(
+    "copula_request_duration_seconds",
+    "Duration of HTTP requests.",
+    ["handler", "method", "status"],
+)
+
+registry = [stage_seconds, request_seconds]
+
+# stage timings of the current request, used for the Server-Timing header
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def stage(name: str, mode: str = "all"):
+    """Time a block of code as a stage of the current request."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        stage_seconds.observe(dt, name, mode)
+
+        timings = request_timings.get()
+        if timings is not None:
+            key = name if mode == "all" else f"{mode}_{name}"
+            timings[key] = timings.get(key, 0) + dt
+
+
+def start_request():
+    """Start collecting stage timings for a request.
+
+    The dict is shared by reference, so stages timed in the threadpool
+    (where sync endpoints run on a copied context) are visible here.
+    """
+    timings = {}
+    request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings: dict):
+    return ", ".join(f"{k};dur={v * 1000:.2f}" for k, v in timings.items())
+
+
+def render():
+    return "\n".join(h.render() for h in registry) + "\n"
@@ -0,0 +1,213 @@
+# %%
+import numpy as np
+import pandas as pd
+import polyline
+from scipy.spatial import cKDTree
+from tqdm import tqdm
+import location
+from timetable import Timetable
+import validate
+from profiler import StageProfiler
+
+
+# %%
+def flight_timetable(
+    flight_routes: pd.DataFrame, first=360, last=1320, checkin=90, deboard=30
+):
+    """Timetable of flights, spread evenly over the day.
+
+    flight_routes.csv only has the number of daily flights, so departures
+    are placed between `first` and `last` (minutes). Check-in and deboarding
+    times are included in each flight connection.
+    """
+    od = flight_routes.drop_duplicates(["origin", "destination"]).reset_index(drop=True)
+
+    airports = pd.concat(
+        [
+            od[["origin", "airport_latitude_origin", "airport_longitude_origin"]]
+            .set_axis(["airport", "lat", "lon"], axis=1),
+            od[
+                [
+                    "destination",
+                    "airport_latitude_destination",
+                    "airport_longitude_destination",
+                ]
+            ].set_axis(["airport", "lat", "lon"], axis=1),
+        ]
+    ).drop_duplicates("airport").reset_index(drop=True)
+
+    airport_index = pd.Series(airports.index, index=airports.airport)
+
+    n = np.maximum(od.daily_flights.round().fillna(1).astype(int).values, 1)
+    row = np.repeat(np.arange(od.shape[0]), n)
+    k = np.arange(row.shape[0]) - np.repeat(np.cumsum(n) - n, n)
+    departure = first + (last - first) * (k + 0.5) / n[row]
+
+    origin, destination = od.origin.values[row], od.destination.values[row]
+
+    return Timetable(
+        dep_stop=airport_index[origin].values,
+        arr_stop=airport_index[destination].values,
+        dep_time=departure - checkin,
+        arr_time=departure + od.duration.values[row] + deboard,
+        trip=np.arange(row.shape[0]),
+        trip_ids=[f"{o}-{d}-{i}" for o, d, i in zip(origin, destination, k)],
+        stop_ids=airports.airport.values,
+        stop_names=airports.airport.values,
+        stop_lat=airports.lat.values,
+        stop_lon=airports.lon.values,
+    )
+
+
+def transfer_links(
+    tt: Timetable,
+    proj,
+    airports=None,
+    walk_radius=1.0,
+    walk_speed=4.5,
+    airport_radius=30,
+    shuttle_speed=40,
+    penalty=5,
+):
+    """Transfer links between stops within walking distance, and between
+    airports and stops within a short shuttle ride.
+
+    `airports` is a boolean mask of airport stops. Link times are travel
+    time plus a `penalty` (minutes) for changing between networks.
+    """
+    x, y = proj(tt.stop_lon, tt.stop_lat)
+    xy = np.column_stack([x / 1000, y / 1000])
+    tree = cKDTree(xy)
+
+    pairs = tree.query_pairs(r=walk_radius, output_type="ndarray")
+    fp_from = [pairs[:, 0], pairs[:, 1]]
+    fp_to = [pairs[:, 1], pairs[:, 0]]
+    speed = [np.full(len(pairs) * 2, walk_speed)]
+
+    if airports is not None and airports.any():
+        airport_idx = np.flatnonzero(airports)
+        near = tree.query_ball_point(xy[airport_idx], r=airport_radius)
+        a = np.repeat(airport_idx, [len(n) for n in near])
+        b = np.concatenate([np.asarray(n, dtype=int) for n in near])
+        keep = a != b
+        fp_from += [a[keep], b[keep]]
+        fp_to += [b[keep], a[keep]]
+        speed.append(np.full(keep.sum() * 2, shuttle_speed))
+
+    fp_from, fp_to = np.concatenate(fp_from), np.concatenate(fp_to)
+    distance = np.hypot(*(xy[fp_from] - xy[fp_to]).T)
+    minutes = distance / np.concatenate(speed) * 60 + penalty
+
+    # keep the fastest link between two stops
+    links = (
+        pd.DataFrame(dict(fp_from=fp_from, fp_to=fp_to, minutes=minutes))
+        .sort_values("minutes")
+        .drop_duplicates(["fp_from", "fp_to"])
+    )
+
+    return links.fp_from.values, links.fp_to.values, links.minutes.values
+
+
+def build_multimodal(timetables: dict, proj, transfer=10, **kwargs):
+    """Join train, bus and flight timetables through transfer links."""
+    joined = Timetable.concat(timetables, transfer=transfer)
+
+    airports = np.zeros(joined.n_stops, dtype=bool)
+    if "flight" in timetables:
+        offset = Timetable.stop_offsets(timetables)["flight"]
+        airports[offset : offset + timetables["flight"].n_stops] = True
+
+    footpaths = transfer_links(joined, proj, airports, **kwargs)
+
+    return Timetable.concat(timetables, footpaths=footpaths, transfer=transfer)
+
+
+# %%
+def create_multimodal_routes(
+    tt: Timetable,
+    city_pairs: pd.DataFrame,
+    proj,
+    radius=10,
+    departure=360,
+    access_speed=30,
+):
+    """Earliest arrival multimodal journey for each city pair."""
+    x, y = proj(tt.stop_lon, tt.stop_lat)
+    xy = np.column_stack([x / 1000, y / 1000])
+    stop_kd_tree = cKDTree(xy)
+
+    def stops_near(pos):
+        idx = np.array(stop_kd_tree.query_ball_point(pos, r=radius), dtype=int)
+        access = np.hypot(*(xy[idx] - pos).T) / access_speed * 60
+        return dict(zip(idx.tolist(), access.tolist()))
+
+    results = []
+
+    for cp in tqdm(city_pairs.itertuples(), total=city_pairs.shape[0]):
+        sources = stops_near(np.array([cp.x0, cp.y0]))
+        targets = stops_near(np.array([cp.x1, cp.y1]))
+
+        if len(sources) == 0 or len(targets) == 0:
+            continue
+
+        journey = tt.earliest_arrival(sources, targets, departure)
+        if len(journey.legs) == 0:
+            continue
+
+        stops = tt.journey_stops(journey)
+        modes = tt.journey_modes(journey)
+
+        results.append(
+            dict(
+                city_origin=cp.city_origin,
+                city_destination=cp.city_destination,
+                lat0=cp.lat0,
+                lon0=cp.lon0,
+                lat1=cp.lat1,
+                lon1=cp.lon1,
+                departure=journey.departure,
+                arrival=journey.arrival,
+                duration=journey.duration,
+                distance=tt.journey_distance(journey),
+                transfers=journey.transfers,
+                modes="+".join(dict.fromkeys(modes)),
+                coords=polyline.encode(
+                    list(zip(tt.stop_lat[stops].tolist(), tt.stop_lon[stops].tolist()))
+                ),
+            )
+        )
+
+    return pd.DataFrame(results)
+
+
+# %%
+if __name__ == "__main__":
+    profiler = StageProfiler("multimodal")
+
+    with profiler.stage("city_pairs") as s:
+        city_pairs, proj = location.gen_city_pairs()
+        s.rows = city_pairs.shape[0]
+
+    # %%
+    with profiler.stage("timetable") as s:
+        timetables = dict(
+            train=Timetable.load("data/train_timetable.npz"),
+            bus=Timetable.load("data/bus_timetable.npz"),
+            flight=flight_timetable(pd.read_csv("data/flight_routes.csv")),
+        )
+        tt = build_multimodal(timetables, proj)
+        tt.save("data/multimodal_timetable.npz")
+        s.rows = tt.n_connections
+
+    # %%
+    with profiler.stage("routing") as s:
+        multimodal_routes = create_multimodal_routes(tt, city_pairs, proj)
+        s.rows = multimodal_routes.shape[0]
+
+    with profiler.stage("validation") as s:
+        multimodal_routes, _ = validate.validate_routes(multimodal_routes, "multimodal")
+        s.rows = multimodal_routes.shape[0]
+
+    # %%
+    multimodal_routes.to_parquet("data/multimodal_routes.parquet", index=False)
+    profiler.save()
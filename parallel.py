@@ -0,0 +1,86 @@
+import os
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+# read-only objects of the parent, inherited copy-on-write by forked workers
+_shared = {}
+
+
+def shared(name):
+    return _shared[name]
+
+
+def fork_map(func, tasks, shared=None, processes=None, chunksize=1):
+    """Map `func` over `tasks` in forked worker processes.
+
+    Objects in `shared` (graphs, KD-trees, large tables) are published
+    before the pool is forked, so workers read them with `shared(name)`
+    without pickling. Results come back in the order of `tasks`. Without
+    fork (Windows), or with one process, tasks run serially.
+    """
+    _shared.clear()
+    _shared.update(shared or {})
+
+    if processes is None:
+        processes = os.cpu_count()
+
+    try:
+        ctx = multiprocessing.get_context("fork")
+    except ValueError:
+        # fork is not available on this platform
+        ctx = None
+
+    try:
+        if ctx is None or processes <= 1 or len(tasks) <= 1:
+            return [func(task) for task in tasks]
+
+        with ctx.Pool(min(processes, len(tasks))) as pool:
+            return pool.map(func, tasks, chunksize=chunksize)
+    finally:
+        _shared.clear()
+
+
+def shard_by(frame: pd.DataFrame, column, n_shards):
+    """Split row positions into shards of similar size, keeping the rows of
+    each value of `column` together and in order of first appearance."""
+    codes, _ = pd.factorize(frame[column])
+    sizes = np.bincount(codes)
+
+    # largest groups first, each to the currently smallest shard
+    shard_of_group = np.zeros(len(sizes), dtype=int)
+    load = np.zeros(max(min(n_shards, len(sizes)), 1))
+    for group in np.argsort(-sizes, kind="stable"):
+        shard = int(np.argmin(load))
+        shard_of_group[group] = shard
+        load[shard] += sizes[group]
+
+    shard_of_row = shard_of_group[codes]
+    return [np.flatnonzero(shard_of_row == s) for s in range(len(load))]
+
+
+def concat_in_order(results, frame: pd.DataFrame, keys):
+    """Concatenate result tables, sorted (stably) by the row order of their
+    `keys` in `frame`, so the output does not depend on the sharding."""
+    merged = pd.concat(results, ignore_index=True)
+    if merged.shape[0] == 0:
+        return merged
+
+    position = pd.Series(
+        np.arange(frame.shape[0]), index=pd.MultiIndex.from_frame(frame[keys])
+    )
+    order = position.reindex(pd.MultiIndex.from_frame(merged[keys])).values
+    return merged.iloc[np.argsort(order, kind="stable")].reset_index(drop=True)
+
+
+def map_groups(func, frame, column, keys, shared=None, processes=None):
+    """Run `func(rows)` on shards of `frame` grouped by `column` in forked
+    workers, and merge the result tables in the row order of `frame`.
+
+    Shards are smaller than frame / processes, so that workers finishing
+    early pick up more work.
+    """
+    processes = processes or os.cpu_count()
+    shards = shard_by(frame, column, 4 * processes)
+    results = fork_map(func, shards, shared=shared, processes=processes)
+    return concat_in_order(results, frame, keys)
@@ -1,22 +1,32 @@
 # %%
+import os
 import pandas as pd
 import numpy as np
 from scipy.spatial import cKDTree
 import polyline
-import itertools
 from tqdm import tqdm
 import location
+import stops
 import networkx as nx
 import visualize
+import validate
+import artifacts
+import parallel
+from profiler import StageProfiler
+from timetable import Timetable
+from service_calendar import ServiceCalendar, select_trips
 
 # %%
 pd.options.display.max_columns = 100
 
+bus_companies = ["flixbus", "alsa", "blabla"]
+
+
 # %%
 def generate_gtfs_routes():
     gtfs_bus_routes = []
 
-    for company in ["flixbus", "alsa", "blabla"]:
+    for company in bus_companies:
         # for company in ["alsa"]:
 
         gtfspath = f"data/gtfs/bus/gtfs_{company}"
@@ -67,9 +77,59 @@ def generate_gtfs_routes():
     return gtfs_bus_routes
 
 
-def process_gtfs_routes(gtfs_bus_routes, proj):
+def create_timetable(companies=bus_companies, travel_dates=None, n_days=1):
+    """Timetable of the bus trips running on the travel date(s), for live
+    routing.
+
+    Unlike generate_gtfs_routes, every route is kept. Stop, trip and service
+    ids are prefixed with the company, as they are only unique within a
+    feed. Without `travel_dates`, the busiest date of each feed is used, as
+    for trains (see service_calendar.select_trips).
+    """
+    stop_times_all = []
+    calendars = []
+
+    for company in companies:
+        gtfspath = f"data/gtfs/bus/gtfs_{company}"
+        prefix = f"{company}:"
+
+        stop_times = pd.read_csv(
+            f"{gtfspath}/stop_times.txt", dtype={"stop_id": str, "trip_id": str}
+        )
+        stops_ = pd.read_csv(f"{gtfspath}/stops.txt", dtype={"stop_id": str})
+        trips = pd.read_csv(
+            f"{gtfspath}/trips.txt", dtype={"trip_id": str, "service_id": str}
+        )
+        calendars.append(ServiceCalendar.read_gtfs(gtfspath, prefix=prefix))
+
+        stop_times_all.append(
+            stop_times.merge(stops_[["stop_id", "stop_name", "stop_lat", "stop_lon"]])
+            .merge(trips[["trip_id", "service_id"]])
+            .assign(
+                stop_id=lambda x: prefix + x.stop_id,
+                trip_id=lambda x: prefix + x.trip_id,
+                service_id=lambda x: prefix + x.service_id,
+            )
+        )
+
+    calendar = ServiceCalendar.concat(calendars)
+    if travel_dates is None:
+        travel_dates = calendar.busiest_dates()
+
+    stop_times = pd.concat(stop_times_all, ignore_index=True)
+    return Timetable.from_stop_times(
+        select_trips(stop_times, calendar, travel_dates, n_days=n_days)
+    )
+
+
+def process_gtfs_routes(gtfs_bus_routes, proj, radius=None):
     x, y = proj(gtfs_bus_routes.stop_lon, gtfs_bus_routes.stop_lat)
     gtfs_bus_routes = gtfs_bus_routes.assign(stop_x=x / 1000, stop_y=y / 1000)
+
+    # optionally merge stops within radius km into stations, as for trains
+    if radius is not None:
+        gtfs_bus_routes = stops.unify_stops(gtfs_bus_routes, radius=radius)
+
     return gtfs_bus_routes
 
 
@@ -114,11 +174,86 @@ def create_graph(gtfs_bus_routes):
     return G, edges, nodes
 
 
+def bus_services(gtfs_bus_routes: pd.DataFrame):
+    """Service group of each bus stop. The graph is undirected, so a stop
+    is served by every trip calling at it, in both directions."""
+    served = gtfs_bus_routes[["stop_id", "trip_id"]].dropna()
+    groups, _ = stops.service_groups(
+        served.assign(source=served.stop_id, target=served.stop_id)
+    )
+    return groups
+
+
+def shortest_paths_from(G: nx.Graph, source, targets):
+    """All paths with the fewest stops from `source` to each of `targets`,
+    as a dict, found with one breadth-first search. Like
+    nx.all_shortest_paths for each target, skipping the NaN node."""
+    remaining = set(targets) - {source}
+    pred = {source: []}
+    level = [source] if source in G else []
+    found = []
+
+    while level and remaining:
+        next_level = {}
+        for node in level:
+            for neighbor in G.neighbors(node):
+                if pd.isna(neighbor):
+                    continue
+                if neighbor not in pred:
+                    pred[neighbor] = [node]
+                    next_level[neighbor] = True
+                elif neighbor in next_level:
+                    pred[neighbor].append(node)
+        level = list(next_level)
+        found += [n for n in level if n in remaining]
+        remaining.difference_update(level)
+
+    def paths_to(node):
+        if len(pred[node]) == 0:
+            return [[node]]
+        return [path + [node] for p in pred[node] for path in paths_to(p)]
+
+    return {target: paths_to(target) for target in found}
+
+
 def create_routes(
     G: nx.Graph,
     gtfs_bus_routes: pd.DataFrame,
     city_pairs: pd.DataFrame,
+    proj,
+    processes=1,
+    services=None,
+    prune=True,
 ):
+    """Bus routes of each city pair, between stops within 10 km.
+
+    All paths with the fewest stops between each origin and destination
+    stop are kept, with one search per origin stop, and routes are chosen
+    by distance downstream. With `prune`, stops without service are left
+    out; the bus graph is undirected, so no stop dominates another.
+
+    With `processes` > 1, city pairs are grouped by origin and routed in
+    forked workers sharing the graph; the result is the same as serial.
+    """
+    if prune and services is None:
+        services = bus_services(gtfs_bus_routes)
+
+    if processes > 1:
+        return parallel.map_groups(
+            _routes_task,
+            city_pairs,
+            "city_origin",
+            keys=["city_origin", "city_destination"],
+            shared=dict(
+                G=G,
+                gtfs_bus_routes=gtfs_bus_routes,
+                city_pairs=city_pairs,
+                proj=proj,
+                kwargs=dict(services=services, prune=prune),
+            ),
+            processes=processes,
+        )
+
     unique_bus_stops = gtfs_bus_routes.drop_duplicates("stop_id").reset_index(drop=True)
 
     x, y = proj(unique_bus_stops.stop_lon, unique_bus_stops.stop_lat)
@@ -131,54 +266,63 @@ def create_routes(
 
     stop_kd_tree = cKDTree(unique_bus_stops[["stop_x", "stop_y"]].values)
 
+    def candidates(pos):
+        # stops within 10 km, with their distance
+        idx = stop_kd_tree.query_ball_point(pos, r=10)
+        offset = unique_bus_stops.loc[idx, ["stop_x", "stop_y"]].values - pos
+        return dict(
+            zip(unique_bus_stops.loc[idx, "stop_id"].values, np.hypot(*offset.T))
+        )
+
     results = []
 
     for i, cp in tqdm(city_pairs.iterrows(), total=city_pairs.shape[0]):
 
-        orig_pos = cp[["x0", "y0"]].to_list()
-        dest_pos = cp[["x1", "y1"]].to_list()
+        orig_stops = candidates(cp[["x0", "y0"]].values.astype(float))
+        dest_stops = candidates(cp[["x1", "y1"]].values.astype(float))
 
-        # query stops with in 10 km
-        orig_bus_stop_idx = stop_kd_tree.query_ball_point(orig_pos, r=10)
-        dest_bus_stop_idx = stop_kd_tree.query_ball_point(dest_pos, r=10)
+        if prune:
+            orig_stops = stops.prune_candidates(orig_stops, services)
+            dest_stops = stops.prune_candidates(dest_stops, services)
 
-        orig_stops = unique_bus_stops.loc[orig_bus_stop_idx]
-        dest_stops = unique_bus_stops.loc[dest_bus_stop_idx]
+        # staying at the origin stop is not a route
+        dest_stops = {d: t for d, t in dest_stops.items() if d not in orig_stops}
 
-        all_path_sets = [
-            list(nx.all_shortest_paths(G, s, t))
-            for s, t in itertools.product(
-                orig_stops.stop_id.values, dest_stops.stop_id.values
-            )
-        ]
-        path_sets = [
-            path for paths in all_path_sets for path in paths if np.nan not in path
-        ]
+        path_sets = []
+        for o in orig_stops:
+            paths = shortest_paths_from(G, o, dest_stops)
+            path_sets += [path for d in dest_stops for path in paths.get(d, [])]
 
-        for stops in path_sets:
+        for stop_ids in path_sets:
 
             coordinates = [
                 gtfs_bus_routes.query(f"stop_id=='{stop}'")
                 .iloc[0][["stop_lon", "stop_lat"]]
                 .values
-                for stop in stops
+                for stop in stop_ids
             ]
 
             route_reconstruct = location.get_osm_route(coordinates)
+            if route_reconstruct.get("code") != "Ok":
+                print("No OSRM route:", stop_ids, route_reconstruct.get("code"))
+                continue
 
             results.append(
                 cp.to_dict()
                 | dict(
-                    stop_ids=stops,
+                    stop_ids=stop_ids,
                     duration=route_reconstruct["routes"][0]["duration"] / 60,
                     distance=route_reconstruct["routes"][0]["distance"] / 1000,
                     coords=polyline.encode(
                         [
                             (G.nodes[stop]["latitude"], G.nodes[stop]["longitude"])
-                            for stop in stops
+                            for stop in stop_ids
                         ]
                     ),
                     coords_full=route_reconstruct["routes"][0]["geometry"],
+                    **location.simplify_tiers(
+                        polyline.decode(route_reconstruct["routes"][0]["geometry"])
+                    ),
                 )
             )
 
@@ -186,21 +330,68 @@ def create_routes(
     return bus_routes
 
 
+def _routes_task(rows):
+    return create_routes(
+        parallel.shared("G"),
+        parallel.shared("gtfs_bus_routes"),
+        parallel.shared("city_pairs").iloc[rows],
+        parallel.shared("proj"),
+        **parallel.shared("kwargs"),
+    )
+
+
 if __name__ == "__main__":
+    profiler = StageProfiler("bus")
+
     # %%
-    # gtfs_bus_routes = generate_gtfs_routes()
-    gtfs_bus_routes = pd.read_parquet("data/bus_routes_gtfs.parquet")
+    with profiler.stage("gtfs_load") as s:
+        # gtfs_bus_routes = generate_gtfs_routes()
+        gtfs_bus_routes = pd.read_parquet("data/bus_routes_gtfs.parquet")
+        s.rows = gtfs_bus_routes.shape[0]
+
+    with profiler.stage("timetable") as s:
+        timetable = create_timetable()
+        timetable.save("data/bus_timetable.npz")
+        s.rows = timetable.n_connections
 
     # %%
-    city_pairs, proj = location.gen_city_pairs()
-    G, edges, nodes = create_graph(gtfs_bus_routes)
-    bus_routes = create_routes(G, gtfs_bus_routes, city_pairs)
+    with profiler.stage("city_pairs") as s:
+        city_pairs, proj = location.gen_city_pairs()
+        s.rows = city_pairs.shape[0]
+
+    with profiler.stage("graph_build") as s:
+        G, edges, nodes = artifacts.cached(
+            "bus_graph",
+            lambda: create_graph(gtfs_bus_routes),
+            inputs=["data/bus_routes_gtfs.parquet"],
+            code=[create_graph],
+        )
+        s.rows = edges.shape[0]
+
+    with profiler.stage("routing_osrm") as s:
+        # in parallel only with a local OSRM server, not the public one
+        local = location.osrm_server != location.public_osrm
+        processes = os.cpu_count() if local else 1
+        bus_routes = create_routes(
+            G, gtfs_bus_routes, city_pairs, proj, processes=processes
+        )
+        s.rows = bus_routes.shape[0]
+
+    with profiler.stage("validation") as s:
+        bus_routes, _ = validate.validate_routes(bus_routes, "bus")
+        s.rows = bus_routes.shape[0]
 
     # %%
     bus_routes.to_parquet("data/bus_routes.parquet", index=False)
+    profiler.save()
 
     # %%
     bus_routes = pd.read_parquet("data/bus_routes.parquet")
 
     # %%
     visualize.draw_sample_routes(bus_routes)
+
+    # %%
+    # QA plots of all routes, with COPULA_QA_IMAGES=1
+    if visualize.qa_images:
+        visualize.export_route_images(bus_routes, "data/qa/bus")
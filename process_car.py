@@ -5,21 +5,30 @@ import location
 import visualize
 import shapely
 import polyline
+import validate
+from profiler import StageProfiler
 
 # %%
 if __name__ == "__main__":
-    city_pairs, proj = location.gen_city_pairs()
+    profiler = StageProfiler("car")
+
+    with profiler.stage("city_pairs") as s:
+        city_pairs, proj = location.gen_city_pairs()
+        s.rows = city_pairs.shape[0]
 
     # %%
+    profiler.start("routing_osrm")
     route_list = []
 
     for i, cp in tqdm(city_pairs.iterrows(), total=city_pairs.shape[0]):
         route = location.get_osm_route([(cp.lon0, cp.lat0), (cp.lon1, cp.lat1)])
+        if route.get("code") != "Ok":
+            print("No OSRM route:", cp.city_origin, cp.city_destination)
+            continue
 
+        coords_full = polyline.decode(route["routes"][0]["geometry"])
         coords_simplified = (
-            shapely.LineString(polyline.decode(route["routes"][0]["geometry"]))
-            .simplify(tolerance=0.01)
-            .coords
+            shapely.LineString(coords_full).simplify(tolerance=0.01).coords
         )
 
         route_list.append(
@@ -28,18 +37,30 @@ if __name__ == "__main__":
                 duration=route["routes"][0]["duration"] / 60,  # -> minutes
                 distance=route["routes"][0]["distance"] / 1000,  # -> km
                 coords=polyline.encode(coords_simplified),
+                **location.simplify_tiers(coords_full),
             )
         )
 
     car_routes = city_pairs.merge(
         pd.DataFrame(route_list).set_index("index"), left_index=True, right_index=True
     )
+    profiler.stop(rows=car_routes.shape[0])
+
+    with profiler.stage("validation") as s:
+        car_routes, _ = validate.validate_routes(car_routes, "car")
+        s.rows = car_routes.shape[0]
 
     #%%
     car_routes.to_parquet("data/car_routes.parquet", index=False)
+    profiler.save()
 
     # %%
     car_routes = pd.read_parquet("data/car_routes.parquet")
 
     #%%
     visualize.draw_sample_routes(car_routes)
+
+    # %%
+    # QA plots of all routes, with COPULA_QA_IMAGES=1
+    if visualize.qa_images:
+        visualize.export_route_images(car_routes, "data/qa/car")
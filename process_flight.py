@@ -1,97 +1,190 @@
 # %%
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from geopy.geocoders import Nominatim
+import location
 from location import countries
 import openap
-import itertools
+import glob
+import emission
+import geocode
+from profiler import StageProfiler
 
 # %%
 # Eurocontrol flight data
 
-
-def process_ectl_data(file, fout=None):
+ectl_columns = {
+    "ICAO Flight Type": "scheduled",
+    "FILED OFF BLOCK TIME": "fobt",
+    "FILED ARRIVAL TIME": "fat",
+    "ACTUAL OFF BLOCK TIME": "aobt",
+    "ACTUAL ARRIVAL TIME": "aat",
+    "STATFOR Market Segment": "market",
+    "ADEP": "origin",
+    "ADES": "destination",
+    "ADEP Latitude": "lat0",
+    "ADEP Longitude": "lon0",
+    "ADES Latitude": "lat1",
+    "ADES Longitude": "lon1",
+    "AC Type": "typecode",
+    "AC Operator": "operator",
+    "ECTRL ID": "flight_id",
+    "Actual Distance Flown (nm)": "distance_nm",
+}
+
+# columns needed for the origin-destination statistics
+ectl_od_columns = [
+    "ECTRL ID",
+    "ADEP",
+    "ADES",
+    "FILED OFF BLOCK TIME",
+    "FILED ARRIVAL TIME",
+    "AC Type",
+    "Actual Distance Flown (nm)",
+]
+
+# e.g. 01-03-2019 04:55:00, parsing with an explicit format avoids inference
+ectl_time_format = "%d-%m-%Y %H:%M:%S"
+
+
+def clean_ectl_data(flights, time_format=ectl_time_format):
     flights = (
-        pd.read_csv(file)
-        .rename(
-            columns={
-                "ICAO Flight Type": "scheduled",
-                "FILED OFF BLOCK TIME": "fobt",
-                "FILED ARRIVAL TIME": "fat",
-                "ACTUAL OFF BLOCK TIME": "aobt",
-                "ACTUAL ARRIVAL TIME": "aat",
-                "STATFOR Market Segment": "market",
-                "ADEP": "origin",
-                "ADES": "destination",
-                "ADEP Latitude": "lat0",
-                "ADEP Longitude": "lon0",
-                "ADES Latitude": "lat1",
-                "ADES Longitude": "lon1",
-                "AC Type": "typecode",
-                "AC Operator": "operator",
-                "ECTRL ID": "flight_id",
-                "Actual Distance Flown (nm)": "distance_nm",
-            }
-        )
+        flights.rename(columns=ectl_columns)
         .query("origin != destination")
-        .drop(["AC Registration", "Requested FL"], axis=1)
-        .assign(fobt=lambda x: pd.to_datetime(x.fobt, dayfirst=True))
-        .assign(fat=lambda x: pd.to_datetime(x.fat, dayfirst=True))
-        .assign(aobt=lambda x: pd.to_datetime(x.aobt, dayfirst=True))
-        .assign(aat=lambda x: pd.to_datetime(x.aat, dayfirst=True))
-        .assign(duration=lambda x: (x.fat - x.fobt).dt.total_seconds() / 60)
-        .eval("distance=distance_nm * 1.852")
+        .drop(["AC Registration", "Requested FL"], axis=1, errors="ignore")
     )
 
+    for column in ["fobt", "fat", "aobt", "aat"]:
+        if column in flights.columns:
+            flights[column] = pd.to_datetime(flights[column], format=time_format)
+
+    return flights.assign(
+        duration=lambda x: (x.fat - x.fobt).dt.total_seconds() / 60
+    ).eval("distance=distance_nm * 1.852")
+
+
+def process_ectl_data(file, fout=None, time_format=ectl_time_format):
+    flights = clean_ectl_data(pd.read_csv(file), time_format)
+
     if fout is not None:
         flights.to_parquet(fout, index=False)
 
     return flights
 
 
-# %%
-file = "/mnt/8TB/ECTL_RD/2019/201903/Flights_20190301_20190331.csv.gz"
-fout = "data/source/flight/flight_list_2019_03.parquet"
-flights = process_ectl_data(file, fout=fout)
-
-#%%
-file = "data/source/flight/flight_list_2019_03.parquet"
-flights = pd.read_parquet(file)
+def ectl_files(root, start, end):
+    """Monthly ECTL flight files between two months, e.g. "2019-03"."""
+    files = []
+    for month in pd.period_range(start, end, freq="M"):
+        folder = f"{root}/{month.year}/{month.strftime('%Y%m')}"
+        files.extend(sorted(glob.glob(f"{folder}/Flights_*.csv.gz")))
+    return files
+
+
+class ODAggregator:
+    """Running origin-destination statistics over chunks of flights.
+
+    Only per-OD counts, sums and typecode frequencies are kept, so any
+    number of monthly files can be aggregated without holding all flights
+    in memory.
+    """
+
+    keys = ["origin", "destination"]
+
+    def __init__(self, start=None, end=None):
+        # inclusive date range on the filed off-block time
+        self.start = pd.Timestamp(start) if start is not None else None
+        self.end = pd.Timestamp(end) + pd.Timedelta(days=1) if end is not None else None
+
+        self.stats = None
+        self.typecodes = None
+        self.dates = set()
+        self.n_flights = 0
+
+    def update(self, flights: pd.DataFrame):
+        if self.start is not None:
+            flights = flights[flights.fobt >= self.start]
+        if self.end is not None:
+            flights = flights[flights.fobt < self.end]
+        if flights.shape[0] == 0:
+            return
+
+        stats = flights.groupby(self.keys).agg(
+            n_flights=("flight_id", "count"),
+            distance_sum=("distance", "sum"),
+            distance_count=("distance", "count"),
+            duration_sum=("duration", "sum"),
+            duration_count=("duration", "count"),
+        )
+        typecodes = flights.groupby(self.keys + ["typecode"]).size()
+
+        if self.stats is None:
+            self.stats, self.typecodes = stats, typecodes
+        else:
+            self.stats = self.stats.add(stats, fill_value=0)
+            self.typecodes = self.typecodes.add(typecodes, fill_value=0)
+
+        self.dates.update(flights.fobt.dt.date.dropna().unique())
+        self.n_flights += flights.shape[0]
+
+    def od_pairs(self):
+        # most common typecode, ties resolved alphabetically like Series.mode
+        typecode = (
+            self.typecodes.rename("n")
+            .reset_index()
+            .sort_values(
+                self.keys + ["n", "typecode"], ascending=[True, True, False, True]
+            )
+            .drop_duplicates(self.keys)
+            .set_index(self.keys)
+            .typecode
+        )
 
-#%%
-top_airports = (
-    flights.groupby("origin")
-    .agg({"flight_id": "count"})
-    .sort_values("flight_id", ascending=False)
-    .reset_index()
-    .head(100)
-)
+        n_days = len(self.dates)
+
+        return (
+            self.stats.sort_index()
+            .assign(
+                distance=lambda x: x.distance_sum / x.distance_count,
+                duration=lambda x: x.duration_sum / x.duration_count,
+                typecode=typecode,
+                daily_flights=lambda x: x.n_flights / n_days,
+            )[["distance", "duration", "typecode", "daily_flights"]]
+            .reset_index()
+        )
 
-airport_codes = top_airports.origin.values
-airport_codes
+    def top_airports(self, n=100):
+        return (
+            self.stats.groupby("origin")
+            .agg({"n_flights": "sum"})
+            .sort_values("n_flights", ascending=False)
+            .reset_index()
+            .head(n)
+        )
 
-#%%
 
-# run following prompt in chatgpt-4, add save results as:
-# data/source/flight/airport_info.csv
+def aggregate_ectl(
+    files, start=None, end=None, chunksize=500_000, time_format=ectl_time_format
+):
+    aggregator = ODAggregator(start, end)
 
-prompt = f"""
-Your role is an assistant. No need to explain, just do the task.
-Below is a list of airport code, give me a table include the following 
-information for each airport: city located, closest big city, country, and iso country code.
-Remember to present the result in csv format in a code block. 
-The csv header columns should be: "airport","place","city","country","country_code"
-Here is the list of airport codes: 
-{airport_codes}
-"""
+    for file in files:
+        chunks = pd.read_csv(file, usecols=ectl_od_columns, chunksize=chunksize)
+        for chunk in tqdm(chunks, desc=file.split("/")[-1]):
+            aggregator.update(clean_ectl_data(chunk, time_format))
 
-print(prompt)
+    return aggregator
 
 
 # %%
 
 
-def gen_airport_dataset(fout=None):
+def gen_airport_dataset(fout=None, geocoder=None):
+    """Airports with the location of their city.
+
+    Cities are geocoded with `geocoder` (a geocode.Geocoder), by default
+    Nominatim with an on-disk cache, each (city, country) only once.
+    """
     # airport information from chat-gpt
     airports = pd.read_csv("data/source/flight/airport_info.csv")
     airports = airports.query(f"country_code.isin({list(countries.keys())})")
@@ -113,17 +206,23 @@ def gen_airport_dataset(fout=None):
 
     airports = airports.merge(our_airport)
 
-    latitudes = []
-    longitudes = []
+    if geocoder is None:
+        geocoder = geocode.Geocoder(geocode.nominatim(user_agent="airports"))
 
-    geolocator = Nominatim(user_agent="airports")
+    queries = (airports.city + ", " + airports.country).tolist()
+    locations = geocoder.geocode_many(queries)
 
-    for i, d in tqdm(airports.iterrows(), total=airports.shape[0]):
-        location = geolocator.geocode(f"{d.city}, {d.country}")
-        latitudes.append(location.latitude)
-        longitudes.append(location.longitude)
+    missing = sorted(q for q, loc in locations.items() if loc is None)
+    if len(missing) > 0:
+        print("Places not found:", missing)
 
-    airports = airports.assign(city_latitude=latitudes, city_longitude=longitudes)
+    latitudes = [(locations[q] or (None, None))[0] for q in queries]
+    longitudes = [(locations[q] or (None, None))[1] for q in queries]
+
+    airports = airports.assign(
+        city_latitude=pd.to_numeric(latitudes),
+        city_longitude=pd.to_numeric(longitudes),
+    )
 
     if fout is not None:
         airports.to_csv(fout, index=False)
@@ -131,67 +230,115 @@ def gen_airport_dataset(fout=None):
     return airports
 
 
-#%%
-# airports = gen_airport_dataset(fout="data/airports.csv")
+# %%
 
-airports = pd.read_csv("data/airports.csv")
 
+def gen_flight_routes(airports, od_pairs, radius=None):
+    """Flights between all pairs of cities, from the origin-destination
+    pairs of airports.
+
+    Each city is served by its own airports and, with `radius`, also by
+    all other airports within `radius` km, found with a KD-tree. Flights
+    are joined to cities on integer airport ids, starting from the airport
+    pairs with flights, so no city pair table is built. Airports missing
+    from `airports` are skipped.
+    """
+    cities, proj = location.city_table(airports)
+    index = location.AirportIndex(airports, proj)
+    city_id, airport_id = index.city_airports(cities, radius)
+
+    od_origin = index.ids(od_pairs.origin)
+    od_destination = index.ids(od_pairs.destination)
+    od = np.flatnonzero((od_origin >= 0) & (od_destination >= 0))
+
+    links = pd.DataFrame(dict(city_id=city_id, airport_id=airport_id))
+    joined = (
+        pd.DataFrame(dict(od=od, o=od_origin[od], d=od_destination[od]))
+        .merge(links.rename(columns=dict(city_id="i", airport_id="o")))
+        .merge(links.rename(columns=dict(city_id="j", airport_id="d")))
+        .query("i != j")
+        .sort_values(["i", "j", "o", "d"])
+    )
 
-# %%
-# Eurocontrol flight data
+    # city ids are the row positions in `cities`
+    i, j, o, d = (joined[c].values for c in ["i", "j", "o", "d"])
+    location_of = dict(city_latitude="lat", city_longitude="lon")
 
-n_days = flights.fobt.dt.date.nunique()
-
-all_od_pairs = (
-    flights.groupby(["origin", "destination"])
-    .agg(
-        {
-            "distance": "mean",
-            "duration": "mean",
-            "flight_id": "count",
-            "typecode": lambda x: pd.Series.mode(x)[0],  # most common ac type
-        }
+    columns = dict(
+        city_origin=cities.city.values[i],
+        city_destination=cities.city.values[j],
     )
-    .reset_index()
-    .assign(daily_flights=lambda x: x.flight_id / n_days)
-    .drop("flight_id", axis=1)
-)
+    for suffix, key, city in [("origin", o, i), ("destination", d, j)]:
+        columns[suffix] = index.codes.values[key]
+        for c in index.airports.columns.drop(["airport", "city"]):
+            if c in location_of:
+                # an airport can serve several cities, use the route's city
+                columns[f"{c}_{suffix}"] = cities[location_of[c]].values[city]
+            else:
+                columns[f"{c}_{suffix}"] = index.airports[c].values[key]
+
+    for c in od_pairs.columns.drop(["origin", "destination"]):
+        columns[c] = od_pairs[c].values[joined.od.values]
+
+    flight_routes = pd.DataFrame(columns)
+
+    return flight_routes
 
 
 # %%
+if __name__ == "__main__":
+    profiler = StageProfiler("flight")
 
+    # %%
+    profiler.start("ectl_aggregation")
+    files = ectl_files("/mnt/8TB/ECTL_RD", "2019-03", "2019-03")
+    aggregator = aggregate_ectl(files)
+    all_od_pairs = aggregator.od_pairs()
+    profiler.stop(rows=aggregator.n_flights)
 
-def gen_flight_routes(airports):
-    cities = airports.drop_duplicates(subset=["city"])
-
-    # generate the all possible airport pairs
-    city_pairs = pd.DataFrame(
-        itertools.product(cities["city"], repeat=2),
-        columns=["city_origin", "city_destination"],
-    ).query("city_origin!=city_destination")
-
-    flight_routes = (
-        city_pairs.merge(airports, left_on=["city_origin"], right_on=["city"])
-        .rename(columns={"airport": "origin"})
-        .drop(columns=["city"])
-        .merge(
-            airports,
-            left_on=["city_destination"],
-            right_on=["city"],
-            suffixes=("_origin", "_destination"),
-        )
-        .rename(columns={"airport": "destination"})
-        .drop(columns=["city"])
-    )
+    # flight list of a single month, for inspection
+    # file = "/mnt/8TB/ECTL_RD/2019/201903/Flights_20190301_20190331.csv.gz"
+    # fout = "data/source/flight/flight_list_2019_03.parquet"
+    # flights = process_ectl_data(file, fout=fout)
 
-    # keep only pairs that have flight connections
-    flight_routes = flight_routes.merge(all_od_pairs, how="inner")
+    #%%
+    top_airports = aggregator.top_airports(100)
 
-    return flight_routes
+    airport_codes = top_airports.origin.values
+    airport_codes
+
+    #%%
+
+    # run following prompt in chatgpt-4, add save results as:
+    # data/source/flight/airport_info.csv
+
+    prompt = f"""
+Your role is an assistant. No need to explain, just do the task.
+Below is a list of airport code, give me a table include the following 
+information for each airport: city located, closest big city, country, and iso country code.
+Remember to present the result in csv format in a code block. 
+The csv header columns should be: "airport","place","city","country","country_code"
+Here is the list of airport codes: 
+{airport_codes}
+"""
+
+    print(prompt)
+
+    #%%
+    # airports = gen_airport_dataset(fout="data/airports.csv")
+
+    airports = pd.read_csv("data/airports.csv")
 
+    #%%
+    profiler.start("flight_routes")
+    flight_routes = gen_flight_routes(airports, all_od_pairs)
+    profiler.stop(rows=flight_routes.shape[0])
 
-#%%
+    flight_routes.to_csv("data/flight_routes.csv", index=False)
 
-flight_routes = gen_flight_routes(airports)
+    #%%
+    profiler.start("co2_table")
+    emission.build_flight_table(flight_routes.typecode.unique())
+    profiler.stop(rows=flight_routes.typecode.nunique())
 
-flight_routes.to_csv("data/flight_routes.csv", index=False)
+    profiler.save()
@@ -1,4 +1,5 @@
 # %%
+import os
 import pandas as pd
 import numpy as np
 from scipy.spatial import cKDTree
@@ -7,10 +8,17 @@ import itertools
 from tqdm import tqdm
 import glob
 import location
+import stops
 import heapq
 import networkx as nx
 import polyline
 import visualize
+import validate
+import artifacts
+import parallel
+from profiler import StageProfiler
+from timetable import Timetable, profile_windows
+from service_calendar import ServiceCalendar, select_trips
 
 # %%
 pd.options.display.max_columns = 100
@@ -52,6 +60,11 @@ def haversine(lat1, lon1, lat2, lon2):
 
 # %%
 def generate_gtfs_routes():
+    """Stop times of all trips in the train feeds, with their service_id.
+
+    The dates of each service are saved to data/train_calendar.npz, use
+    service_calendar.select_trips to pick the trips of a travel date.
+    """
     columns = [
         "agency_name",
         "route_id",
@@ -67,9 +80,11 @@ def generate_gtfs_routes():
         "stop_lat",
         "stop_lon",
         "direction_id",
+        "service_id",
     ]
 
     gtfs_routes = []
+    calendars = []
 
     for gtfspath in sorted(glob.glob("data/source/train/gtfs_*")):
 
@@ -84,54 +99,21 @@ def generate_gtfs_routes():
         )
         stops = pd.read_csv(f"{gtfspath}/stops.txt", dtype={"stop_id": str})
         trips = pd.read_csv(
-            f"{gtfspath}/trips.txt", dtype={"trip_id": str, "route_id": str}
+            f"{gtfspath}/trips.txt",
+            dtype={"trip_id": str, "route_id": str, "service_id": str},
         )
         routes = pd.read_csv(
             f"{gtfspath}/routes.txt", dtype={"agency_id": str, "route_id": str}
         )
-        calendar_dates = pd.read_csv(f"{gtfspath}/calendar_dates.txt")
         agency = pd.read_csv(f"{gtfspath}/agency.txt", dtype={"agency_id": str})
 
-        # find a busy day  with most added service (or running services)
-        if calendar_dates.query("exception_type==1").shape[0] > 0:
-            date = (
-                calendar_dates.query("exception_type==1")
-                .groupby("date")
-                .size()
-                .sort_values(ascending=False)
-                .reset_index()
-                .iloc[0]
-                .date
-            )
-        else:
-            date = (
-                calendar_dates.query("exception_type==2")
-                .groupby("date")
-                .size()
-                .sort_values(ascending=True)
-                .reset_index()
-                .iloc[0]
-                .date
-            )
-
-        service_running = calendar_dates.query(
-            f"date==@date and exception_type==1"
-        ).service_id.values
-
-        service_removed = calendar_dates.query(
-            f"date==@date and exception_type==2"
-        ).service_id.values
-
-        if calendar_dates.query("exception_type==2").shape[0] == 0:
-            # exception_type is used as running services instead of added services
-            trips_ = trips.query("service_id.isin(@service_running)")
-        else:
-            trips_ = trips.query(
-                "service_id.isin(@service_running) or ~service_id.isin(@service_removed)"
-            )
+        # service ids are only unique within a feed
+        prefix = f"{country}:"
+        calendars.append(ServiceCalendar.read_gtfs(gtfspath, prefix=prefix))
+        trips = trips.assign(service_id=prefix + trips.service_id)
 
         df = (
-            trips_.merge(routes)
+            trips.merge(routes)
             .merge(stop_times)
             .merge(stops)
             .merge(agency)
@@ -161,31 +143,18 @@ def generate_gtfs_routes():
     gtfs_routes = pd.concat(gtfs_routes, ignore_index=True)
 
     gtfs_routes.to_parquet("data/train_routes_gtfs.parquet", index=False)
+    ServiceCalendar.concat(calendars).save("data/train_calendar.npz")
 
     return gtfs_routes
 
 
 #%%
-def process_gtfs_routes(gtfs_routes, proj):
+def process_gtfs_routes(gtfs_routes, proj, radius=1.0):
     x, y = proj(gtfs_routes.stop_lon, gtfs_routes.stop_lat)
-    gtfs_routes = gtfs_routes.assign(
-        stop_x=x / 1000,
-        stop_y=y / 1000,
-        stop_x_round=(x / 1000 / 10).round() * 10,
-        stop_y_round=(y / 1000 / 10).round() * 10,
-    )
+    gtfs_routes = gtfs_routes.assign(stop_x=x / 1000, stop_y=y / 1000)
 
-    # stops must be merges based on proximity!
-
-    # merge stops that are close, < 1km apart, as the same stop
-    unified_ids = (
-        gtfs_routes.groupby(["stop_x_round", "stop_y_round"])
-        .agg({"stop_name": lambda x: pd.Series.mode(x)[0]})
-        .reset_index()
-        .assign(uni_stop_id=lambda d: (d.index + 1).astype(str))
-        .rename(columns=dict(stop_name="uni_stop_name"))
-    )
-    gtfs_routes = gtfs_routes.merge(unified_ids)
+    # merge stops that are close, < radius km apart, as the same stop
+    gtfs_routes = stops.unify_stops(gtfs_routes, radius=radius)
 
     return gtfs_routes
 
@@ -291,32 +260,181 @@ def create_graph(gtfs_routes):
 
 
 #%%
-def shortest_path(G, orig, dest):
+class SearchBounds:
+    """Admissible lower bounds on the remaining cost to a destination, for A*.
+
+    The straight-line distance between projected stops divided by the
+    maximum speed found on any edge never overestimates the remaining
+    duration. With landmarks (ALT), the triangle inequality on precomputed
+    minimum durations to and from a few far apart stops gives tighter
+    bounds. Both are consistent, so A* settles every node with the same
+    cost as the plain search. Edges shorter than `min_duration` minutes
+    count as that long for the maximum speed.
+    """
+
+    def __init__(self, G, n_landmarks=0, min_duration=0.5):
+        self.xy = {
+            n: (d.get("stop_x", np.nan), d.get("stop_y", np.nan))
+            for n, d in G.nodes(data=True)
+        }
+
+        # static graph of the minimum duration between two stops
+        durations = nx.DiGraph()
+        self.vmax = 0  # km per minute
+        for u, v, d in G.edges(data=True):
+            duration = d["duration_mins"]
+            if duration != duration:
+                continue
+            if not durations.has_edge(u, v) or durations[u][v]["weight"] > duration:
+                durations.add_edge(u, v, weight=duration)
+
+            distance = np.hypot(
+                self.xy[u][0] - self.xy[v][0], self.xy[u][1] - self.xy[v][1]
+            )
+            # GTFS times are in whole minutes, so stops less than a minute
+            # apart can have a duration of 0, which is not a speed
+            if distance > 0:
+                speed = distance / max(duration, min_duration)
+                self.vmax = max(self.vmax, speed)
+
+        self.landmarks = self.select_landmarks(n_landmarks)
+        self.from_landmark = [
+            nx.single_source_dijkstra_path_length(durations, lm)
+            for lm in self.landmarks
+        ]
+        self.to_landmark = [
+            nx.single_source_dijkstra_path_length(durations.reverse(copy=False), lm)
+            for lm in self.landmarks
+        ]
+
+    @classmethod
+    def from_dict(cls, state):
+        """Restore bounds saved as vars(bounds), e.g. in the artifact cache."""
+        bounds = cls.__new__(cls)
+        bounds.__dict__.update(state)
+        return bounds
+
+    def select_landmarks(self, n):
+        """Pick stops far apart from each other (farthest point selection)."""
+        if n == 0:
+            return []
+
+        nodes = [k for k, v in self.xy.items() if v[0] == v[0]]
+        xy = np.array([self.xy[k] for k in nodes])
+
+        selected = [int(np.argmax(np.hypot(*(xy - xy.mean(axis=0)).T)))]
+        distance = np.hypot(*(xy - xy[selected[0]]).T)
+        for _ in range(1, min(n, len(nodes))):
+            selected.append(int(np.argmax(distance)))
+            distance = np.minimum(distance, np.hypot(*(xy - xy[selected[-1]]).T))
+
+        return [nodes[i] for i in selected]
+
+    def __call__(self, node, dest):
+        bound = 0
+
+        if 0 < self.vmax < np.inf:
+            (x0, y0), (x1, y1) = self.xy[node], self.xy[dest]
+            distance = np.hypot(x1 - x0, y1 - y0)
+            if distance == distance:
+                bound = distance / self.vmax
+
+        for from_lm, to_lm in zip(self.from_landmark, self.to_landmark):
+            if node in from_lm and dest in from_lm:
+                bound = max(bound, from_lm[dest] - from_lm[node])
+            if node in to_lm and dest in to_lm:
+                bound = max(bound, to_lm[node] - to_lm[dest])
+
+        return bound
+
+
+def shortest_path(
+    G,
+    orig,
+    dest,
+    start_time=360,
+    bounds=None,
+    stats=None,
+    transfer_penalty=10,
+    time_penalty_factor=0.1,
+):
+    """Time-dependent shortest path, departing at start_time (minutes, 6am).
+
+    Changing trips costs `transfer_penalty` minutes, and each minute of
+    departure after start_time costs `time_penalty_factor`, to prefer
+    departing close to start_time.
 
-    start_time = 360  # 6am
+    With `bounds` (a SearchBounds), the search is goal-directed (A*). The
+    number of settled nodes is stored in `stats["settled"]` when a dict is
+    given.
+    """
 
     if orig not in G or dest not in G:
         print("Invalid node(s)!")
 
-    # Custom Dijkstra's algorithm to consider time constraints
-    dist = {node: np.inf for node in G}
-    prev = {node: {"node": None, "key": None, "data": None} for node in G}
-    last_trip_id = {node: None for node in G}
+    path_nodes, path_edges = shortest_path_multi(
+        G,
+        {orig: 0},
+        {dest: 0},
+        start_time,
+        bounds,
+        stats,
+        transfer_penalty,
+        time_penalty_factor,
+    )
 
-    dist[orig] = start_time
+    if len(path_nodes) == 0:
+        return [dest], []
 
-    # cost of transferring
-    transfer_penalty = 10
+    return path_nodes, path_edges
+
+
+def shortest_path_multi(
+    G,
+    sources: dict,
+    targets: dict,
+    start_time=360,
+    bounds=None,
+    stats=None,
+    transfer_penalty=10,
+    time_penalty_factor=0.1,
+):
+    """Shortest path from any of the `sources` to any of the `targets`.
 
-    # Increase to prioritize depart closer to start_time
-    time_penalty_factor = 0.1
+    Both map stops to minutes: the time to reach a source stop after
+    start_time, and the time from a target stop to the destination. The
+    search stops once no open path can beat the best target found, so one
+    search replaces the searches between all pairs of stops. Returns empty
+    lists when no target can be reached.
+    """
+
+    # Custom Dijkstra's algorithm to consider time constraints
+    dist = {}
+    prev = {}
+    last_trip_id = {}
+
+    def heuristic(node):
+        if bounds is None:
+            return 0
+        return min(bounds(node, target) for target in targets)
+
+    # Priority queue: (distance + lower bound to targets, distance, node)
+    pq = []
+    for source, access in sources.items():
+        if source in G and start_time + access < dist.get(source, np.inf):
+            dist[source] = start_time + access
+            pq.append((dist[source] + heuristic(source), dist[source], source))
+    heapq.heapify(pq)
 
-    # Priority queue: (distance, node)
-    pq = [(start_time, orig)]
     visited = set()  # To keep track of visited nodes
+    best, best_target = np.inf, None
 
     while pq:
-        current_time, current_node = heapq.heappop(pq)
+        estimate, current_time, current_node = heapq.heappop(pq)
+
+        # no open path can beat the best target any more
+        if estimate >= best:
+            break
 
         # If the node has been visited before, skip
         if current_node in visited:
@@ -324,12 +442,14 @@ def shortest_path(G, orig, dest):
         else:
             visited.add(current_node)
 
-        # Determine the "arrival time" at the current node.
-        arrival_time_at_current = start_time if current_node == orig else current_time
+        if current_node in targets:
+            total = current_time + targets[current_node]
+            if total < best:
+                best, best_target = total, current_node
 
         # Visit neighbors
         for me, neighbor, key, data in G.edges(current_node, data=True, keys=True):
-            if arrival_time_at_current > data["depart_from_target_mins"]:
+            if current_time > data["depart_from_target_mins"]:
                 continue
 
             time_penalty = (
@@ -337,7 +457,7 @@ def shortest_path(G, orig, dest):
             ) * time_penalty_factor
 
             if (
-                last_trip_id[current_node] is not None
+                last_trip_id.get(current_node) is not None
                 and last_trip_id[current_node] != data["trip_id"]
             ):
                 penalty = transfer_penalty
@@ -346,73 +466,149 @@ def shortest_path(G, orig, dest):
 
             alt = current_time + data["duration_mins"] + penalty + time_penalty
 
-            if alt < dist[neighbor]:
+            if alt < dist.get(neighbor, np.inf):
                 dist[neighbor] = alt
-                prev[neighbor] = {"node": current_node, "key": key, "data": data}
+                prev[neighbor] = (current_node, key, data)
                 last_trip_id[neighbor] = data["trip_id"]
-                heapq.heappush(pq, (dist[neighbor], neighbor))
+                heapq.heappush(pq, (alt + heuristic(neighbor), alt, neighbor))
+
+    if stats is not None:
+        stats["settled"] = stats.get("settled", 0) + len(visited)
 
     # Reconstruct path with edges
     path_nodes = []
     path_edges = []
-    stop = dest
+    stop = best_target
     while stop is not None:
         path_nodes.insert(0, stop)
-        if prev[stop]["node"] is not None:
-            path_edges.insert(
-                0, (prev[stop]["node"], stop, prev[stop]["key"], prev[stop]["data"])
-            )
-        stop = prev[stop]["node"]
+        if stop in prev:
+            node, key, data = prev[stop]
+            path_edges.insert(0, (node, stop, key, data))
+            stop = node
+        else:
+            stop = None
 
     return path_nodes, path_edges
 
 
 #%%
+def train_services(G: nx.Graph):
+    """Outbound and inbound service groups of the stops of the graph, and
+    the times of each stop on each trip, to prune candidate stops."""
+    links = pd.DataFrame(
+        [
+            (
+                u,
+                v,
+                d["trip_id"],
+                d["arrive_at_source_mins"],
+                d["depart_from_target_mins"],
+            )
+            for u, v, d in G.edges(data=True)
+        ],
+        columns=["source", "target", "trip_id", "source_position", "target_position"],
+    )
+    outbound, inbound = stops.service_groups(links)
+    return outbound, inbound, stops.trip_positions(links)
+
+
 def create_train_routes(
     G: nx.Graph,
     nodes: pd.DataFrame,
     city_pairs: pd.DataFrame,
+    bounds: SearchBounds = None,
+    stop_kd_tree: cKDTree = None,
+    transfer_penalty=10,
+    time_penalty_factor=0.1,
+    progress=True,
+    processes=1,
+    access_speed=None,
+    services=None,
+    prune=True,
 ):
+    """Shortest train route of each city pair, between stops within 5 km.
+
+    Each pair is routed with one search from all stops near the origin to
+    all stops near the destination. With `prune`, stops without service,
+    and stops dominated by another stop on the same trips, are left out
+    (see stops.prune_candidates), which does not change the routes.
+    With `access_speed` (km/h), the time to reach the stops is added to
+    both ends of the journey.
+
+    With `processes` > 1, city pairs are grouped by origin and routed in
+    forked workers sharing the graph; the result is the same as serial.
+    """
+
+    if stop_kd_tree is None:
+        stop_kd_tree = cKDTree(nodes[["stop_x", "stop_y"]].values)
+
+    if prune and services is None:
+        services = train_services(G)
+
+    if processes > 1:
+        return parallel.map_groups(
+            _routes_task,
+            city_pairs,
+            "city_origin",
+            keys=["city_origin", "city_destination"],
+            shared=dict(
+                G=G,
+                nodes=nodes,
+                city_pairs=city_pairs,
+                bounds=bounds,
+                stop_kd_tree=stop_kd_tree,
+                kwargs=dict(
+                    transfer_penalty=transfer_penalty,
+                    time_penalty_factor=time_penalty_factor,
+                    access_speed=access_speed,
+                    services=services,
+                    prune=prune,
+                ),
+            ),
+            processes=processes,
+        )
 
-    stop_kd_tree = cKDTree(nodes[["stop_x", "stop_y"]].values)
+    def candidates(pos):
+        # stops within range, with the access time to each of them
+        idx = stop_kd_tree.query_ball_point(pos, r=5)
+        access = np.zeros(len(idx))
+        if access_speed is not None and len(idx) > 0:
+            offset = nodes.loc[idx, ["stop_x", "stop_y"]].values - pos
+            access = np.hypot(*offset.T) / access_speed * 60
+        return dict(zip(nodes.loc[idx, "uni_stop_id"].values, access))
 
     results = []
 
-    for i, cp in tqdm(city_pairs.iterrows(), total=city_pairs.shape[0]):
+    for i, cp in tqdm(
+        city_pairs.iterrows(), total=city_pairs.shape[0], disable=not progress
+    ):
 
-        orig_pos = cp[["x0", "y0"]].to_list()
-        dest_pos = cp[["x1", "y1"]].to_list()
+        origs = candidates(cp[["x0", "y0"]].values.astype(float))
+        dests = candidates(cp[["x1", "y1"]].values.astype(float))
 
-        # query stops with in a range
-        orig_train_stop_idx = stop_kd_tree.query_ball_point(orig_pos, r=5)
-        dest_train_stop_idx = stop_kd_tree.query_ball_point(dest_pos, r=5)
+        if prune:
+            outbound, inbound, positions = services
+            origs = stops.prune_candidates(origs, outbound, positions)
+            dests = stops.prune_candidates(dests, inbound, positions, origin=False)
 
-        origs = nodes.loc[orig_train_stop_idx]
-        dests = nodes.loc[dest_train_stop_idx]
+        # staying at the origin stop is not a route
+        dests = {d: t for d, t in dests.items() if d not in origs}
 
-        path_edges_set = []
-        path_nodes_set = []
-        travel_times = []
-        for o, d in itertools.product(
-            origs.uni_stop_id.values, dests.uni_stop_id.values
-        ):
-            path_nodes, path_edges = shortest_path(G, o, d)
-
-            if len(path_edges) > 0:
-                path_edges_set.append(path_edges)
-                path_nodes_set.append(path_nodes)
+        if len(origs) == 0 or len(dests) == 0:
+            continue
 
-                time_table = pd.DataFrame([pe[3] for pe in path_edges])[
-                    ["arrive_at_source_mins", "depart_from_target_mins"]
-                ].values
-                travel_times.append(time_table[-1, 1] - time_table[0, 0])
+        path_nodes, shortest_route = shortest_path_multi(
+            G,
+            origs,
+            dests,
+            bounds=bounds,
+            transfer_penalty=transfer_penalty,
+            time_penalty_factor=time_penalty_factor,
+        )
 
-        if len(travel_times) == 0:
+        if len(shortest_route) == 0:
             continue
 
-        shortest_duration = min(travel_times)
-        shortest_route = path_edges_set[np.argmin(travel_times)]
-
         df = pd.DataFrame([sr[3] for sr in shortest_route])
 
         df = df.assign(
@@ -428,7 +624,11 @@ def create_train_routes(
         results.append(
             cp.to_dict()
             | dict(
-                duration=df.duration_mins.sum(),
+                departure=df.arrive_at_source_mins.iloc[0],
+                arrival=df.depart_from_target_mins.iloc[-1],
+                # from the first to the last stop, with dwell and transfers
+                duration=df.depart_from_target_mins.iloc[-1]
+                - df.arrive_at_source_mins.iloc[0],
                 distance=df.distance.sum(),
                 coords=polyline.encode(
                     np.append(
@@ -445,26 +645,293 @@ def create_train_routes(
     return train_routes
 
 
+def _routes_task(rows):
+    return create_train_routes(
+        parallel.shared("G"),
+        parallel.shared("nodes"),
+        parallel.shared("city_pairs").iloc[rows],
+        parallel.shared("bounds"),
+        parallel.shared("stop_kd_tree"),
+        progress=False,
+        **parallel.shared("kwargs"),
+    )
+
+
+def _sweep_task(task):
+    transfer_penalty, time_penalty_factor, rows = task
+    routes = create_train_routes(
+        parallel.shared("G"),
+        parallel.shared("nodes"),
+        parallel.shared("city_pairs").iloc[rows],
+        parallel.shared("bounds"),
+        parallel.shared("stop_kd_tree"),
+        transfer_penalty=transfer_penalty,
+        time_penalty_factor=time_penalty_factor,
+        progress=False,
+        services=parallel.shared("services"),
+    )
+    return routes.assign(
+        transfer_penalty=transfer_penalty, time_penalty_factor=time_penalty_factor
+    )
+
+
+def sweep_penalties(
+    G,
+    nodes,
+    city_pairs,
+    transfer_penalties=(0, 5, 10, 20),
+    time_penalty_factors=(0, 0.05, 0.1, 0.2),
+    bounds=None,
+    stop_kd_tree=None,
+    processes=None,
+):
+    """Train routes of all city pairs for each combination of penalties.
+
+    Settings and shards of city pairs run in forked processes sharing the
+    graph. Returns all routes with their transfer_penalty and
+    time_penalty_factor.
+    """
+    if stop_kd_tree is None:
+        stop_kd_tree = cKDTree(nodes[["stop_x", "stop_y"]].values)
+
+    n_shards = processes or os.cpu_count()
+    shards = parallel.shard_by(city_pairs, "city_origin", n_shards)
+    tasks = [
+        (tp, tf, rows)
+        for tp, tf in itertools.product(transfer_penalties, time_penalty_factors)
+        for rows in shards
+    ]
+
+    results = parallel.fork_map(
+        _sweep_task,
+        tasks,
+        shared=dict(
+            G=G,
+            nodes=nodes,
+            city_pairs=city_pairs,
+            bounds=bounds,
+            stop_kd_tree=stop_kd_tree,
+            services=train_services(G),
+        ),
+        processes=processes,
+    )
+
+    return pd.concat(results, ignore_index=True)
+
+
+def sweep_report(sweep: pd.DataFrame, baseline=(10, 0.1)):
+    """Per setting: routes found, durations, and changes from `baseline`."""
+    keys = ["city_origin", "city_destination"]
+    settings = ["transfer_penalty", "time_penalty_factor"]
+
+    base = sweep.query(
+        "transfer_penalty==@baseline[0] and time_penalty_factor==@baseline[1]"
+    )[keys + ["duration", "coords"]]
+
+    compared = sweep.merge(base, on=keys, how="left", suffixes=("", "_baseline"))
+
+    return (
+        compared.assign(
+            route_changed=lambda d: d.coords != d.coords_baseline,
+            duration_change=lambda d: d.duration - d.duration_baseline,
+        )
+        .groupby(settings)
+        .agg(
+            routes=("duration", "size"),
+            duration_mean=("duration", "mean"),
+            duration_median=("duration", "median"),
+            routes_changed=("route_changed", "mean"),
+            duration_change_mean=("duration_change", "mean"),
+        )
+        .reset_index()
+    )
+
+
+def build_routing_graph(gtfs_routes, n_landmarks=8):
+    """Graph, A* bounds and stop KD-tree for create_train_routes, as a dict
+    of picklable objects for the artifact cache."""
+    G, edges, nodes = create_graph(gtfs_routes)
+    return dict(
+        G=G,
+        edges=edges,
+        nodes=nodes,
+        bounds=vars(SearchBounds(G, n_landmarks=n_landmarks)),
+        stop_kd_tree=cKDTree(nodes[["stop_x", "stop_y"]].values),
+    )
+
+
+#%%
+def create_train_profiles(
+    timetable: Timetable,
+    city_pairs: pd.DataFrame,
+    proj,
+    radius=5,
+    window=60,
+    max_transfers=4,
+):
+    """Shortest train journey per city pair and departure time window.
+
+    Pairs are grouped by destination: one profile scan towards the stops of
+    each destination city is read for the stops of all its origin cities.
+    """
+    x, y = proj(timetable.stop_lon, timetable.stop_lat)
+    stop_kd_tree = cKDTree(np.column_stack([x / 1000, y / 1000]))
+
+    results = []
+
+    groups = city_pairs.groupby("city_destination", sort=False)
+    for _, pairs in tqdm(groups, total=groups.ngroups):
+        cp = pairs.iloc[0]
+        targets = stop_kd_tree.query_ball_point([cp.x1, cp.y1], r=radius)
+
+        if len(targets) == 0:
+            continue
+
+        scan = timetable.profile_scan(
+            dict.fromkeys(targets, 0), max_transfers=max_transfers
+        )
+
+        for cp in pairs.itertuples():
+            sources = stop_kd_tree.query_ball_point([cp.x0, cp.y0], r=radius)
+
+            if len(sources) == 0:
+                continue
+
+            profile = timetable.profile_from(scan, dict.fromkeys(sources, 0))
+
+            if profile.shape[0] == 0:
+                continue
+
+            results.append(
+                profile_windows(profile, window=window)
+                .dropna(subset=["duration"])
+                .assign(
+                    city_origin=cp.city_origin, city_destination=cp.city_destination
+                )
+            )
+
+    columns = ["city_origin", "city_destination", "window_start", "departure"]
+    columns += ["arrival", "duration", "transfers"]
+
+    if len(results) == 0:
+        return pd.DataFrame(columns=columns)
+
+    return pd.concat(results, ignore_index=True)[columns]
+
+
 # %%
 if __name__ == "__main__":
-    city_pairs, proj = location.gen_city_pairs()
+    profiler = StageProfiler("train")
+
+    with profiler.stage("city_pairs") as s:
+        city_pairs, proj = location.gen_city_pairs()
+        s.rows = city_pairs.shape[0]
 
     #%%
-    # gtfs_routes = generate_gtfs_routes()
-    gtfs_routes = pd.read_parquet("data/train_routes_gtfs.parquet")
+    with profiler.stage("gtfs_load") as s:
+        # gtfs_routes = generate_gtfs_routes()
+        gtfs_routes = pd.read_parquet("data/train_routes_gtfs.parquet")
+        calendar = ServiceCalendar.load("data/train_calendar.npz")
+        s.rows = gtfs_routes.shape[0]
+
+    # travel date of each feed, the date with the most services by default,
+    # as feeds can cover different periods
+    travel_dates = calendar.busiest_dates()
+    print({feed: str(date.date()) for feed, date in travel_dates.items()})
 
     #%%
-    gtfs_routes = process_gtfs_routes(gtfs_routes, proj)
+    # inputs of the cached stages below
+    sources = [
+        "data/train_routes_gtfs.parquet",
+        "data/train_calendar.npz",
+        "data/airports.csv",
+    ]
+
+    with profiler.stage("stop_merge") as s:
+        gtfs_routes = artifacts.cached(
+            "train_stops",
+            lambda: process_gtfs_routes(gtfs_routes, proj, radius=1.0),
+            inputs=sources,
+            params=dict(radius=1.0),
+            code=[process_gtfs_routes, stops.unify_stops, stops.cluster_points],
+            fmt="parquet",
+        )
+        s.rows = gtfs_routes.uni_stop_id.nunique()
 
     #%%
-    G, edges, nodes = create_graph(gtfs_routes)
-    train_routes = create_train_routes(G, nodes, city_pairs)
+    with profiler.stage("timetable") as s:
+        timetable = Timetable.from_stop_times(
+            select_trips(gtfs_routes, calendar, travel_dates),
+            stop_column="uni_stop_id",
+        )
+        timetable.save("data/train_timetable.npz")
+        s.rows = timetable.n_connections
+
+    #%%
+    with profiler.stage("graph_build") as s:
+        day_routes = select_trips(
+            gtfs_routes, calendar, travel_dates, overnight=False
+        )
+        graph = artifacts.cached(
+            "train_graph",
+            lambda: build_routing_graph(day_routes, n_landmarks=8),
+            inputs=sources,
+            params=dict(
+                radius=1.0,
+                travel_dates={f: str(d.date()) for f, d in travel_dates.items()},
+                n_landmarks=8,
+            ),
+            code=[
+                build_routing_graph,
+                create_graph,
+                SearchBounds,
+                select_trips,
+                ServiceCalendar,
+            ],
+        )
+        G, edges, nodes = graph["G"], graph["edges"], graph["nodes"]
+        bounds = SearchBounds.from_dict(graph["bounds"])
+        s.rows = edges.shape[0]
+
+    with profiler.stage("routing") as s:
+        train_routes = create_train_routes(
+            G,
+            nodes,
+            city_pairs,
+            bounds,
+            graph["stop_kd_tree"],
+            processes=os.cpu_count(),
+        )
+        s.rows = train_routes.shape[0]
+
+    with profiler.stage("profiles") as s:
+        train_profiles = create_train_profiles(timetable, city_pairs, proj)
+        s.rows = train_profiles.shape[0]
+
+    with profiler.stage("validation") as s:
+        train_routes, _ = validate.validate_routes(train_routes, "train")
+        s.rows = train_routes.shape[0]
 
     #%%
     train_routes.to_parquet("data/train_routes.parquet", index=False)
+    train_profiles.to_parquet("data/train_profiles.parquet", index=False)
+    profiler.save()
+
+    # %%
+    # sensitivity of the routes to the routing penalties
+    # sweep = sweep_penalties(
+    #     G, nodes, city_pairs, bounds=bounds, stop_kd_tree=graph["stop_kd_tree"]
+    # )
+    # sweep.to_parquet("data/train_routes_sweep.parquet", index=False)
+    # print(sweep_report(sweep))
 
     # %%
     train_routes = pd.read_parquet("data/train_routes.parquet")
 
     # %%
     visualize.draw_sample_routes(train_routes)
+
+    # %%
+    # QA plots of all routes, with COPULA_QA_IMAGES=1
+    if visualize.qa_images:
+        visualize.export_route_images(train_routes, "data/qa/train")
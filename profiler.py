@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import time
+import platform
+import resource
+from datetime import datetime
+from contextlib import contextmanager
+import pandas as pd
+
+
+def rss_mb():
+    """Current resident set size in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    """Peak resident set size in MB, since start or the last reset."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    # process lifetime peak, in KB on linux and bytes on macos
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024**2 if sys.platform == "darwin" else maxrss / 1024
+
+
+def reset_peak_rss():
+    """Reset the peak RSS counter, so that the peak can be measured per stage.
+
+    Only supported on linux; otherwise the peak covers the whole process.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class Stage:
+    def __init__(self, name):
+        self.stage = name
+        self.rows = None
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class StageProfiler:
+    """Record wall time, CPU time, peak RSS and row counts of pipeline stages.
+
+    Use `stage()` as a context manager, or `start()` / `stop()` when a stage
+    spans several notebook cells:
+
+        profiler = StageProfiler("train")
+        with profiler.stage("graph") as s:
+            G, edges, nodes = create_graph(gtfs_routes)
+            s.rows = edges.shape[0]
+        profiler.save()
+    """
+
+    def __init__(self, pipeline: str, verbose=True):
+        self.pipeline = pipeline
+        self.verbose = verbose
+        self.started = datetime.now()
+        self.stages = []
+        self.current = None
+
+    def start(self, name: str):
+        if self.current is not None:
+            self.stop()
+
+        s = Stage(name)
+        s._peak_reset = reset_peak_rss()
+        s._rss_start = rss_mb()
+        s._wall = time.perf_counter()
+        s._cpu = time.process_time()
+        self.current = s
+        return s
+
+    def stop(self, rows: int = None):
+        s, self.current = self.current, None
+        if s is None:
+            return None
+
+        s.wall_s = round(time.perf_counter() - s._wall, 4)
+        s.cpu_s = round(time.process_time() - s._cpu, 4)
+        s.rss_start_mb = s._rss_start
+        s.rss_end_mb = rss_mb()
+        s.peak_rss_mb = peak_rss_mb()
+        s.peak_is_per_stage = s._peak_reset
+        if rows is not None:
+            s.rows = rows
+
+        for k in ["_wall", "_cpu", "_rss_start", "_peak_reset"]:
+            delattr(s, k)
+
+        if s.rows is not None and s.wall_s > 0:
+            s.rows_per_s = round(s.rows / s.wall_s, 1)
+
+        self.stages.append(s.to_dict())
+
+        if self.verbose:
+            print(
+                f"[{self.pipeline}] {s.stage}: {s.wall_s:.2f}s wall, "
+                f"{s.cpu_s:.2f}s cpu, peak {s.peak_rss_mb:.0f} MB"
+                + (f", {s.rows} rows" if s.rows is not None else "")
+            )
+
+        return s
+
+    @contextmanager
+    def stage(self, name: str):
+        s = self.start(name)
+        try:
+            yield s
+        finally:
+            self.stop()
+
+    def report(self):
+        return dict(
+            pipeline=self.pipeline,
+            started=self.started.isoformat(timespec="seconds"),
+            host=platform.node(),
+            python=platform.python_version(),
+            cpu_count=os.cpu_count(),
+            wall_s=round(sum(s["wall_s"] for s in self.stages), 4),
+            cpu_s=round(sum(s["cpu_s"] for s in self.stages), 4),
+            peak_rss_mb=max((s["peak_rss_mb"] for s in self.stages), default=None),
+            stages=self.stages,
+        )
+
+    def save(self, fout=None):
+        if self.current is not None:
+            self.stop()
+
+        if fout is None:
+            timestamp = self.started.strftime("%Y%m%d_%H%M%S")
+            fout = f"data/profiles/{self.pipeline}_{timestamp}.json"
+
+        os.makedirs(os.path.dirname(fout) or ".", exist_ok=True)
+        with open(fout, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+        return fout
+
+
+def load_report(file):
+    with open(file) as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold=0.1):
+    """Compare two run reports stage by stage.
+
+    A stage is flagged as a regression when its wall time or peak RSS grew
+    by more than `threshold` (relative).
+    """
+    if isinstance(baseline, str):
+        baseline = load_report(baseline)
+    if isinstance(current, str):
+        current = load_report(current)
+
+    columns = ["stage", "wall_s", "cpu_s", "peak_rss_mb", "rows"]
+    df = pd.merge(
+        pd.DataFrame(baseline["stages"]).reindex(columns=columns),
+        pd.DataFrame(current["stages"]).reindex(columns=columns),
+        on="stage",
+        how="outer",
+        suffixes=["_base", "_new"],
+        sort=False,
+    )
+
+    df = df.assign(
+        wall_ratio=lambda x: x.wall_s_new / x.wall_s_base,
+        peak_rss_ratio=lambda x: x.peak_rss_mb_new / x.peak_rss_mb_base,
+    ).assign(
+        regression=lambda x: (x.wall_ratio > 1 + threshold)
+        | (x.peak_rss_ratio > 1 + threshold)
+    )
+
+    return df
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("usage: python profiler.py baseline.json current.json [threshold]")
+        sys.exit(1)
+
+    threshold = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+    result = compare(sys.argv[1], sys.argv[2], threshold)
+    print(result.round(3).to_string(index=False))
+
+    sys.exit(1 if result.regression.any() else 0)
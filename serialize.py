@@ -0,0 +1,64 @@
+import numpy as np
+import orjson
+from fastapi.responses import Response
+
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def is_coords(value):
+    """Check if a value looks like a list of (lat, lon) pairs."""
+    return (
+        isinstance(value, (list, tuple))
+        and len(value) > 0
+        and isinstance(value[0], (list, tuple))
+        and len(value[0]) == 2
+        and all(isinstance(v, (int, float, np.number)) for v in value[0])
+    )
+
+
+def round_coords(content, precision: int, as_list=False):
+    """Round all coordinate lists in a (nested) response to `precision` decimals.
+
+    Coordinates are converted to NumPy arrays, which orjson can serialise
+    directly. Set `as_list=True` to get plain lists for the stdlib encoder.
+    """
+    if isinstance(content, dict):
+        return {k: round_coords(v, precision, as_list) for k, v in content.items()}
+
+    if isinstance(content, np.ndarray) and content.ndim == 2:
+        coords = np.round(content.astype(float), precision)
+        return coords.tolist() if as_list else coords
+
+    if is_coords(content):
+        coords = np.round(np.asarray(content, dtype=float), precision)
+        return coords.tolist() if as_list else coords
+
+    if isinstance(content, list):
+        return [round_coords(v, precision, as_list) for v in content]
+
+    return content
+
+
+def dumps(content, precision: int = None) -> bytes:
+    if precision is not None:
+        content = round_coords(content, precision)
+    return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+
+class FastJSONResponse(Response):
+    """JSON response rendered with orjson.
+
+    Returning this response from an endpoint skips FastAPI's jsonable_encoder
+    pass. NumPy arrays and scalars are serialised natively.
+    """
+
+    media_type = "application/json"
+
+    def __init__(self, content, precision: int = None, **kwargs):
+        # must be set before Response.__init__, which calls render()
+        self.precision = precision
+        super().__init__(content, **kwargs)
+
+    def render(self, content) -> bytes:
+        return dumps(content, self.precision)
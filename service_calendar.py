@@ -0,0 +1,239 @@
+import os
+import numpy as np
+import pandas as pd
+
+weekdays = [
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+]
+
+
+def parse_dates(dates):
+    return pd.to_datetime(pd.Series(dates).astype(str), format="%Y%m%d")
+
+
+class ServiceCalendar:
+    """Dates on which GTFS services run, as one row of bits per service_id.
+
+    Bit d of a row is set when the service runs on day `start + d`. Rows
+    are packed with np.packbits, so a year of dates takes 46 bytes per
+    service, and selecting all services of a date is a single column read.
+    """
+
+    def __init__(self, service_ids, start, active: np.ndarray):
+        self.service_ids = np.asarray(service_ids).astype(str)
+        self.index = pd.Index(self.service_ids)
+        self.start = pd.Timestamp(start).normalize()
+        self.n_days = active.shape[1]
+        self.bits = np.packbits(active.astype(bool), axis=1)
+
+    @classmethod
+    def from_gtfs(cls, calendar: pd.DataFrame = None, calendar_dates=None):
+        """Expand calendar.txt weekday patterns and calendar_dates.txt
+        exceptions (1 added, 2 removed), either of which can be missing."""
+        empty = pd.DataFrame(columns=["service_id"])
+        calendar = empty if calendar is None else calendar
+        calendar_dates = empty if calendar_dates is None else calendar_dates
+
+        dates = []
+        if calendar.shape[0] > 0:
+            dates += [parse_dates(calendar.start_date), parse_dates(calendar.end_date)]
+        if calendar_dates.shape[0] > 0:
+            dates += [parse_dates(calendar_dates.date)]
+
+        service_ids = pd.Index(
+            pd.unique(
+                np.concatenate(
+                    [
+                        calendar.service_id.astype(str).values,
+                        calendar_dates.service_id.astype(str).values,
+                    ]
+                )
+            )
+        )
+
+        if len(dates) == 0:
+            return cls(service_ids, "2000-01-01", np.zeros((len(service_ids), 0)))
+
+        dates = pd.concat(dates)
+        start = dates.min()
+        n_days = (dates.max() - start).days + 1
+        active = np.zeros((len(service_ids), n_days), dtype=bool)
+
+        if calendar.shape[0] > 0:
+            day = np.arange(n_days)
+            weekday = (start.weekday() + day) % 7
+            first = (parse_dates(calendar.start_date) - start).dt.days.values
+            last = (parse_dates(calendar.end_date) - start).dt.days.values
+            runs = calendar[weekdays].values.astype(bool)
+
+            rows = service_ids.get_indexer(calendar.service_id.astype(str))
+            active[rows] = (
+                runs[:, weekday]
+                & (day >= first[:, None])
+                & (day <= last[:, None])
+            )
+
+        if calendar_dates.shape[0] > 0:
+            rows = service_ids.get_indexer(calendar_dates.service_id.astype(str))
+            day = (parse_dates(calendar_dates.date) - start).dt.days.values
+            added = calendar_dates.exception_type.values == 1
+            active[rows[added], day[added]] = True
+            active[rows[~added], day[~added]] = False
+
+        return cls(service_ids, start, active)
+
+    @classmethod
+    def read_gtfs(cls, gtfspath, prefix=""):
+        """Calendar of a GTFS folder, with `prefix` added to service ids."""
+        tables = {}
+        for name in ["calendar", "calendar_dates"]:
+            fname = f"{gtfspath}/{name}.txt"
+            if os.path.exists(fname):
+                table = pd.read_csv(fname, dtype={"service_id": str})
+                tables[name] = table.assign(service_id=prefix + table.service_id)
+        return cls.from_gtfs(**tables)
+
+    @classmethod
+    def concat(cls, calendars):
+        """Calendars of several feeds, over the union of their dates."""
+        calendars = [c for c in calendars if c.n_days > 0]
+        if len(calendars) == 0:
+            return cls([], "2000-01-01", np.zeros((0, 0)))
+
+        start = min(c.start for c in calendars)
+        end = max(c.start + pd.Timedelta(days=c.n_days) for c in calendars)
+        n_days = (end - start).days
+
+        service_ids, active = [], []
+        for c in calendars:
+            offset = (c.start - start).days
+            rows = np.zeros((len(c.service_ids), n_days), dtype=bool)
+            rows[:, offset : offset + c.n_days] = c.active_between(
+                c.start, c.start + pd.Timedelta(days=c.n_days - 1)
+            )
+            service_ids.append(c.service_ids)
+            active.append(rows)
+
+        return cls(np.concatenate(service_ids), start, np.vstack(active))
+
+    def day(self, date):
+        return (pd.Timestamp(date).normalize() - self.start).days
+
+    def active_mask(self, date):
+        """Boolean per service, True when it runs on `date`."""
+        d = self.day(date)
+        if d < 0 or d >= self.n_days:
+            return np.zeros(len(self.service_ids), dtype=bool)
+        return (self.bits[:, d >> 3] & (0x80 >> (d & 7))) > 0
+
+    def active(self, date):
+        """Service ids running on `date`."""
+        return self.service_ids[self.active_mask(date)]
+
+    def active_between(self, first, last):
+        """Boolean matrix (services x days) from `first` to `last` date."""
+        d0, d1 = self.day(first), self.day(last) + 1
+        active = np.zeros((len(self.service_ids), max(d1 - d0, 0)), dtype=bool)
+
+        lo, hi = max(d0, 0), min(d1, self.n_days)
+        if lo < hi:
+            unpacked = np.unpackbits(self.bits, axis=1, count=self.n_days)
+            active[:, lo - d0 : hi - d0] = unpacked[:, lo:hi].astype(bool)
+        return active
+
+    def busiest_date(self, prefix=""):
+        """The date with the most services running, of the services with
+        ids starting with `prefix` (a feed)."""
+        rows = np.char.startswith(self.service_ids, prefix)
+        if self.n_days == 0 or not rows.any():
+            raise ValueError(f"No service dates for '{prefix}'")
+
+        unpacked = np.unpackbits(self.bits[rows], axis=1, count=self.n_days)
+        return self.start + pd.Timedelta(days=int(unpacked.sum(axis=0).argmax()))
+
+    def feeds(self, sep=":"):
+        """Feed prefixes of the service ids, such as "germany:"."""
+        prefixes = [i.split(sep)[0] + sep for i in self.service_ids if sep in i]
+        return sorted(set(prefixes))
+
+    def busiest_dates(self, sep=":"):
+        """Busiest date of each feed, as different feeds can cover
+        different periods."""
+        return {feed: self.busiest_date(feed) for feed in self.feeds(sep)}
+
+    def service_days(self, date, n_days=1, overnight=True):
+        """Services running on each service date needed for travel on
+        `n_days` days from `date`, with the day offset of that date.
+
+        With `overnight`, services of the day before are included too, as
+        their trips can continue past midnight (GTFS times over 24:00).
+        """
+        date = pd.Timestamp(date).normalize()
+        first = -1 if overnight else 0
+
+        active = self.active_between(
+            date + pd.Timedelta(days=first), date + pd.Timedelta(days=n_days - 1)
+        )
+        rows, offset = np.nonzero(active)
+
+        return pd.DataFrame(
+            dict(service_id=self.service_ids[rows], day_offset=offset + first)
+        )
+
+    def save(self, fout):
+        np.savez(
+            fout,
+            service_ids=self.service_ids,
+            start=str(self.start.date()),
+            n_days=self.n_days,
+            bits=self.bits,
+        )
+
+    @classmethod
+    def load(cls, fin):
+        with np.load(fin) as f:
+            bits = f["bits"]
+            active = np.unpackbits(bits, axis=1, count=int(f["n_days"]))
+            return cls(f["service_ids"], str(f["start"]), active)
+
+
+def select_trips(stop_times, calendar: ServiceCalendar, date, n_days=1, overnight=True):
+    """Stop times of the trips running when travelling on `date`.
+
+    `date` can also be a dict of a date per feed prefix of the service ids,
+    such as from ServiceCalendar.busiest_dates().
+
+    Rows get a `day_offset` (days from `date` to the service date). When a
+    trip can run on several of the selected service dates, its copies get
+    the service date in their trip_id.
+    """
+    if isinstance(date, dict):
+        return pd.concat(
+            [
+                select_trips(
+                    stop_times[stop_times.service_id.str.startswith(feed)],
+                    calendar,
+                    feed_date,
+                    n_days,
+                    overnight,
+                )
+                for feed, feed_date in date.items()
+            ],
+            ignore_index=True,
+        )
+
+    days = calendar.service_days(date, n_days=n_days, overnight=overnight)
+    selected = stop_times.merge(days, on="service_id")
+
+    if n_days > 1 or overnight:
+        selected = selected.assign(
+            trip_id=selected.trip_id + "@" + selected.day_offset.astype(str)
+        )
+
+    return selected
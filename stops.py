@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+def cluster_points(x, y, radius: float):
+    """Label points that are connected by links shorter than `radius`.
+
+    Pairs within the radius come from a KD-tree query, and clusters are the
+    connected components of these links (single linkage, like union-find),
+    so stations are never split by grid cell borders.
+    """
+    n = len(x)
+    tree = cKDTree(np.column_stack([x, y]))
+    pairs = tree.query_pairs(r=radius, output_type="ndarray")
+
+    links = coo_matrix(
+        (np.ones(len(pairs), dtype=bool), (pairs[:, 0], pairs[:, 1])), shape=(n, n)
+    )
+    _, labels = connected_components(links, directed=False)
+
+    return labels
+
+
+def unify_stops(gtfs_routes: pd.DataFrame, radius: float = 1.0):
+    """Merge stops within `radius` km into stations.
+
+    Adds `uni_stop_id` and `uni_stop_name` columns. The name of a station is
+    the most frequent stop name of its rows, alphabetically on ties.
+    Requires projected `stop_x` and `stop_y` columns (km).
+    """
+    positions = gtfs_routes[["stop_x", "stop_y"]].drop_duplicates()
+    positions = positions.assign(
+        cluster=cluster_points(positions.stop_x.values, positions.stop_y.values, radius)
+    )
+
+    gtfs_routes = gtfs_routes.merge(positions, on=["stop_x", "stop_y"], how="left")
+
+    names = (
+        gtfs_routes.groupby(["cluster", "stop_name"])
+        .size()
+        .rename("n")
+        .reset_index()
+        .sort_values(["cluster", "n", "stop_name"], ascending=[True, False, True])
+        .drop_duplicates("cluster")[["cluster", "stop_name"]]
+        .rename(columns=dict(stop_name="uni_stop_name"))
+    )
+
+    return (
+        gtfs_routes.merge(names, on="cluster")
+        .assign(uni_stop_id=lambda d: (d.cluster + 1).astype(str))
+        .drop(columns="cluster")
+    )
+
+
+def service_groups(links: pd.DataFrame):
+    """Group stops by the set of trips leaving and arriving at them.
+
+    `links` has one row per hop, with `source`, `target` and `trip_id`.
+    Returns two dicts, stop to outbound group and stop to inbound group;
+    stops without outbound (or inbound) service are not in the dict.
+    """
+    groups = []
+    for column in ["source", "target"]:
+        trips = links.groupby(column).trip_id.agg(frozenset)
+        codes, _ = pd.factorize(trips.values)
+        groups.append(dict(zip(trips.index, codes)))
+    return tuple(groups)
+
+
+def trip_positions(links: pd.DataFrame):
+    """First and last position of each stop on each trip.
+
+    `links` has `source_position` and `target_position` columns besides
+    those of service_groups, such as the times or sequence numbers of both
+    stops on the trip. Returns a frame indexed by (stop, trip_id).
+    """
+    visits = pd.concat(
+        [
+            links[[column, "trip_id", f"{column}_position"]].set_axis(
+                ["stop", "trip_id", "position"], axis=1
+            )
+            for column in ["source", "target"]
+        ]
+    )
+    return (
+        visits.groupby(["stop", "trip_id"])
+        .position.agg(first="min", last="max")
+        .sort_index()
+    )
+
+
+def dominates(positions: pd.DataFrame, kept, stop, origin=True):
+    """True when every trip of `stop` is boarded (origin) or left
+    (destination) at least as well at `kept`: downstream of `stop` on the
+    origin side, upstream on the destination side."""
+    a, b = positions.loc[kept], positions.loc[stop]
+    if not a.index.equals(b.index):
+        return False
+    if origin:
+        return bool((a["first"] >= b["last"]).all())
+    return bool((a["last"] <= b["first"]).all())
+
+
+def prune_candidates(
+    candidates: dict, groups: dict, positions: pd.DataFrame = None, origin=True
+):
+    """Drop candidate stops that are dominated by another one.
+
+    `candidates` maps stops to their access time. Stops without service
+    are dropped. With `positions` (see trip_positions), a stop is dropped
+    when another stop with no more access time is served by the same
+    trips, and every trip reaches that other stop no earlier on the origin
+    side (or no later on the destination side), so riding between the two
+    can never help. Otherwise all stops are kept.
+    """
+    members = {}
+    for stop in candidates:
+        group = groups.get(stop)
+        if group is not None:
+            members.setdefault(group, []).append(stop)
+
+    def dominated(stop, others):
+        for k in others:
+            if k == stop or candidates[k] > candidates[stop]:
+                continue
+            if not dominates(positions, k, stop, origin):
+                continue
+            # of stops dominating each other, keep the first by id
+            mutual = candidates[k] == candidates[stop] and dominates(
+                positions, stop, k, origin
+            )
+            if not (mutual and stop < k):
+                return True
+        return False
+
+    return {
+        stop: candidates[stop]
+        for others in members.values()
+        for stop in others
+        if positions is None or not dominated(stop, others)
+    }
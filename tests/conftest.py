@@ -0,0 +1,53 @@
+import os
+import sys
+import pytest
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "benchmarks"))
+
+import synthetic
+
+
+@pytest.fixture(scope="session", autouse=True)
+def data_dir(tmp_path_factory):
+    """Run in a directory with synthetic data/, as location.py reads it on
+    import. Import pipeline modules inside the tests."""
+    path = tmp_path_factory.mktemp("copula")
+    cwd = os.getcwd()
+    os.chdir(path)
+    airports = synthetic.write_data_dir(".", n_cities=10, seed=0)
+    feed = synthetic.gen_gtfs(airports, stops_per_city=2, n_lines=10, n_trips=200)
+    synthetic.write_gtfs(feed, "data/source/train/gtfs_synthetic")
+    yield airports
+    os.chdir(cwd)
+
+
+@pytest.fixture(scope="session")
+def train_graph(data_dir):
+    """Routing graph of the synthetic GTFS feed, with the city pairs."""
+    import location
+    import process_train
+    from service_calendar import ServiceCalendar, select_trips
+
+    city_pairs, proj = location.gen_city_pairs(data_dir, cache=False)
+    gtfs_routes = process_train.generate_gtfs_routes()
+    gtfs_routes = process_train.process_gtfs_routes(gtfs_routes, proj)
+
+    calendar = ServiceCalendar.load("data/train_calendar.npz")
+    day_routes = select_trips(
+        gtfs_routes, calendar, calendar.busiest_dates(), overnight=False
+    )
+    G, edges, nodes = process_train.create_graph(day_routes)
+
+    return dict(G=G, nodes=nodes, city_pairs=city_pairs, proj=proj)
+
+
+@pytest.fixture(scope="session")
+def train_routes(train_graph):
+    """Train routes of all city pairs, from the synthetic GTFS feed."""
+    import process_train
+
+    return process_train.create_train_routes(
+        train_graph["G"], train_graph["nodes"], train_graph["city_pairs"], progress=False
+    )
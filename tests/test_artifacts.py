@@ -0,0 +1,34 @@
+import pandas as pd
+import artifacts
+
+
+def stage_v1():
+    return pd.DataFrame(dict(a=[1]))
+
+
+def stage_v2():
+    return pd.DataFrame(dict(a=[2]))
+
+
+def test_cache_key_depends_on_code(tmp_path):
+    fin = tmp_path / "input.csv"
+    fin.write_text("a\n1\n")
+    calls = []
+
+    def compute(stage):
+        calls.append(stage)
+        return stage()
+
+    for stage in [stage_v1, stage_v1, stage_v2]:
+        result = artifacts.cached(
+            "stage",
+            lambda: compute(stage),
+            inputs=[str(fin)],
+            code=[stage],
+            fmt="parquet",
+            root=str(tmp_path / "cache"),
+        )
+        assert result.a[0] == stage().a[0]
+
+    # same code is served from the cache, changed code is computed again
+    assert calls == [stage_v1, stage_v2]
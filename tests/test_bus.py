@@ -0,0 +1,19 @@
+import networkx as nx
+import numpy as np
+
+
+def test_shortest_paths_from_matches_networkx():
+    import process_bus
+
+    G = nx.Graph()
+    G.add_edges_from(
+        [("a", "b"), ("b", "d"), ("a", "c"), ("c", "d"), ("d", "e"), ("e", np.nan)]
+    )
+    G.add_node("f")
+
+    paths = process_bus.shortest_paths_from(G, "a", ["d", "e", "f"])
+
+    assert set(paths) == {"d", "e"}
+    for target, found in paths.items():
+        expected = nx.all_shortest_paths(G, "a", target)
+        assert sorted(found) == sorted(expected)
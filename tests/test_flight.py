@@ -0,0 +1,82 @@
+import itertools
+import pandas as pd
+import synthetic
+
+
+def test_ectl_files(tmp_path):
+    import process_flight
+
+    for month in ["201902", "201903", "201904"]:
+        folder = tmp_path / month[:4] / month
+        folder.mkdir(parents=True)
+        (folder / f"Flights_{month}01_{month}28.csv.gz").touch()
+        (folder / "other.csv.gz").touch()
+
+    files = process_flight.ectl_files(str(tmp_path), "2019-03", "2019-04")
+
+    assert [f.split("/")[-1] for f in files] == [
+        "Flights_20190301_20190328.csv.gz",
+        "Flights_20190401_20190428.csv.gz",
+    ]
+
+
+def baseline_flight_routes(airports, od_pairs):
+    # gen_flight_routes before the airport index: a join on city names
+    cities = airports.drop_duplicates(subset=["city"])
+    city_pairs = pd.DataFrame(
+        itertools.product(cities["city"], repeat=2),
+        columns=["city_origin", "city_destination"],
+    ).query("city_origin!=city_destination")
+
+    flight_routes = (
+        city_pairs.merge(airports, left_on=["city_origin"], right_on=["city"])
+        .rename(columns={"airport": "origin"})
+        .drop(columns=["city"])
+        .merge(
+            airports,
+            left_on=["city_destination"],
+            right_on=["city"],
+            suffixes=("_origin", "_destination"),
+        )
+        .rename(columns={"airport": "destination"})
+        .drop(columns=["city"])
+    )
+    return flight_routes.merge(od_pairs, how="inner")
+
+
+def test_gen_flight_routes_matches_baseline():
+    import process_flight
+
+    airports = synthetic.gen_airports(8, airports_per_city=2, seed=1)
+    od_pairs = synthetic.gen_flight_routes(airports)[
+        ["origin", "destination", "distance", "duration", "typecode", "daily_flights"]
+    ].copy()
+    # an airport missing from the airport table
+    od_pairs.loc[len(od_pairs)] = ["ZZZZ", od_pairs.origin[0], 500, 90, "A320", 1]
+
+    routes = process_flight.gen_flight_routes(airports, od_pairs)
+    expected = baseline_flight_routes(airports, od_pairs)
+
+    pd.testing.assert_frame_equal(routes, expected.reset_index(drop=True))
+
+
+def test_gen_flight_routes_radius():
+    import process_flight
+
+    airports = synthetic.gen_airports(8, seed=1)
+    # a second city next to the airport of the first one
+    nearby = airports.iloc[[0]].assign(airport="NEAR", city="Nearby")
+    airports = pd.concat([airports, nearby], ignore_index=True)
+    od_pairs = synthetic.gen_flight_routes(airports)[
+        ["origin", "destination", "distance", "duration", "typecode", "daily_flights"]
+    ]
+
+    own = process_flight.gen_flight_routes(airports, od_pairs)
+    near = process_flight.gen_flight_routes(airports, od_pairs, radius=50)
+
+    city = airports.city[0]
+    assert set(own.query("city_origin == @city").origin) == {airports.airport[0]}
+    assert set(near.query("city_origin == @city").origin) == {
+        airports.airport[0],
+        "NEAR",
+    }
@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+from service_calendar import ServiceCalendar, select_trips
+
+
+def feed_calendar(prefix, start_date, end_date):
+    calendar = pd.DataFrame(
+        dict(
+            service_id=["DAILY"],
+            monday=[1],
+            tuesday=[1],
+            wednesday=[1],
+            thursday=[1],
+            friday=[1],
+            saturday=[1],
+            sunday=[1],
+            start_date=[start_date],
+            end_date=[end_date],
+        )
+    )
+    return ServiceCalendar.from_gtfs(calendar.assign(service_id=prefix + "0012"))
+
+
+def test_busiest_date_per_feed():
+    calendar = ServiceCalendar.concat(
+        [
+            feed_calendar("a:", 20240101, 20240107),
+            feed_calendar("b:", 20240301, 20240307),
+        ]
+    )
+    dates = calendar.busiest_dates()
+    assert dates == {
+        "a:": pd.Timestamp("2024-01-01"),
+        "b:": pd.Timestamp("2024-03-01"),
+    }
+
+    stop_times = pd.DataFrame(
+        dict(trip_id=["t1", "t2"], service_id=["a:0012", "b:0012"])
+    )
+    selected = select_trips(stop_times, calendar, dates, overnight=False)
+    assert sorted(selected.trip_id) == ["t1", "t2"]
+
+    # a single date drops the feed not running on it
+    selected = select_trips(stop_times, calendar, dates["a:"], overnight=False)
+    assert selected.trip_id.tolist() == ["t1"]
+
+
+def test_concat_empty():
+    calendar = ServiceCalendar.concat([])
+    assert len(calendar.service_ids) == 0
+    assert calendar.active("2024-01-01").size == 0
+    with pytest.raises(ValueError):
+        calendar.busiest_date()
@@ -0,0 +1,54 @@
+import pandas as pd
+import stops
+
+
+def line_links():
+    # two trips along one line: A -> B -> C, stations A and B in one city
+    return pd.DataFrame(
+        dict(
+            source=["A", "B", "A", "B"],
+            target=["B", "C", "B", "C"],
+            trip_id=["t1", "t1", "t2", "t2"],
+            source_position=[600, 630, 720, 750],
+            target_position=[628, 700, 748, 820],
+        )
+    )
+
+
+def test_prune_keeps_downstream_origin():
+    links = line_links()
+    outbound, inbound = stops.service_groups(links)
+    positions = stops.trip_positions(links)
+
+    assert outbound["A"] == outbound["B"]
+
+    # A sorts first, but boarding at B saves the ride from A
+    pruned = stops.prune_candidates({"A": 0, "B": 0}, outbound, positions)
+    assert pruned == {"B": 0}
+
+    # A is closer, so both are kept
+    pruned = stops.prune_candidates({"A": 0, "B": 5}, outbound, positions)
+    assert pruned == {"A": 0, "B": 5}
+
+    # B upstream of C on the destination side
+    pruned = stops.prune_candidates(
+        {"B": 0, "C": 0}, inbound, positions, origin=False
+    )
+    assert pruned == {"B": 0}
+
+    # without positions, only stops without service are dropped
+    pruned = stops.prune_candidates({"A": 0, "B": 0, "X": 0}, outbound)
+    assert pruned == {"A": 0, "B": 0}
+
+
+def test_pruned_routes_match_unpruned(train_graph, train_routes):
+    import process_train
+
+    unpruned = process_train.create_train_routes(
+        train_graph["G"],
+        train_graph["nodes"],
+        train_graph["city_pairs"],
+        progress=False,
+        prune=False,
+    )
+    pd.testing.assert_frame_equal(train_routes, unpruned)
@@ -0,0 +1,67 @@
+from timetable import Timetable
+
+
+def walk_timetable():
+    # one train from A to B, the destination C is a 5 minute walk from B
+    return Timetable(
+        dep_stop=[0],
+        arr_stop=[1],
+        dep_time=[400.0],
+        arr_time=[450.0],
+        trip=[0],
+        trip_ids=["t0"],
+        stop_ids=["A", "B", "C"],
+        stop_names=["A", "B", "C"],
+        stop_lat=[50.0, 50.5, 50.51],
+        stop_lon=[4.0, 5.0, 5.0],
+        footpaths=([1], [2], [5.0]),
+    )
+
+
+def test_earliest_arrival_on_foot():
+    tt = walk_timetable()
+    journey = tt.earliest_arrival({0: 0}, {2: 0}, departure=360)
+
+    assert journey.arrival == 455
+    assert journey.departure == 400
+    assert journey.legs == [(0, 0, 0), (-1, 1, 2)]
+    assert tt.journey_stops(journey).tolist() == [0, 1, 2]
+
+
+def test_profile_on_foot():
+    tt = walk_timetable()
+    profile = tt.profile({0: 0}, {2: 0})
+
+    assert profile[["departure", "arrival", "transfers"]].values.tolist() == [
+        [400, 455, 0]
+    ]
+
+    # the same journey from a source one walk away from the first stop
+    tt = Timetable(
+        dep_stop=[0],
+        arr_stop=[1],
+        dep_time=[400.0],
+        arr_time=[450.0],
+        trip=[0],
+        trip_ids=["t0"],
+        stop_ids=["A", "B", "S"],
+        stop_names=["A", "B", "S"],
+        stop_lat=[50.0, 50.5, 50.01],
+        stop_lon=[4.0, 5.0, 4.0],
+        footpaths=([2], [0], [5.0]),
+    )
+    profile = tt.profile({2: 0}, {1: 0})
+    assert profile[["departure", "arrival"]].values.tolist() == [[395, 450]]
+    assert tt.earliest_arrival({2: 0}, {1: 0}, departure=360).arrival == 450
+
+
+def test_profile_scan_for_many_sources():
+    tt = walk_timetable()
+    scan = tt.profile_scan({2: 0})
+
+    from_a = tt.profile_from(scan, {0: 0})
+    assert from_a.equals(tt.profile({0: 0}, {2: 0}))
+    # from B the destination is only a walk away
+    assert tt.profile_from(scan, {1: 0}).shape[0] == 0
+
+    assert tt.profile_scan({2: 0}, deadline=0).timed_out
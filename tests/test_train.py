@@ -0,0 +1,32 @@
+import numpy as np
+
+
+def path_cost(edges, start_time=360, transfer_penalty=10, time_penalty_factor=0.1):
+    # cost of a path as in shortest_path_multi
+    cost, trip = start_time, None
+    for _, _, _, d in edges:
+        penalty = transfer_penalty if trip not in (None, d["trip_id"]) else 0
+        time_penalty = (d["depart_from_target_mins"] - start_time) * time_penalty_factor
+        cost += d["duration_mins"] + penalty + time_penalty
+        trip = d["trip_id"]
+    return cost
+
+
+def test_bounds_keep_shortest_paths(train_graph):
+    import process_train
+
+    G = train_graph["G"]
+    bounds = process_train.SearchBounds(G, n_landmarks=4)
+    assert np.isfinite(bounds.vmax)
+
+    nodes = sorted(G.nodes)
+    rng = np.random.default_rng(0)
+    for orig, dest in rng.choice(nodes, size=(30, 2)):
+        if orig == dest:
+            continue
+
+        plain = process_train.shortest_path(G, orig, dest)
+        astar = process_train.shortest_path(G, orig, dest, bounds=bounds)
+
+        assert astar[0] == plain[0]
+        assert path_cost(astar[1]) == path_cost(plain[1])
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+
+def test_train_routes_pass_time_checks(train_routes):
+    import validate
+
+    assert train_routes.shape[0] > 0
+    flags = validate.check_routes(train_routes, "train")
+
+    assert flags.times_not_monotonic.sum() == 0
+    assert flags.duration_exceeds_times.sum() == 0
+    assert flags.missing.sum() == 0
+    assert flags.non_positive.sum() == 0
+
+
+def test_times_past_midnight():
+    import validate
+
+    routes = pd.DataFrame(
+        dict(
+            departure=[1380, 1380, 360, np.nan, 360],
+            arrival=[1500, 60, 300, 420, 420],
+            duration=[120, 120, 60, 60, 600],
+        )
+    ).assign(
+        distance=100.0,
+        lat0=50.0,
+        lon0=4.0,
+        lat1=50.5,
+        lon1=5.0,
+        coords="",
+    )
+
+    flags = validate.check_routes(routes, "train")
+    # GTFS times past midnight are above 24:00, 01:00 is a wrong time
+    assert flags.times_not_monotonic.tolist() == [False, True, True, True, False]
+    assert flags.duration_exceeds_times.tolist() == [False, True, True, False, True]
@@ -0,0 +1,559 @@
+import time
+import bisect
+from dataclasses import dataclass, field
+import numpy as np
+import pandas as pd
+
+
+def gtfs_times_to_minutes(times: pd.Series):
+    """Vectorised GTFS time (HH:MM:SS, can be > 24h) to minutes after midnight."""
+    parts = times.astype(str).str.split(":", expand=True)
+    parts = parts.apply(pd.to_numeric, errors="coerce")
+    return (parts[0] * 60 + parts[1] + parts[2] / 60).values
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 6371 * 2 * np.arcsin(np.sqrt(a))  # km
+
+
+def profile_windows(profile: pd.DataFrame, window=60, start=0, end=1440):
+    """Shortest journey departing within each departure time window."""
+    windows = pd.DataFrame(dict(window_start=np.arange(start, end, window)))
+    if profile.shape[0] == 0:
+        return windows.assign(
+            departure=np.nan, arrival=np.nan, duration=np.nan, transfers=np.nan
+        )
+
+    best = (
+        profile.assign(
+            window_start=lambda x: (x.departure - start) // window * window + start
+        )
+        .sort_values(["window_start", "duration", "transfers"])
+        .drop_duplicates("window_start")
+    )
+    return windows.merge(best, how="left")[
+        ["window_start", "departure", "arrival", "duration", "transfers"]
+    ]
+
+
+@dataclass
+class Journey:
+    departure: float
+    arrival: float
+    # (trip, boarding connection, alighting connection) per leg
+    legs: list = field(default_factory=list)
+    scanned: int = 0
+    timed_out: bool = False
+
+    @property
+    def duration(self):
+        return self.arrival - self.departure
+
+    @property
+    def transfers(self):
+        return max(len([leg for leg in self.legs if leg[0] >= 0]) - 1, 0)
+
+
+@dataclass
+class ProfileScan:
+    """Profiles of all stops towards a set of targets, from Timetable.profile_scan."""
+
+    # per stop: departures (negated, ascending) and best arrival per number
+    # of trips when ready at the stop at that time
+    profile_dep: list
+    profile_vec: list
+    start: float
+    k_max: int
+    timed_out: bool = False
+
+
+class Timetable:
+    """Compact in-memory timetable, queried with the Connection Scan Algorithm.
+
+    Every elementary connection (a vehicle going from one stop to the next)
+    is stored in flat arrays sorted by departure time. An earliest arrival
+    query is a single linear scan from the departure time, which stops as
+    soon as connections depart after the best arrival found so far.
+    """
+
+    arrays = ["dep_stop", "arr_stop", "dep_time", "arr_time", "trip"]
+    stop_arrays = ["stop_ids", "stop_names", "stop_lat", "stop_lon"]
+
+    def __init__(
+        self,
+        dep_stop,
+        arr_stop,
+        dep_time,
+        arr_time,
+        trip,
+        trip_ids,
+        stop_ids,
+        stop_names,
+        stop_lat,
+        stop_lon,
+        transfer=10,
+        trip_modes=None,
+        footpaths=None,
+    ):
+        order = np.lexsort((arr_time, dep_time))
+        self.dep_stop = np.asarray(dep_stop, dtype=np.int32)[order]
+        self.arr_stop = np.asarray(arr_stop, dtype=np.int32)[order]
+        self.dep_time = np.asarray(dep_time, dtype=np.float64)[order]
+        self.arr_time = np.asarray(arr_time, dtype=np.float64)[order]
+        self.trip = np.asarray(trip, dtype=np.int32)[order]
+
+        self.trip_ids = np.asarray(trip_ids).astype(str)
+        self.stop_ids = np.asarray(stop_ids).astype(str)
+        self.stop_names = np.asarray(stop_names).astype(str)
+        self.stop_lat = np.asarray(stop_lat, dtype=np.float64)
+        self.stop_lon = np.asarray(stop_lon, dtype=np.float64)
+
+        # minimum time (minutes) to change between vehicles at a stop
+        self.transfer = transfer
+
+        # optional transport mode of each trip, for multimodal timetables
+        if trip_modes is None:
+            trip_modes = np.full(len(self.trip_ids), "")
+        self.trip_modes = np.asarray(trip_modes).astype(str)
+
+        # optional transfer links between stops: (from, to, minutes) arrays
+        if footpaths is None:
+            footpaths = (np.zeros(0, int), np.zeros(0, int), np.zeros(0))
+        self.fp_from, self.fp_to, self.fp_minutes = (np.asarray(a) for a in footpaths)
+
+        self.n_stops = len(self.stop_ids)
+        self.n_connections = len(self.dep_time)
+        self.stop_index = {s: i for i, s in enumerate(self.stop_ids)}
+
+        # connections of each trip in sequence, to recover intermediate stops
+        self.trip_order = np.lexsort((self.dep_time, self.trip))
+        self.trip_start = np.searchsorted(
+            self.trip[self.trip_order], np.arange(len(self.trip_ids) + 1)
+        )
+        self.conn_pos = np.empty(self.n_connections, dtype=np.int64)
+        self.conn_pos[self.trip_order] = np.arange(self.n_connections) - np.repeat(
+            self.trip_start[:-1], np.diff(self.trip_start)
+        )
+
+        # plain lists are much faster than numpy arrays for scalar access
+        self._dep_stop = self.dep_stop.tolist()
+        self._arr_stop = self.arr_stop.tolist()
+        self._dep_time = self.dep_time.tolist()
+        self._arr_time = self.arr_time.tolist()
+        self._trip = self.trip.tolist()
+
+        self._footpaths = [[] for _ in range(len(self.stop_ids))]
+        for u, v, m in zip(
+            self.fp_from.tolist(), self.fp_to.tolist(), self.fp_minutes.tolist()
+        ):
+            self._footpaths[u].append((v, m))
+
+    @classmethod
+    def from_stop_times(cls, stop_times: pd.DataFrame, stop_column="stop_id", **kwargs):
+        """Build from a table of stop times.
+
+        Requires trip_id, stop_sequence, arrival_time, departure_time (GTFS
+        format), stop_name, stop_lat, stop_lon and the stop id column, which
+        can be `uni_stop_id` for merged stations. An optional `day_offset`
+        column shifts the times of trips by whole days.
+        """
+        df = stop_times.dropna(subset=[stop_column]).sort_values(
+            ["trip_id", "stop_sequence"]
+        )
+
+        stop_codes, stop_ids = pd.factorize(df[stop_column])
+        trip_codes, trip_ids = pd.factorize(df.trip_id)
+
+        stops = (
+            pd.DataFrame({stop_column: stop_ids})
+            .merge(
+                df.drop_duplicates(stop_column)[
+                    [stop_column, "stop_name", "stop_lat", "stop_lon"]
+                ],
+                how="left",
+            )
+        )
+
+        arrival = gtfs_times_to_minutes(df.arrival_time)
+        departure = gtfs_times_to_minutes(df.departure_time)
+
+        # trips of other service dates, see service_calendar.select_trips
+        if "day_offset" in df:
+            arrival = arrival + df.day_offset.values * 1440
+            departure = departure + df.day_offset.values * 1440
+
+        same_trip = trip_codes[1:] == trip_codes[:-1]
+        dep_time = departure[:-1][same_trip]
+        arr_time = arrival[1:][same_trip]
+
+        # some feeds restart the clock after midnight
+        arr_time = np.where(arr_time < dep_time, arr_time + 1440, arr_time)
+
+        valid = ~(np.isnan(dep_time) | np.isnan(arr_time))
+
+        return cls(
+            dep_stop=stop_codes[:-1][same_trip][valid],
+            arr_stop=stop_codes[1:][same_trip][valid],
+            dep_time=dep_time[valid],
+            arr_time=arr_time[valid],
+            trip=trip_codes[:-1][same_trip][valid],
+            trip_ids=trip_ids,
+            stop_ids=stops[stop_column].values,
+            stop_names=stops.stop_name.values,
+            stop_lat=stops.stop_lat.values,
+            stop_lon=stops.stop_lon.values,
+            **kwargs,
+        )
+
+    @classmethod
+    def concat(cls, timetables: dict, footpaths=None, transfer=10):
+        """Join timetables of several modes, e.g. {"train": ..., "bus": ...}.
+
+        Stop and trip indices of each timetable are offset, so `footpaths`
+        refer to stop indices in the joined timetable (see stop_offsets).
+        """
+        parts = {k: [] for k in cls.arrays + cls.stop_arrays + ["trip_ids"]}
+        trip_modes = []
+        stop_offset = trip_offset = 0
+
+        for mode, tt in timetables.items():
+            parts["dep_stop"].append(tt.dep_stop + stop_offset)
+            parts["arr_stop"].append(tt.arr_stop + stop_offset)
+            parts["trip"].append(tt.trip + trip_offset)
+            for k in ["dep_time", "arr_time", "trip_ids"] + cls.stop_arrays:
+                parts[k].append(getattr(tt, k))
+            trip_modes.append(np.full(len(tt.trip_ids), mode))
+
+            stop_offset += tt.n_stops
+            trip_offset += len(tt.trip_ids)
+
+        return cls(
+            **{k: np.concatenate(v) for k, v in parts.items()},
+            transfer=transfer,
+            trip_modes=np.concatenate(trip_modes),
+            footpaths=footpaths,
+        )
+
+    @staticmethod
+    def stop_offsets(timetables: dict):
+        sizes = [tt.n_stops for tt in timetables.values()]
+        return dict(zip(timetables, np.cumsum([0] + sizes[:-1]).tolist()))
+
+    def save(self, fout):
+        np.savez(
+            fout,
+            transfer=self.transfer,
+            trip_ids=self.trip_ids,
+            trip_modes=self.trip_modes,
+            fp_from=self.fp_from,
+            fp_to=self.fp_to,
+            fp_minutes=self.fp_minutes,
+            **{k: getattr(self, k) for k in self.arrays + self.stop_arrays},
+        )
+
+    @classmethod
+    def load(cls, fin, **kwargs):
+        data = np.load(fin)
+        kwargs.setdefault("transfer", float(data["transfer"]))
+        if "trip_modes" in data:
+            kwargs.setdefault("trip_modes", data["trip_modes"])
+        if "fp_from" in data:
+            kwargs.setdefault(
+                "footpaths", (data["fp_from"], data["fp_to"], data["fp_minutes"])
+            )
+        return cls(
+            trip_ids=data["trip_ids"],
+            **{k: data[k] for k in cls.arrays + cls.stop_arrays},
+            **kwargs,
+        )
+
+    def earliest_arrival(
+        self, sources: dict, targets: dict, departure: float, deadline: float = None
+    ):
+        """Earliest arrival journey from any source to any target stop.
+
+        `sources` and `targets` map stop indices to access and egress times
+        (minutes), so a whole city can be queried in one scan. `deadline` is
+        a time.perf_counter() value after which the scan is aborted.
+
+        Footpaths are taken after any connection, also to reach a target.
+        Journeys on foot only, without any connection, are not returned.
+        """
+        inf = float("inf")
+        dep_stop, arr_stop = self._dep_stop, self._arr_stop
+        dep_time, arr_time, trips = self._dep_time, self._arr_time, self._trip
+        transfer, footpaths = self.transfer, self._footpaths
+
+        # earliest time at which a vehicle can be boarded at each stop
+        ready = [inf] * self.n_stops
+        # (trip, boarding connection, alighting connection) reaching each stop,
+        # or (-1, from stop, to stop) for a footpath
+        reached_by = [None] * self.n_stops
+        boarded = {}
+
+        for s, access in sources.items():
+            ready[s] = min(ready[s], departure + access)
+
+        for s in sources:
+            for f, minutes in footpaths[s]:
+                if ready[s] + minutes < ready[f]:
+                    ready[f] = ready[s] + minutes
+                    reached_by[f] = (-1, s, f)
+
+        best, best_legs = inf, None
+        start = bisect.bisect_left(dep_time, departure)
+        c = start
+        timed_out = False
+
+        for c in range(start, self.n_connections):
+            dep = dep_time[c]
+            if dep >= best:
+                break
+
+            if deadline is not None and ((c - start) & 4095) == 0:
+                if time.perf_counter() > deadline:
+                    timed_out = True
+                    break
+
+            trip = trips[c]
+            board = boarded.get(trip)
+            if board is None:
+                if ready[dep_stop[c]] > dep:
+                    continue
+                board = boarded[trip] = c
+
+            s, t = arr_stop[c], arr_time[c]
+            if t + transfer < ready[s]:
+                ready[s] = t + transfer
+                reached_by[s] = (trip, board, c)
+
+            for f, minutes in footpaths[s]:
+                if t + minutes < ready[f]:
+                    ready[f] = t + minutes
+                    reached_by[f] = (-1, s, f)
+
+                # a target reached on foot after this connection
+                egress = targets.get(f)
+                if egress is not None and t + minutes + egress < best:
+                    best = t + minutes + egress
+                    best_legs = [(trip, board, c), (-1, s, f)]
+
+            egress = targets.get(s)
+            if egress is not None and t + egress < best:
+                best, best_legs = t + egress, [(trip, board, c)]
+
+        journey = Journey(departure, best, scanned=c - start, timed_out=timed_out)
+        if best_legs is None:
+            return journey
+
+        legs = best_legs
+        while len(legs) <= self.n_stops:
+            s = self.leg_origin(legs[0])
+            if s in sources or reached_by[s] is None:
+                break
+            legs.insert(0, reached_by[s])
+
+        journey.legs = legs
+        journey.departure = dep_time[next(leg for leg in legs if leg[0] >= 0)[1]]
+        return journey
+
+    def leg_origin(self, leg):
+        trip, board, _ = leg
+        return board if trip < 0 else self._dep_stop[board]
+
+    def profile(
+        self,
+        sources: dict,
+        targets: dict,
+        start: float = 0,
+        end: float = 1440,
+        max_transfers: int = 4,
+    ):
+        """Pareto set of (departure, arrival, transfers) over a departure window.
+
+        One backward scan over the connections (profile Connection Scan with
+        a bound on the number of trips) replaces an earliest arrival query
+        per departure time. Departure times are at the source stops, minus
+        the access time.
+
+        Footpaths are taken after a connection, to a target or to transfer,
+        and from a source stop before the first connection, as in
+        earliest_arrival. Journeys on foot only are not included.
+        """
+        scan = self.profile_scan(targets, start, max_transfers)
+        return self.profile_from(scan, sources, end)
+
+    def profile_scan(
+        self,
+        targets: dict,
+        start: float = 0,
+        max_transfers: int = 4,
+        deadline: float = None,
+    ):
+        """Backward scan of profile(), towards the targets only. The result
+        can be read for any number of sources with profile_from(). `deadline`
+        is a time.perf_counter() value after which the scan is aborted."""
+        inf = float("inf")
+        k_max = max_transfers + 1
+        no_journey = (inf,) * k_max
+
+        dep_stop, arr_stop = self._dep_stop, self._arr_stop
+        dep_time, arr_time, trips = self._dep_time, self._arr_time, self._trip
+        transfer, footpaths = self.transfer, self._footpaths
+
+        profile_dep = [[] for _ in range(self.n_stops)]
+        profile_vec = [[] for _ in range(self.n_stops)]
+        trip_vec = {}
+        timed_out = False
+
+        first = bisect.bisect_left(dep_time, start)
+        last = self.n_connections - 1
+
+        for c in range(last, first - 1, -1):
+            if deadline is not None and ((last - c) & 4095) == 0:
+                if time.perf_counter() > deadline:
+                    timed_out = True
+                    break
+
+            s, t = arr_stop[c], arr_time[c]
+
+            # arrive at a target, stay seated, or transfer at the next stop
+            egress = targets.get(s)
+            tc = no_journey if egress is None else (t + egress,) * k_max
+
+            seated = trip_vec.get(trips[c])
+            if seated is not None:
+                tc = tuple(map(min, tc, seated))
+
+            negdeps = profile_dep[s]
+            if negdeps:
+                i = bisect.bisect_right(negdeps, -(t + transfer)) - 1
+                if i >= 0:
+                    p = profile_vec[s][i]
+                    tc = tuple(map(min, tc, (inf,) + p[:-1]))
+
+            # walk to another stop, to a target or to transfer there
+            for f, minutes in footpaths[s]:
+                egress = targets.get(f)
+                if egress is not None:
+                    tc = tuple(map(min, tc, (t + minutes + egress,) * k_max))
+
+                negdeps = profile_dep[f]
+                if negdeps:
+                    i = bisect.bisect_right(negdeps, -(t + minutes)) - 1
+                    if i >= 0:
+                        p = profile_vec[f][i]
+                        tc = tuple(map(min, tc, (inf,) + p[:-1]))
+
+            if tc[-1] == inf:
+                continue
+
+            trip_vec[trips[c]] = tc
+
+            u, dep = dep_stop[c], dep_time[c]
+            negdeps, vecs = profile_dep[u], profile_vec[u]
+            if vecs:
+                new = tuple(map(min, tc, vecs[-1]))
+                if new == vecs[-1]:
+                    continue
+                if negdeps[-1] == -dep:
+                    vecs[-1] = new
+                    continue
+            else:
+                new = tc
+            negdeps.append(-dep)
+            vecs.append(new)
+
+        return ProfileScan(profile_dep, profile_vec, start, k_max, timed_out)
+
+    def profile_from(self, scan: ProfileScan, sources: dict, end: float = 1440):
+        """Pareto set of profile() for the sources, from a profile_scan()."""
+        inf = float("inf")
+        footpaths = self._footpaths
+        profile_dep, profile_vec = scan.profile_dep, scan.profile_vec
+        start, k_max = scan.start, scan.k_max
+
+        # boarding at a source stop, or at a stop on foot from it
+        starts = list(sources.items()) + [
+            (f, access + minutes)
+            for u, access in sources.items()
+            for f, minutes in footpaths[u]
+        ]
+        entries = sorted(
+            (
+                (-negdep - access, vec)
+                for u, access in starts
+                for negdep, vec in zip(profile_dep[u], profile_vec[u])
+            ),
+            reverse=True,
+        )
+
+        pareto = []
+        best = [inf] * k_max
+        for departure, vec in entries:
+            for k in range(k_max):
+                if vec[k] < best[k] and (k == 0 or vec[k] < vec[k - 1]):
+                    if start <= departure <= end:
+                        pareto.append((departure, vec[k], k))
+            best = list(map(min, best, vec))
+
+        return pd.DataFrame(
+            pareto, columns=["departure", "arrival", "transfers"]
+        ).assign(duration=lambda x: x.arrival - x.departure)[::-1].reset_index(
+            drop=True
+        )
+
+    def leg_connections(self, leg):
+        """Connection indices of a leg, in travel order."""
+        trip, board, alight = leg
+        if trip < 0:
+            return np.zeros(0, dtype=np.int64)
+        offset = self.trip_start[trip]
+        return self.trip_order[
+            offset + self.conn_pos[board] : offset + self.conn_pos[alight] + 1
+        ]
+
+    def journey_stops(self, journey: Journey):
+        """Stop indices visited by a journey, including intermediate stops."""
+        stops = []
+        for leg in journey.legs:
+            if leg[0] < 0:
+                # footpath between two stops
+                if len(stops) == 0:
+                    stops.append(leg[1])
+                stops.append(leg[2])
+                continue
+            conns = self.leg_connections(leg)
+            if len(stops) == 0 or stops[-1] != self.dep_stop[conns[0]]:
+                stops.append(self.dep_stop[conns[0]])
+            stops.extend(self.arr_stop[conns])
+        return np.array(stops, dtype=np.int64)
+
+    def journey_distance(self, journey: Journey):
+        stops = self.journey_stops(journey)
+        lat, lon = self.stop_lat[stops], self.stop_lon[stops]
+        return haversine(lat[:-1], lon[:-1], lat[1:], lon[1:]).sum()
+
+    def journey_legs(self, journey: Journey):
+        return pd.DataFrame(
+            [
+                dict(
+                    trip_id=self.trip_ids[trip],
+                    mode=self.trip_modes[trip],
+                    stop_name_source=self.stop_names[self.dep_stop[board]],
+                    stop_name_target=self.stop_names[self.arr_stop[alight]],
+                    departure=self.dep_time[board],
+                    arrival=self.arr_time[alight],
+                )
+                for trip, board, alight in journey.legs
+                if trip >= 0
+            ]
+        )
+
+    def journey_modes(self, journey: Journey):
+        return [self.trip_modes[trip] for trip, _, _ in journey.legs if trip >= 0]
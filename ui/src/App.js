@@ -4,7 +4,7 @@ import './App.css';
 
 import {
   MapContainer, TileLayer, ZoomControl, Marker, Circle,
-  CircleMarker, Tooltip, Polyline, Popup, useMap
+  CircleMarker, Tooltip, Polyline, Popup, useMap, useMapEvents
 } from 'react-leaflet'
 
 import React, { useState, useEffect } from 'react';
@@ -29,6 +29,12 @@ const colors = {
   car: 'purple'
 };
 
+// zoom levels where the API switches to a more detailed route geometry,
+// same as location.zoom_tolerances
+const zoomTiers = [0, 6, 9, 12];
+
+const zoomTier = (zoom) => Math.max(...zoomTiers.filter(z => z <= zoom));
+
 
 
 function App() {
@@ -51,12 +57,34 @@ function App() {
   }, [origin]);
 
   const [routes, setRoutes] = useState({});
+  const [fitRoutes, setFitRoutes] = useState({});
+  const [zoom, setZoom] = useState(5);
+
+  const fetchRoutes = (dest, zoom, fit) => {
+    axios.get(`http://localhost:8000/route/${origin}/${dest}`, {
+      params: { zoom: Math.floor(zoom) }
+    })
+      .then(response => {
+        setRoutes(response.data.routes);
+        setSummary(response.data.summary);
+        if (fit) setFitRoutes(response.data.routes);
+      })
+      .catch(error => console.error(error));
+  };
+
+  // fetch more (or less) detailed geometry when the zoom tier changes
+  const tier = zoomTier(zoom);
+  useEffect(() => {
+    if (selectedDest) fetchRoutes(selectedDest, tier, false);
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [tier]);
 
   const handleMarkerClick = (dest) => {
     if (dest[0] === selectedDest) {
       // Deselect destination and clear routes
       setSelectedDest(null);
       setRoutes({});
+      setFitRoutes({});
       setSummary([])
       return;
     }
@@ -67,12 +95,7 @@ function App() {
     setRoutes({});
 
     // Get routes for each transport mode
-    axios.get(`http://localhost:8000/route/${origin}/${dest[0]}`)
-      .then(response => {
-        setRoutes(response.data.routes);
-        setSummary(response.data.summary);
-      })
-      .catch(error => console.error(error));
+    fetchRoutes(dest[0], zoom, true);
   };
 
   const handlePolylineClick = (event, transportMode, popupInfo) => {
@@ -103,6 +126,14 @@ function App() {
     return null;
   }
 
+  const ZoomTracker = () => {
+    useMapEvents({
+      zoomend: (event) => setZoom(event.target.getZoom())
+    });
+
+    return null;
+  }
+
   const Route = ({ transportMode, route, handlePolylineClick, popupInfo }) => {
     if (route.length === 0) return null;
 
@@ -170,7 +201,8 @@ function App() {
     <div className="App">
       <ControlPanel setOrigin={setOrigin} origin={origin}
         setSummary={setSummary} summary={summary}
-        setSelectedDest={setSelectedDest} setRoutes={setRoutes} />
+        setSelectedDest={setSelectedDest}
+        setRoutes={(routes) => { setRoutes(routes); setFitRoutes(routes); }} />
 
       <MapContainer
         center={[50, 8]}
@@ -180,7 +212,8 @@ function App() {
         scrollWheelZoom={{ wheelPxPerZoomLevel: 60 }}
         zoomControl={false}
       >
-        <MapUpdater routes={routes} />
+        <MapUpdater routes={fitRoutes} />
+        <ZoomTracker />
 
         {popup && (
           <Popup position={popup.position}>
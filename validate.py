@@ -0,0 +1,156 @@
+# %%
+import os
+import json
+import numpy as np
+import pandas as pd
+import polyline
+from timetable import haversine
+from profiler import StageProfiler
+
+# plausible average speed (km/h) over a whole route, door to door
+speed_bounds = {
+    "car": (20, 140),
+    "bus": (10, 110),
+    "train": (15, 320),
+    "multimodal": (10, 900),
+}
+
+# route distance over the great-circle distance between the two cities
+max_detour = {"car": 3.0, "bus": 3.5, "train": 3.5, "multimodal": 4.0}
+
+
+# %%
+def decode_endpoints(coords: pd.Series):
+    """First and last point (lat, lon) of each polyline, NaN if invalid."""
+    endpoints = np.full((len(coords), 4), np.nan)
+    n_points = np.zeros(len(coords), dtype=int)
+
+    for i, c in enumerate(coords):
+        try:
+            points = polyline.decode(c)
+        except Exception:
+            continue
+        n_points[i] = len(points)
+        if len(points) > 0:
+            endpoints[i] = points[0] + points[-1]
+
+    return endpoints, n_points
+
+
+def check_routes(
+    routes: pd.DataFrame, mode: str, endpoint_radius=50, time_tolerance=1
+):
+    """Flags of failed checks for each route, True means failed.
+
+    `time_tolerance` (minutes) allows for rounding of the duration against
+    the departure and arrival times.
+    """
+    vmin, vmax = speed_bounds.get(mode, (0, np.inf))
+
+    distance = routes["distance"].values.astype(float)
+    duration = routes["duration"].values.astype(float)
+    direct = haversine(routes.lat0, routes.lon0, routes.lat1, routes.lon1).values
+
+    endpoints, n_points = decode_endpoints(routes["coords"])
+    lat_a, lon_a, lat_b, lon_b = endpoints.T
+    span = haversine(lat_a, lon_a, lat_b, lon_b)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed = distance / (duration / 60)
+        detour = distance / direct
+
+    flags = pd.DataFrame(
+        dict(
+            missing=np.isnan(distance) | np.isnan(duration),
+            non_positive=(distance <= 0) | (duration <= 0),
+            too_slow=speed < vmin,
+            too_fast=speed > vmax,
+            detour=detour > max_detour.get(mode, np.inf),
+            # a route can not be shorter than the line between its ends
+            shortcut=distance < 0.95 * span,
+            coords_invalid=n_points < 2,
+            coords_out_of_range=(np.abs(endpoints[:, [0, 2]]) > 90).any(axis=1)
+            | (np.abs(endpoints[:, [1, 3]]) > 180).any(axis=1),
+            far_from_origin=haversine(routes.lat0, routes.lon0, lat_a, lon_a).values
+            > endpoint_radius,
+            far_from_destination=haversine(
+                routes.lat1, routes.lon1, lat_b, lon_b
+            ).values
+            > endpoint_radius,
+        ),
+        index=routes.index,
+    )
+
+    if "departure" in routes and "arrival" in routes:
+        # GTFS minutes go past 24:00 after midnight, so they never wrap
+        elapsed = routes["arrival"].values - routes["departure"].values
+        flags["times_not_monotonic"] = ~(elapsed >= 0)
+        # time spent on the route can not exceed the time between its ends
+        flags["duration_exceeds_times"] = duration > elapsed + time_tolerance
+
+    if "stop_ids" in routes:
+        flags["missing_stops"] = routes["stop_ids"].map(
+            lambda stops: pd.isna(np.asarray(stops, dtype=object)).any()
+        )
+
+    return flags
+
+
+def validate_routes(
+    routes: pd.DataFrame, mode: str, outdir="data/validation", **kwargs
+):
+    """Split routes into valid ones and outliers, and save a report.
+
+    Outliers are written to {outdir}/{mode}_quarantine.parquet with the
+    names of the failed checks, the report to {outdir}/{mode}_report.json.
+    """
+    if routes.shape[0] == 0:
+        return routes, dict(mode=mode, rows=0, valid=0, quarantined=0, failures={})
+
+    flags = check_routes(routes, mode, **kwargs)
+    failed = flags.any(axis=1).values
+
+    report = dict(
+        mode=mode,
+        rows=int(routes.shape[0]),
+        valid=int((~failed).sum()),
+        quarantined=int(failed.sum()),
+        failures={k: int(v) for k, v in flags.sum().items()},
+    )
+
+    if outdir is not None:
+        os.makedirs(outdir, exist_ok=True)
+
+        quarantine = routes[failed].assign(
+            failed_checks=[
+                ",".join(flags.columns[row]) for row in flags.values[failed]
+            ]
+        )
+        quarantine.to_parquet(f"{outdir}/{mode}_quarantine.parquet", index=False)
+
+        with open(f"{outdir}/{mode}_report.json", "w") as f:
+            json.dump(report, f, indent=2)
+
+    print(
+        f"{mode}: {report['valid']} valid, {report['quarantined']} quarantined",
+        {k: v for k, v in report["failures"].items() if v > 0},
+    )
+
+    return routes[~failed], report
+
+
+# %%
+if __name__ == "__main__":
+    profiler = StageProfiler("validate")
+
+    for mode in ["car", "bus", "train", "multimodal"]:
+        fin = f"data/{mode}_routes.parquet"
+        if not os.path.exists(fin):
+            continue
+
+        with profiler.stage(mode) as s:
+            routes = pd.read_parquet(fin)
+            validate_routes(routes, mode)
+            s.rows = routes.shape[0]
+
+    profiler.save()
@@ -1,10 +1,48 @@
+import os
+import re
+import functools
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
+import matplotlib
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+import cartopy
 import cartopy.crs as ccrs
 import polyline
 
 
+@functools.lru_cache()
+def stock_image():
+    """Background image of ax.stock_img(), read from disk only once."""
+    fname = os.path.join(
+        cartopy.config["repo_data_dir"],
+        "raster",
+        "natural_earth",
+        "50-natural-earth-1-downsampled.png",
+    )
+    return plt.imread(fname)
+
+
+def draw_basemap(ax):
+    ax.imshow(
+        stock_image(),
+        origin="upper",
+        transform=ccrs.PlateCarree(),
+        extent=[-180, 180, -90, 90],
+    )
+    ax.coastlines()
+
+
+def set_route_extent(ax, lonlats, margin=1.0):
+    min_lon, min_lat = np.min(lonlats, axis=0)
+    max_lon, max_lat = np.max(lonlats, axis=0)
+    ax.set_extent(
+        [min_lon - margin, max_lon + margin, min_lat - margin, max_lat + margin],
+        crs=ccrs.PlateCarree(),
+    )
+
+
 def draw_coordinates(coords, margin=1.0):
     fig = plt.figure()
     ax = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
@@ -32,16 +70,10 @@ def draw_coordinates(coords, margin=1.0):
     )
 
     # Add features to the map
-    ax.coastlines()
-    ax.stock_img()
+    draw_basemap(ax)
 
     # Set extent to cover the route with some margin
-    min_lon, max_lon = np.min(lats), np.max(lats)
-    min_lat, max_lat = np.min(lons), np.max(lons)
-    ax.set_extent(
-        [min_lat - margin, max_lat + margin, min_lon - margin, max_lon + margin],
-        crs=ccrs.Geodetic(),
-    )
+    set_route_extent(ax, np.column_stack([lons, lats]), margin)
 
 
 def draw_route(route: pd.Series):
@@ -49,9 +81,136 @@ def draw_route(route: pd.Series):
 
 
 def draw_sample_routes(routes: pd.DataFrame, sample=5):
-    for i, route in (
-        routes.drop_duplicates(["city_origin", "city_destination"])
-        .sample(sample)
-        .iterrows()
+    routes = routes.drop_duplicates(["city_origin", "city_destination"])
+    for coords in routes.coords.sample(sample):
+        draw_coordinates(np.array(polyline.decode(coords)))
+
+
+# Batch rendering, for QA plots of all routes after a rebuild
+
+
+def route_lonlats(routes: pd.DataFrame, column="coords"):
+    """Decoded routes as (lon, lat) arrays, as segments of a LineCollection."""
+    return [
+        np.asarray(polyline.decode(c), dtype=float).reshape(-1, 2)[:, ::-1]
+        for c in routes[column]
+    ]
+
+
+def add_routes(ax, segments, color="blue", linewidth=1, endpoints=True):
+    """Draw many routes with one LineCollection, return the new artists."""
+    artists = [
+        ax.add_collection(
+            LineCollection(
+                segments,
+                colors=color,
+                linewidths=linewidth,
+                transform=ccrs.PlateCarree(),
+            )
+        )
+    ]
+
+    if endpoints:
+        starts = np.array([s[0] for s in segments])
+        ends = np.array([s[-1] for s in segments])
+        for points, color in [(starts, "tab:green"), (ends, "tab:red")]:
+            artists.append(
+                ax.scatter(
+                    points[:, 0],
+                    points[:, 1],
+                    color=color,
+                    s=10,
+                    transform=ccrs.PlateCarree(),
+                    zorder=100,
+                )
+            )
+
+    return artists
+
+
+def draw_routes(routes: pd.DataFrame, ax=None, margin=1.0, column="coords", **kwargs):
+    """All routes on shared axes, with a single basemap."""
+    segments = [s for s in route_lonlats(routes, column) if len(s) > 1]
+
+    if ax is None:
+        fig = plt.figure(figsize=(10, 8))
+        ax = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
+        draw_basemap(ax)
+
+    add_routes(ax, segments, **kwargs)
+    set_route_extent(ax, np.concatenate(segments), margin)
+
+    return ax
+
+
+def draw_route_grid(routes: pd.DataFrame, ncols=4, margin=1.0, column="coords"):
+    """Small multiples, one route per panel."""
+    segments = route_lonlats(routes, column)
+    nrows = -(-len(segments) // ncols)
+
+    fig, axes = plt.subplots(
+        nrows,
+        ncols,
+        figsize=(3 * ncols, 2.5 * nrows),
+        subplot_kw=dict(projection=ccrs.PlateCarree()),
+        squeeze=False,
+    )
+
+    for ax, segment, route in zip(axes.flat, segments, routes.itertuples()):
+        draw_basemap(ax)
+        add_routes(ax, [segment], linewidth=1.5)
+        set_route_extent(ax, segment, margin)
+        ax.set_title(f"{route.city_origin} - {route.city_destination}", fontsize=8)
+
+    for ax in axes.flat[len(segments) :]:
+        ax.set_visible(False)
+
+    return fig
+
+
+# QA images of all routes are only exported by the pipelines when enabled
+qa_images = os.environ.get("COPULA_QA_IMAGES", "0") == "1"
+
+# one figure per worker process, with the basemap drawn once
+_canvas = {}
+
+
+def _init_canvas(figsize=(6, 4)):
+    matplotlib.use("Agg")
+    fig = plt.figure(figsize=figsize)
+    ax = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
+    draw_basemap(ax)
+    _canvas.update(fig=fig, ax=ax)
+
+
+def _render_route(task):
+    fout, segment, margin = task
+    ax = _canvas["ax"]
+
+    artists = add_routes(ax, [segment], linewidth=2)
+    set_route_extent(ax, segment, margin)
+    _canvas["fig"].savefig(fout, dpi=100)
+
+    for artist in artists:
+        artist.remove()
+
+    return fout
+
+
+def export_route_images(
+    routes: pd.DataFrame, outdir, processes=None, margin=1.0, column="coords"
+):
+    """Save a PNG of every route, rendered in parallel worker processes."""
+    os.makedirs(outdir, exist_ok=True)
+
+    tasks = []
+    for i, (segment, route) in enumerate(
+        zip(route_lonlats(routes, column), routes.itertuples())
     ):
-        draw_route(route)
+        if len(segment) < 2:
+            continue
+        name = re.sub(r"\W+", "_", f"{route.city_origin}_{route.city_destination}")
+        tasks.append((os.path.join(outdir, f"{i:06d}_{name}.png"), segment, margin))
+
+    with ProcessPoolExecutor(processes, initializer=_init_canvas) as pool:
+        return list(pool.map(_render_route, tasks, chunksize=16))